@@ -0,0 +1,99 @@
+"""
+Opt-in on-disk cache for deterministic remote metadata lookups.
+
+Set SHAZAM_CACHE=1 to serve repeated Spotify/YouTube lookups from a shelve
+file under SHAZAM_CACHE_DIR (default: .cache) instead of the network.
+"""
+import contextlib
+import functools
+import inspect
+import json
+import logging
+import os
+import shelve
+import threading
+from typing import Callable, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# shelve files are not safe for concurrent use; ingestion looks tracks up from a thread pool
+_lock = threading.Lock()
+
+
+def _cache_enabled() -> bool:
+    return os.getenv('SHAZAM_CACHE', '').lower() in ('1', 'true', 'yes')
+
+
+@contextlib.contextmanager
+def _open_locked(path: str) -> Iterator[shelve.Shelf]:
+    """Open the shelve at path while holding a lock on it across threads and processes.
+
+    The file is shared by every process that uses the cache (playlist workers,
+    pytest-xdist workers), so a thread lock alone is not enough: an flock on a
+    sidecar .lock file serialises the processes too. Without fcntl, each process
+    uses its own file instead.
+    """
+    if fcntl is None:
+        with _lock, shelve.open(f"{path}.{os.getpid()}") as db:
+            yield db
+        return
+    with _lock, open(f"{path}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with shelve.open(path) as db:
+                yield db
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def disk_cached(name: str) -> Callable:
+    """Cache a client method's results on disk, keyed by its arguments.
+
+    The cache is read only when SHAZAM_CACHE is set, so it can be switched on
+    per process (e.g. for test runs) without touching the clients. Exceptions
+    and empty results are never stored, and any error from the cache itself
+    falls back to calling the method.
+
+    Args:
+        name: File name of the shelve database inside the cache directory
+    """
+    def decorator(method: Callable) -> Callable:
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not _cache_enabled():
+                return method(self, *args, **kwargs)
+
+            cache_dir = os.getenv('SHAZAM_CACHE_DIR', '.cache')
+            path = os.path.join(cache_dir, name)
+            # Bind to the signature so f(q, 1) and f(q, max_results=1) share an entry
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = list(bound.arguments.items())[1:]  # drop self
+            key = json.dumps([method.__name__, arguments], default=str)
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with _open_locked(path) as db:
+                    if key in db:
+                        return db[key]
+            except Exception as e:
+                logger.warning(f"Disk cache {path} unavailable, calling {method.__name__} directly: {e}")
+                return method(self, *args, **kwargs)
+
+            result = method(self, *args, **kwargs)
+            if result:
+                try:
+                    with _open_locked(path) as db:
+                        db[key] = result
+                except Exception as e:
+                    logger.warning(f"Could not store {method.__name__} result in disk cache {path}: {e}")
+            return result
+        return wrapper
+    return decorator
@@ -10,6 +10,8 @@ from typing import Dict, Optional, Union
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 
+from .cache import disk_cached
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -45,6 +47,7 @@ class SpotifyClient:
         )
         self.client = spotipy.Spotify(auth_manager=auth_manager)
     
+    @disk_cached('spotify_tracks')
     def get_track_metadata(self, spotify_url: str) -> Dict[str, Union[str, int, float]]:
         """Get metadata for a track from its Spotify URL.
         
@@ -64,6 +67,7 @@ class SpotifyClient:
             - preview_url: URL to a 30-second preview (may be None)
             - external_urls: Dictionary of external URLs
             - images: List of album cover images in various sizes
+            - isrc: International Standard Recording Code (may be None)
         """
         try:
             # Extract track ID from URL if needed
@@ -110,7 +114,8 @@ class SpotifyClient:
                 'preview_url': track.get('preview_url'),
                 'external_urls': track.get('external_urls', {}),
                 'images': album.get('images', []),
-                'spotify_url': track.get('external_urls', {}).get('spotify', '')
+                'spotify_url': track.get('external_urls', {}).get('spotify', ''),
+                'isrc': track.get('external_ids', {}).get('isrc')
             }
             
             return metadata
@@ -10,6 +10,8 @@ import tempfile
 from typing import Dict, Optional, Tuple, List
 import yt_dlp
 
+from .cache import disk_cached
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -29,6 +31,7 @@ class YouTubeClient:
         # Create download directory if it doesn't exist
         os.makedirs(self.download_dir, exist_ok=True)
     
+    @disk_cached('youtube_searches')
     def search_videos(self, query: str, max_results: int = 5) -> List[Dict]:
         """Search for videos on YouTube.
         
@@ -34,6 +34,10 @@ with app.app_context():
         # Run migrations
         from database.migrations.v2_add_task_tracking import migrate
         migrate(str(DB_PATH))
+        from database.migrations.v3_add_isrc import migrate as migrate_isrc
+        migrate_isrc(str(DB_PATH))
+        from database.migrations.v4_add_fingerprint_version import migrate as migrate_fingerprint_version
+        migrate_fingerprint_version(str(DB_PATH))
         app.logger.info("Database migration completed")
         app.extensions['spotify_client'] = SpotifyClient(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET)
         app.extensions['youtube_client'] = YouTubeClient()
@@ -1,11 +1,16 @@
 from re import DEBUG
 import sqlite3
-from typing import List, Tuple, Any, TYPE_CHECKING, Optional
+from typing import List, Tuple, Any, TYPE_CHECKING, Optional, Iterable
+import contextlib
+import itertools
 import json
 import logging
+import threading
+import time
+from collections import OrderedDict
 
 if TYPE_CHECKING:
-    from shazam_core.fingerprinting import Fingerprint # For type hinting
+    from shazam_core.fingerprinting import FingerprintArray # For type hinting
 import os
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Tuple
@@ -13,20 +18,125 @@ from typing import List, Dict, Any, Optional, Tuple
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Connections a forked child inherited from its parent. They are kept alive but
+# never used or closed: closing them in the child would drop the parent's locks.
+_FORK_INHERITED_CONNECTIONS = []
+
+_SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+# Above this many hashes, get_matches_by_hashes joins against a temp table rather
+# than binding an IN list (older SQLite builds cap a statement at 999 variables)
+_MAX_IN_CLAUSE_HASHES = 500
+
+# get_song_by_id keeps up to this many songs per handler. Entries expire after
+# the TTL: ingestion workers and other server processes write through their own
+# handlers, so their updates and deletes become visible here within that time.
+_SONG_CACHE_SIZE = 1024
+_SONG_CACHE_TTL_SECONDS = 60.0
+
+
+class _TransactionConnection:
+    """Stand-in for a thread's connection while DatabaseHandler.transaction() is open.
+
+    Handler methods commit after each call, explicitly or by leaving a
+    ``with conn`` block. Both are no-ops here, so their statements join the
+    enclosing transaction instead.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def commit(self):
+        pass
+
+
 class DatabaseHandler:
-    def __init__(self, db_path: str = 'data/fingerprints.db'):
+    def __init__(self, db_path: str = 'data/fingerprints.db', synchronous: str = 'NORMAL'):
         """Initialize the database handler.
         
         Args:
             db_path: Path to the SQLite database file
+            synchronous: SQLite synchronous mode for every connection. 'OFF' skips
+                fsync entirely and is only safe for throwaway databases.
         """
+        if synchronous.upper() not in _SYNCHRONOUS_MODES:
+            raise ValueError(f"synchronous must be one of {_SYNCHRONOUS_MODES}, got {synchronous!r}")
         self.db_path = db_path
+        self.synchronous = synchronous.upper()
+        self._local = threading.local()
+        # song_id -> (monotonic time cached, song row); most recently used last
+        self._song_cache: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._song_cache_lock = threading.Lock()
         self._ensure_db_directory()
         self._init_db()
     
-    def _get_connection(self):
-        """Create a new database connection."""
-        return sqlite3.connect(self.db_path, timeout=30.0)  # 30-second timeout for locked db
+    def _get_connection(self) -> sqlite3.Connection:
+        """Return this thread's database connection, opening it on first use.
+        
+        sqlite3 connections can't be shared between threads, so each thread
+        (and each forked process) keeps its own for the handler's lifetime
+        instead of reconnecting on every call.
+        """
+        transaction = getattr(self._local, 'transaction', None)
+        if transaction is not None:
+            return transaction
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        if conn is not None:
+            _FORK_INHERITED_CONNECTIONS.append(conn)
+        
+        conn = sqlite3.connect(self.db_path, timeout=30.0)  # 30-second timeout for locked db
+        # Default NORMAL: in WAL mode it only syncs at checkpoints; still crash-safe, far fewer fsyncs
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')  # read the fingerprint index through a 256 MiB map
+        conn.execute('PRAGMA cache_size=-65536')  # 64 MiB page cache (negative = KiB) for index-heavy inserts
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+    
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run the handler calls made inside the block as one transaction.
+
+        Commits once when the block exits, or rolls everything back if it
+        raises. Nested blocks join the outermost one. Applies to the calling
+        thread's connection only.
+        """
+        if getattr(self._local, 'transaction', None) is not None:
+            yield
+            return
+        conn = self._get_connection()
+        conn.execute('BEGIN')
+        self._local.transaction = _TransactionConnection(conn)
+        try:
+            yield
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            self._local.transaction = None
+            # Cached lookups may have seen rows that were just rolled back
+            self._clear_song_cache()
+
+    def close(self):
+        """Close the calling thread's connection, if it has one."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
     
     def _ensure_db_directory(self):
         """Ensure the database directory exists."""
@@ -37,6 +147,8 @@ class DatabaseHandler:
     def _init_db(self):
         """Initialize the database by running schema.sql."""
         with self._get_connection() as conn:
+            # WAL is persistent on the file: readers no longer block the ingest writer
+            conn.execute('PRAGMA journal_mode=WAL')
             with open(os.path.join(os.path.dirname(__file__), 'schema.sql'), 'r') as f:
                 conn.executescript(f.read())
     
@@ -52,6 +164,7 @@ class DatabaseHandler:
         release_date: str = None,
         spotify_url: str = None,
         youtube_id: str = None,
+        isrc: str = None,
     ) -> int:
         # Debug log all parameters being passed to add_song
         logger.debug(f"add_song called with parameters:")
@@ -65,6 +178,7 @@ class DatabaseHandler:
         logger.debug(f"  release_date: {release_date} (type: {type(release_date) if release_date is not None else 'None'})")
         logger.debug(f"  spotify_url: {spotify_url} (type: {type(spotify_url) if spotify_url is not None else 'None'})")
         logger.debug(f"  youtube_id: {youtube_id} (type: {type(youtube_id) if youtube_id is not None else 'None'})")
+        logger.debug(f"  isrc: {isrc} (type: {type(isrc) if isrc is not None else 'None'})")
         """Add a new song to the database.
         
         Args:
@@ -78,6 +192,7 @@ class DatabaseHandler:
             release_date: Release date in YYYY-MM-DD format (optional)
             spotify_url: Spotify URL (optional)
             youtube_id: YouTube URL (optional)
+            isrc: International Standard Recording Code (optional)
             
         Returns:
             int: The ID of the newly inserted song
@@ -101,7 +216,8 @@ class DatabaseHandler:
                     str(cover_url) if cover_url is not None else None,
                     str(release_date) if release_date is not None else None,
                     str(spotify_url) if spotify_url is not None else None,
-                    str(youtube_id) if youtube_id is not None else None
+                    str(youtube_id) if youtube_id is not None else None,
+                    str(isrc) if isrc is not None else None
                 )
                 
                 logger.debug(f"Final parameters tuple: {params}")
@@ -110,8 +226,8 @@ class DatabaseHandler:
                 sql = """
                 INSERT INTO songs (
                     title, artist, album, source_type, source_id, duration_ms,
-                    cover_url, release_date, spotify_url, youtube_id
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    cover_url, release_date, spotify_url, youtube_id, isrc
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ON CONFLICT(source_type, source_id) 
                 DO NOTHING
                 """
@@ -137,7 +253,40 @@ class DatabaseHandler:
             logger.error(f"Parameters: {params}")
             logger.error(f"Parameter types: {tuple(type(p) for p in params) if 'params' in locals() else 'N/A'}")
             return None
-    
+
+    def add_songs_bulk(self, songs: Iterable[Dict[str, Any]]) -> int:
+        """Add many songs in a single transaction.
+
+        Args:
+            songs: Iterable of dicts using the keyword arguments of add_song;
+                title, artist, source_type and source_id are required
+
+        Returns:
+            Number of songs inserted; rows whose (source_type, source_id)
+            already exists are skipped, as in add_song
+        """
+        columns = (
+            'title', 'artist', 'album', 'source_type', 'source_id', 'duration_ms',
+            'cover_url', 'release_date', 'spotify_url', 'youtube_id', 'isrc'
+        )
+        rows = (
+            tuple(song.get(column, '' if column in ('title', 'artist', 'album') else None) for column in columns)
+            for song in songs
+        )
+        with self._get_connection() as conn:
+            before = conn.total_changes
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                f"INSERT INTO songs ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+                "ON CONFLICT(source_type, source_id) DO NOTHING",
+                rows
+            )
+            conn.commit()
+            inserted = conn.total_changes - before
+        logging.info(f"[DB_HANDLER] add_songs_bulk: Added {inserted} songs.")
+        return inserted
+
     def get_song_by_source(self, source_type: str, source_id: str) -> Optional[Dict[str, Any]]:
         """Get a song by its source type and ID.
         
@@ -149,8 +298,8 @@ class DatabaseHandler:
             Song dictionary or None if not found
         """
         with self._get_connection() as conn:
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             cursor.execute(
                 'SELECT * FROM songs WHERE source_type = ? AND source_id = ?',
                 (source_type, source_id)
@@ -158,11 +307,27 @@ class DatabaseHandler:
             row = cursor.fetchone()
             return dict(row) if row else None
 
+    def get_song_by_isrc(self, isrc: str) -> Optional[Dict[str, Any]]:
+        """Get a song by its ISRC, regardless of which source it was ingested from.
+        
+        Args:
+            isrc: International Standard Recording Code
+            
+        Returns:
+            Song dictionary or None if not found
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute('SELECT * FROM songs WHERE isrc = ? LIMIT 1', (isrc,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
     def get_all_songs(self) -> List[Dict[str, Any]]:
         """Get a list of all songs in the database."""
         with self._get_connection() as conn:
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             cursor.execute('SELECT * FROM songs ORDER BY artist, title')
             rows = cursor.fetchall()
             return [dict(row) for row in rows]
@@ -176,30 +341,106 @@ class DatabaseHandler:
             # Then, delete the song
             cursor.execute('DELETE FROM songs WHERE id = ?', (song_id,))
             conn.commit()
+            self._clear_song_cache()
             # Return True if a row was affected (i.e., the song was deleted)
             return cursor.rowcount > 0
     
-    def add_fingerprints(self, song_id: int, fingerprints: List[Tuple[int, int]]) -> None:
+    def add_fingerprints(
+        self,
+        song_id: int,
+        fingerprints: 'FingerprintArray',
+        fingerprint_version: Optional[int] = None
+    ) -> None:
         """Add fingerprints for a song.
         
         Args:
             song_id: ID of the song
-            fingerprints: List of (hash, timestamp) tuples
+            fingerprints: FingerprintArray of hashes and offsets
+            fingerprint_version: FINGERPRINT_VERSION the fingerprints were built with
         """
         logging.info(f"[DB_HANDLER] add_fingerprints: Received {len(fingerprints)} fingerprints to add.")
         if not fingerprints:
             return
 
-        data_to_insert = [(fp.hash, song_id, int(fp.offset)) for fp in fingerprints]
-        if data_to_insert:
-            logging.info(f"[DB_HANDLER] add_fingerprints: First 3 fingerprints to insert for song_id {song_id} [(hash, song_id, offset)]: {data_to_insert[:3]}")
+        self.add_fingerprints_bulk(song_id, [(fingerprints.hash, fingerprints.offset)], fingerprint_version)
+        logging.info(f"[DB_HANDLER] add_fingerprints: Successfully added {len(fingerprints)} fingerprints.")
+
+    def add_fingerprints_bulk(
+        self,
+        song_id: int,
+        chunks: Iterable[Tuple[Any, Any]],
+        fingerprint_version: Optional[int] = None
+    ) -> int:
+        """Add fingerprints for a song from streamed (hashes, offsets) array chunks.
+
+        All chunks are written in a single transaction, so a failure part-way
+        leaves no fingerprints behind for the song.
+
+        Args:
+            song_id: ID of the song
+            chunks: Iterable of (hashes, offsets) numpy array pairs
+            fingerprint_version: FINGERPRINT_VERSION the fingerprints were built
+                with; recorded on the song in the same transaction when given
+
+        Returns:
+            Number of fingerprints inserted
+        """
+        total = 0
         with self._get_connection() as conn:
-            conn.executemany(
-                'INSERT INTO fingerprints (hash, song_id, timestamp) VALUES (?, ?, ?)',
-                data_to_insert
-            )
+            # Take the write lock up front rather than upgrading mid-transaction
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            for hashes, offsets in chunks:
+                conn.executemany(
+                    'INSERT INTO fingerprints (hash, song_id, timestamp) VALUES (?, ?, ?)',
+                    zip(hashes.tolist(), itertools.repeat(song_id), offsets.tolist())
+                )
+                total += len(hashes)
+            if fingerprint_version is not None:
+                conn.execute(
+                    'UPDATE songs SET fingerprint_version = ? WHERE id = ?',
+                    (fingerprint_version, song_id)
+                )
             conn.commit()
-        logging.info(f"[DB_HANDLER] add_fingerprints: Successfully added {len(fingerprints)} fingerprints.")
+        logging.info(f"[DB_HANDLER] add_fingerprints_bulk: Added {total} fingerprints for song_id {song_id}.")
+        return total
+
+    def replace_fingerprints(
+        self,
+        song_id: int,
+        chunks: Iterable[Tuple[Any, Any]],
+        fingerprint_version: int
+    ) -> int:
+        """Swap a song's stored fingerprints for newly generated ones.
+
+        The old fingerprints are deleted and the new ones inserted in one
+        transaction, so the song is never left without fingerprints.
+
+        Args:
+            song_id: ID of the song
+            chunks: Iterable of (hashes, offsets) numpy array pairs
+            fingerprint_version: FINGERPRINT_VERSION the new fingerprints were built with
+
+        Returns:
+            Number of fingerprints inserted
+        """
+        with self.transaction():
+            self._get_connection().execute('DELETE FROM fingerprints WHERE song_id = ?', (song_id,))
+            return self.add_fingerprints_bulk(song_id, chunks, fingerprint_version)
+
+    def get_songs_with_outdated_fingerprints(self, fingerprint_version: int) -> List[Dict[str, Any]]:
+        """Get songs whose fingerprints predate the given FINGERPRINT_VERSION.
+
+        Songs stored before versioning (NULL version) are always included.
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(
+                'SELECT * FROM songs WHERE fingerprint_version IS NULL OR fingerprint_version < ? ORDER BY id',
+                (fingerprint_version,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
 
     def store_fingerprints(self, song_id: int, fingerprints: List[Tuple[int, int]]):
         """Store audio fingerprints for a song.
@@ -222,6 +463,9 @@ class DatabaseHandler:
                 logging.info(f"[DB_HANDLER] store_fingerprints: First {min(3, len(data))} processed fingerprints for song_id {song_id_int}: {data[:3]}")
 
             with self._get_connection() as conn:
+                # One write transaction for the whole batch, like add_fingerprints_bulk
+                if not conn.in_transaction:
+                    conn.execute('BEGIN IMMEDIATE')
                 conn.executemany(
                     'INSERT OR IGNORE INTO fingerprints (hash, song_id, timestamp) VALUES (?, ?, ?)',
                     data
@@ -244,17 +488,23 @@ class DatabaseHandler:
             logging.info("[DB_HANDLER] get_matches_by_hashes: No query hashes received, returning empty list.")
             return []
 
-        # Create a string of placeholders (?, ?, ?, ...)
-        placeholders = ', '.join('?' for _ in hashes)
-        
-        # The query is now much cleaner and safer
-        query = f"SELECT hash, song_id, timestamp FROM fingerprints WHERE hash IN ({placeholders})"
-
         with self._get_connection() as conn:
             try:
                 cursor = conn.cursor()
                 logging.info(f"[DB_HANDLER] get_matches_by_hashes: Executing query for {len(hashes)} hashes. First 3: {hashes[:3] if hashes else 'N/A'}")
-                cursor.execute(query, hashes)
+                if len(hashes) <= _MAX_IN_CLAUSE_HASHES:
+                    placeholders = ', '.join('?' for _ in hashes)
+                    cursor.execute(f"SELECT hash, song_id, timestamp FROM fingerprints WHERE hash IN ({placeholders})", hashes)
+                else:
+                    # Large queries: stage the hashes in a per-connection temp table and
+                    # join, instead of a statement with one bound variable per hash
+                    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS query_hashes (hash INTEGER PRIMARY KEY)')
+                    cursor.execute('DELETE FROM query_hashes')
+                    cursor.executemany('INSERT OR IGNORE INTO query_hashes (hash) VALUES (?)', zip(hashes))
+                    cursor.execute(
+                        'SELECT f.hash, f.song_id, f.timestamp '
+                        'FROM query_hashes q JOIN fingerprints f ON f.hash = q.hash'
+                    )
                 results = cursor.fetchall()
                 logging.info(f"[DB_HANDLER] get_matches_by_hashes: DB query returned {len(results)} rows. First 3: {results[:3] if results else 'N/A'}")
                 return results
@@ -263,15 +513,57 @@ class DatabaseHandler:
                 logging.error(f"[DB_HANDLER] Database query failed for hashes {hashes[:3] if hashes else 'N/A'}...: {e}")
                 return []
     
+    def get_fingerprints_by_song_id(self, song_id: int) -> List[Tuple[int, int, int]]:
+        """Get all fingerprints stored for a song.
+        
+        Args:
+            song_id: ID of the song
+            
+        Returns:
+            List of (hash, timestamp, song_id) tuples
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT hash, timestamp, song_id FROM fingerprints WHERE song_id = ? ORDER BY timestamp',
+                (song_id,)
+            )
+            return cursor.fetchall()
+    
     def get_song_by_id(self, song_id: int) -> Optional[Dict[str, Any]]:
         """Get song metadata by ID.
         
+        Found songs are cached per handler for up to _SONG_CACHE_TTL_SECONDS; a
+        small set of popular songs accounts for most matches, so repeat hits
+        skip the SELECT. Misses are not cached, so newly added songs show up at
+        once. Changes made through another handler or process can take up to
+        the TTL to be seen.
+        
         Args:
             song_id: ID of the song
             
         Returns:
             Dictionary with song metadata or None if not found
         """
+        now = time.monotonic()
+        with self._song_cache_lock:
+            entry = self._song_cache.get(song_id)
+            if entry is not None and now - entry[0] < _SONG_CACHE_TTL_SECONDS:
+                self._song_cache.move_to_end(song_id)
+                # Hand out a copy so callers can't mutate the cached entry
+                return dict(entry[1])
+        
+        song = self._fetch_song_by_id(song_id)
+        if song is None:
+            return None
+        with self._song_cache_lock:
+            self._song_cache[song_id] = (now, song)
+            self._song_cache.move_to_end(song_id)
+            if len(self._song_cache) > _SONG_CACHE_SIZE:
+                self._song_cache.popitem(last=False)
+        return dict(song)
+
+    def _fetch_song_by_id(self, song_id: int) -> Optional[Dict[str, Any]]:
         with self._get_connection() as conn:
             logger.debug(f"Executing SELECT by ID with parameter: {song_id} (type: {type(song_id)})")
             cursor = conn.execute(
@@ -289,6 +581,11 @@ class DatabaseHandler:
                 }
             return None
 
+    def _clear_song_cache(self):
+        """Forget every song cached by get_song_by_id on this handler."""
+        with self._song_cache_lock:
+            self._song_cache.clear()
+
     def get_song_by_spotify_url(self, spotify_url: str) -> Optional[Dict[str, Any]]:
         """Get a song by its Spotify URL.
         
@@ -299,9 +596,9 @@ class DatabaseHandler:
             Song dictionary or None if not found
         """
         with self._get_connection() as conn:
-            conn.row_factory = sqlite3.Row
             logger.debug(f"Executing SELECT by Spotify URL with parameter: {spotify_url} (type: {type(spotify_url)})")
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             cursor.execute(
                 'SELECT * FROM songs WHERE spotify_url = ?',
                 (spotify_url,)
@@ -348,8 +645,8 @@ class DatabaseHandler:
     def get_task(self, task_id):
         """Get task by task_id."""
         with self._get_connection() as conn:
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             cursor.execute(
                 """
                 SELECT 
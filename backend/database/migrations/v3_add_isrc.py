@@ -0,0 +1,27 @@
+"""Migration to add an ISRC column to songs for cross-source duplicate detection."""
+import sqlite3
+
+def migrate(db_path):
+    """Run the migration"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    # Add the isrc column if this database predates it
+    cursor.execute("PRAGMA table_info(songs)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if 'isrc' not in columns:
+        cursor.execute("ALTER TABLE songs ADD COLUMN isrc TEXT")
+    
+    # Create index
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_songs_isrc ON songs(isrc)")
+    
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 2:
+        print("Usage: python v3_add_isrc.py <db_path>")
+        sys.exit(1)
+    
+    migrate(sys.argv[1])
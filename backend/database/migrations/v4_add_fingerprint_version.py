@@ -0,0 +1,48 @@
+"""Migration to record which fingerprint pipeline version built each song's fingerprints.
+
+Songs stored before this column existed read as NULL (version 1: the old
+pydub decoder). Run with --refingerprint to re-download those songs and
+replace their fingerprints with ones from the current pipeline.
+"""
+import os
+import sqlite3
+import sys
+
+def migrate(db_path):
+    """Run the migration"""
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    
+    # Add the fingerprint_version column if this database predates it
+    cursor.execute("PRAGMA table_info(songs)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if 'fingerprint_version' not in columns:
+        cursor.execute("ALTER TABLE songs ADD COLUMN fingerprint_version INTEGER")
+    
+    conn.commit()
+    conn.close()
+
+def refingerprint(db_path):
+    """Re-fingerprint every song whose fingerprints predate FINGERPRINT_VERSION."""
+    # Backend modules import each other as top-level packages
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+    from database.db_handler import DatabaseHandler
+    from api_clients.youtube_client import YouTubeClient
+    from services.song_ingester import SongIngester
+
+    # Re-fingerprinting only re-downloads from YouTube; no Spotify client needed
+    ingester = SongIngester(DatabaseHandler(db_path), None, YouTubeClient())
+    results = ingester.refingerprint_outdated()
+    failed = [r for r in results if not r['success']]
+    print(f"Re-fingerprinted {len(results) - len(failed)} of {len(results)} songs")
+    for result in failed:
+        print(f"  song {result['song_id']}: {result['error']}")
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3) or (len(sys.argv) == 3 and sys.argv[2] != '--refingerprint'):
+        print("Usage: python v4_add_fingerprint_version.py <db_path> [--refingerprint]")
+        sys.exit(1)
+    
+    migrate(sys.argv[1])
+    if len(sys.argv) == 3:
+        refingerprint(sys.argv[1])
@@ -12,6 +12,8 @@ CREATE TABLE IF NOT EXISTS songs (
     spotify_url TEXT,           -- Spotify URL if available
     youtube_url TEXT,            -- YouTube URL if available
     youtube_id TEXT,
+    isrc TEXT,                  -- International Standard Recording Code, if known
+    fingerprint_version INTEGER, -- shazam_core FINGERPRINT_VERSION of the stored fingerprints (NULL = 1)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(source_type, source_id)  -- Prevent duplicate entries from same source
 );
@@ -9,7 +9,7 @@ import logging
 from api_clients.spotify_client import SpotifyClient
 from api_clients.youtube_client import YouTubeClient
 from dotenv import load_dotenv
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
 
 load_dotenv()
 
@@ -17,9 +17,31 @@ logger = logging.getLogger(__name__)
 
 songs_bp = Blueprint('songs', __name__, url_prefix='/api')
 
-# Initialize a ProcessPoolExecutor for parallel playlist track ingestion.
+fingerprinter = Fingerprinter()
+
+# Initialize a ProcessPoolExecutor for background track and playlist imports.
 # This is defined globally as it doesn't depend on app state and can be shared.
-playlist_executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+# It is kept narrow because each task fans out over its own share of the cores:
+# at most this many imports run at once, and later ones queue.
+_PLAYLIST_POOL_SIZE = min(4, os.cpu_count() or 1)
+playlist_executor = ProcessPoolExecutor(max_workers=_PLAYLIST_POOL_SIZE)
+
+# Cores each playlist_executor task may use (fingerprint processes for a playlist,
+# FFT threads for a single track), so busy imports stay near cpu_count in total
+# while a lone playlist import on an idle machine still uses most of the cores.
+_FINGERPRINT_WORKERS_PER_PLAYLIST = max(1, (os.cpu_count() or 1) // _PLAYLIST_POOL_SIZE)
+
+# Per-process DatabaseHandler used by the background task helpers below.
+# Each worker opens it once on first use rather than once per task.
+_DB: Optional[DatabaseHandler] = None
+
+
+def _worker_db(db_path: str) -> DatabaseHandler:
+    """Return this process's DatabaseHandler, creating it on first use."""
+    global _DB
+    if _DB is None or _DB.db_path != db_path:
+        _DB = DatabaseHandler(db_path=db_path)
+    return _DB
 
 
 @songs_bp.route('/songs', methods=['POST'])
@@ -90,7 +112,7 @@ def add_from_spotify():
 
 def _process_single_track_async(spotify_url, task_id, db_path, spotify_client_id, spotify_client_secret):
     """Process single track in background and update task status."""
-    db_handler_process = DatabaseHandler(db_path=db_path)
+    db_handler_process = _worker_db(db_path)
     try:
         result = _ingest_track_safely(
             spotify_url,
@@ -112,13 +134,15 @@ def _ingest_track_safely(spotify_url: str, db_path: str, spotify_client_id: Opti
     # Initialize dependencies within the process
     current_spotify_client = SpotifyClient(client_id=spotify_client_id, client_secret=spotify_client_secret)
     current_youtube_client = YouTubeClient()
-    current_db_handler = DatabaseHandler(db_path=db_path)
+    current_db_handler = _worker_db(db_path)
 
     current_song_ingester = SongIngester(
         db_handler=current_db_handler,
         spotify_client=current_spotify_client,
         youtube_client=current_youtube_client
     )
+    # Limit this task's FFTs to its share of the cores
+    current_song_ingester.fingerprinter.fft_workers = _FINGERPRINT_WORKERS_PER_PLAYLIST
 
     try:
         existing_song = current_db_handler.get_song_by_spotify_url(spotify_url)
@@ -149,23 +173,22 @@ def _ingest_track_safely(spotify_url: str, db_path: str, spotify_client_id: Opti
 
 def _process_playlist_async(task_id, tracks, db_path, spotify_client_id, spotify_client_secret):
     """Actual playlist processing running in background."""
-    db_handler_process = DatabaseHandler(db_path=db_path)
+    db_handler_process = _worker_db(db_path)
     try:
-        futures = [
-            playlist_executor.submit(
-                _ingest_track_safely,
-                track['spotify_url'],
-                db_path,
-                spotify_client_id,
-                spotify_client_secret
-            ) for track in tracks
-        ]
-        
-        results = []
-        for i, future in enumerate(as_completed(futures)):
-            results.append(future.result())
-            # Update progress after each track is processed
-            db_handler_process.update_task_progress(task_id, processed_items=i + 1)
+        # Downloads overlap on threads while fingerprinting runs in a small process pool
+        song_ingester = SongIngester(
+            db_handler=db_handler_process,
+            spotify_client=SpotifyClient(client_id=spotify_client_id, client_secret=spotify_client_secret),
+            youtube_client=YouTubeClient()
+        )
+        spotify_urls = [track['spotify_url'] for track in tracks]
+        results = song_ingester.ingest_batch(
+            spotify_urls,
+            max_fingerprint_workers=_FINGERPRINT_WORKERS_PER_PLAYLIST,
+            progress_callback=lambda done: db_handler_process.update_task_progress(task_id, processed_items=done)
+        )
+        for spotify_url, result in zip(spotify_urls, results):
+            result['spotify_url'] = spotify_url
         
         success_count = sum(1 for r in results if r.get('success'))
         db_handler_process.complete_task(task_id, {
@@ -197,27 +220,13 @@ def delete_song_by_id(song_id):
         return jsonify({"success": False, "error": "Song not found."}), 404
 
 
-def _save_live_audio_file(audio_file):
-    """Saves the uploaded audio file to a temporary location and returns the path."""
-    temp_dir_base = os.path.join(current_app.root_path, '..', 'temp_downloads')
-    live_recordings_dir = os.path.join(temp_dir_base, 'live_recordings')
-    os.makedirs(live_recordings_dir, exist_ok=True)
-
-    temp_filename = f"{uuid.uuid4()}.wav"
-    temp_filepath = os.path.join(live_recordings_dir, temp_filename)
-    audio_file.save(temp_filepath)
-    logger.info(f"Saved live audio to temporary file: {temp_filepath}")
-    return temp_filepath
-
-
-def _perform_audio_match(filepath):
-    """Matches the audio file against the database and returns results."""
+def _perform_audio_match_stream(stream):
+    """Matches audio read straight from the upload stream and returns results."""
     db_handler = current_app.extensions['db_handler']
-    fingerprinter_instance = Fingerprinter()
-    matcher = FingerprintMatcher(db_handler=db_handler, fingerprinter_instance=fingerprinter_instance)
+    matcher = FingerprintMatcher(db_handler=db_handler, fingerprinter_instance=fingerprinter)
     
-    logger.info(f"Attempting to match audio file: {filepath}")
-    return matcher.match_file(filepath)
+    logger.info("Attempting to match uploaded audio stream")
+    return matcher.match_file_like(stream)
 
 
 @songs_bp.route('/match_live_audio', methods=['POST'])
@@ -230,10 +239,8 @@ def match_live_audio():
     if audio_file.filename == '':
         return jsonify({"success": False, "error": "No selected file"}), 400
 
-    temp_filepath = None
     try:
-        temp_filepath = _save_live_audio_file(audio_file)
-        match_results = _perform_audio_match(temp_filepath)
+        match_results = _perform_audio_match_stream(audio_file.stream)
 
         if not match_results:
             logger.info("No match found for the live audio.")
@@ -267,13 +274,6 @@ def match_live_audio():
     except Exception as e:
         logger.error(f"Error in match_live_audio: {e}", exc_info=True)
         return jsonify({"success": False, "error": "Internal server error during matching"}), 500
-    finally:
-        if temp_filepath and os.path.exists(temp_filepath):
-            try:
-                os.remove(temp_filepath)
-                logger.info(f"Cleaned up temporary file: {temp_filepath}")
-            except Exception as e:
-                logger.error(f"Error cleaning up temporary file {temp_filepath}: {e}")
 
 
 @songs_bp.route('/tasks/cleanup', methods=['POST'])
@@ -7,14 +7,25 @@ from flask import Blueprint
 from shazam_core.fingerprinting import Fingerprinter, FingerprintMatcher
 from shazam_core.audio_utils import load_audio
 from database.db_handler import DatabaseHandler
-import json
 import logging
 
+import orjson
+
 logger = logging.getLogger(__name__)
 
 fingerprinter = Fingerprinter()
 from flask import current_app
 
+# Text message a client may send after its audio so /identify starts matching
+# right away instead of waiting out the receive timeout
+END_OF_AUDIO = "end"
+
+
+def _dumps(payload):
+    """Serialize a message with orjson, returned as str so it goes out as a text frame."""
+    return orjson.dumps(payload).decode()
+
+
 def register_websockets(sock):
     """Register all WebSocket routes with the provided sock instance"""
     db_handler = current_app.extensions['db_handler']
@@ -28,14 +39,14 @@ def register_websockets(sock):
                 return ws.close(code=1008, reason='Task not found')
                 
             # Send initial state
-            ws.send(json.dumps({
+            ws.send(_dumps({
                 'type': 'initial',
                 'task': task
             }))
             
             # If completed, send final message and close
             if task['status'] == 'completed':
-                ws.send(json.dumps({
+                ws.send(_dumps({
                     'type': 'complete', 
                     'task': task
                 }))
@@ -46,7 +57,7 @@ def register_websockets(sock):
             while task and task['status'] not in ('completed', 'failed'):
                 task = db_handler.get_task(task_id)
                 if task and task['processed_items'] != last_progress:
-                    ws.send(json.dumps({
+                    ws.send(_dumps({
                         "type": "progress",
                         "processed": task['processed_items'],
                         "total": task['total_items']
@@ -55,16 +66,16 @@ def register_websockets(sock):
                 
             # Final status
             if task:
-                ws.send(json.dumps({
+                ws.send(_dumps({
                     "type": "complete",
                     "status": task['status'],
-                    "result": json.loads(task['result_json']) if task['result_json'] else None
+                    "result": orjson.loads(task['result_json']) if task['result_json'] else None
                 }))
                 
         except Exception as e:
             logger.error(f"WebSocket error: {str(e)}", exc_info=True)
             try:
-                ws.send(json.dumps({'type': 'error', 'message': str(e)}))
+                ws.send(_dumps({'type': 'error', 'message': str(e)}))
             except:
                 pass
             return ws.close()
@@ -80,7 +91,7 @@ def register_websockets(sock):
         while True:
             try:
                 data = ws.receive(timeout=5)
-                if data is None:
+                if data is None or data == END_OF_AUDIO:
                     break
                 audio_buffer.extend(data)
             except Exception:
@@ -115,7 +126,7 @@ def register_websockets(sock):
             matches = matcher.match_fingerprints(query_fingerprints)
 
             if not matches:
-                ws.send(json.dumps({"status": "no_match"}))
+                ws.send(_dumps({"status": "no_match"}))
                 logger.info("No match found.")
                 return
 
@@ -136,14 +147,14 @@ def register_websockets(sock):
                         "timestamp": best_match['offset_seconds']
                     }
                 }
-                ws.send(json.dumps(response_data))
+                ws.send(_dumps(response_data))
                 logger.info(f"Match found: {song.get('title')} by {song.get('artist')}")
             else:
-                ws.send(json.dumps({"status": "no_match"}))
+                ws.send(_dumps({"status": "no_match"}))
 
         except Exception as e:
             logger.error(f"Error during matching process: {e}", exc_info=True)
-            ws.send(json.dumps({"status": "error", "message": "Failed to process audio."}))
+            ws.send(_dumps({"status": "error", "message": "Failed to process audio."}))
         finally:
             # Step 6: Clean up the temporary file
             if temp_file_path and os.path.exists(temp_file_path):
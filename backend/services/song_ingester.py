@@ -4,20 +4,43 @@ Song ingestion service.
 This module provides functionality to ingest songs from various sources
 (YouTube, Spotify, etc.) into the database.
 """
+import itertools
 import logging
 import tempfile
 import os
 import re
-from typing import Dict, Optional, List, Tuple, Any
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, Optional, List, Tuple, Union
+
+import numpy as np
 
 from database.db_handler import DatabaseHandler # For type hinting
 from shazam_core.audio_utils import load_audio
-from shazam_core.fingerprinting import Fingerprinter
+from shazam_core.fingerprinting import FINGERPRINT_VERSION, Fingerprinter
 from api_clients.spotify_client import SpotifyClient
 from api_clients.youtube_client import YouTubeClient
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+
+# Matches the video ID in youtube.com/watch?v=ID, /embed/ID, /v/ID, /e/ID and youtu.be/ID URLs
+_YT_ID_RE = re.compile(r'(?:v=|youtu\.be\/|\/v\/|\/e\/|embed\/|\?v=|\&v=)([^#\&\?]*)')
+
+
+@dataclass
+class DownloadedTrack:
+    """A Spotify track whose audio has been downloaded and is ready to fingerprint."""
+    metadata: Dict[str, Any]
+    youtube_id: str
+    file_path: str
+
+
+def _fingerprint_file(fingerprinter: Fingerprinter, file_path: str) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Decode and fingerprint one file; runs in an ingest_batch worker process."""
+    # The pool already runs one file per core; keep each worker's FFTs single-threaded
+    fingerprinter.fft_workers = 1
+    audio_data, _ = load_audio(file_path, target_sample_rate=fingerprinter.sample_rate)
+    return list(fingerprinter.generate_fingerprint_arrays(audio_data))
 
 
 class SongIngester:
@@ -52,88 +75,196 @@ class SongIngester:
             Dictionary with song information and status
         """
         try:
-            spotify_metadata = self.spotify.get_track_metadata(spotify_url)
-            if not spotify_metadata:
-                return {'success': False, 'error': 'Could not fetch track from Spotify'}
+            track = self._download_spotify_track(spotify_url)
+            if not isinstance(track, DownloadedTrack):
+                return track
 
-            existing = self.db.get_song_by_source('spotify', spotify_metadata['id'])
-            if existing:
-                return {'success': True, 'song_id': existing['id'], 'status': 'already_exists'}
+            try:
+                audio_data, _ = load_audio(track.file_path, target_sample_rate=self.fingerprinter.sample_rate)
+                fingerprint_chunks = self.fingerprinter.generate_fingerprint_arrays(audio_data)
+                return self._store_spotify_track(track, fingerprint_chunks)
+            finally:
+                if track.file_path and os.path.exists(track.file_path):
+                    os.remove(track.file_path)
 
-            query = f"{spotify_metadata['artist']} - {spotify_metadata['title']} official audio"
-            yt_results = self.youtube.search_videos(query, max_results=1)
+        except Exception as e:
+            logger.error(f"Error ingesting from Spotify: {str(e)}", exc_info=True)
+            return {'success': False, 'error': str(e)}
 
-            if not yt_results:
-                return {'success': False, 'error': f"No matching YouTube video found for query: '{query}'"}
-            
-            yt_video_id = yt_results[0]['id']
+    def ingest_batch(
+        self,
+        spotify_urls: List[str],
+        max_download_workers: int = 8,
+        max_fingerprint_workers: Optional[int] = None,
+        progress_callback: Optional[Callable[[int], None]] = None
+    ) -> List[Dict[str, Any]]:
+        """Ingest many Spotify tracks, overlapping downloads with fingerprinting.
 
-            file_path, _ = self.youtube.download_audio(yt_video_id)
-            if not file_path or not os.path.exists(file_path):
-                return {'success': False, 'error': 'Failed to download audio from YouTube'}
+        Metadata lookups and downloads run on a thread pool, decoding and
+        fingerprinting on a process pool, and all database writes happen in
+        the calling thread. At most one task per worker is kept in flight, so
+        downloaded files cannot pile up ahead of the fingerprinting stage.
 
-            try:
-                # --- CORRECTED BLOCK ---
-                audio_data, _ = load_audio(file_path, target_sample_rate=self.fingerprinter.sample_rate)
-                fingerprints = self.fingerprinter.generate_fingerprints(audio_data)
+        Args:
+            spotify_urls: Spotify track URLs or IDs
+            max_download_workers: Threads used for metadata lookups and downloads
+            max_fingerprint_workers: Processes used for fingerprinting (default: CPU count)
+            progress_callback: Called with the number of finished tracks after each one completes
 
-                if not fingerprints:
-                    return {'success': False, 'error': 'Failed to generate fingerprints'}
-                
-                # Log all parameters before passing to db.add_song()
-                logger.debug('Parameters for db.add_song():')
-                logger.debug(f"title: {spotify_metadata.get('title')} (type: {type(spotify_metadata.get('title'))})")
-                logger.debug(f"artist: {spotify_metadata.get('artist')} (type: {type(spotify_metadata.get('artist'))})")
-                logger.debug(f"album: {spotify_metadata.get('album')} (type: {type(spotify_metadata.get('album'))})")
-                logger.debug(f"source_id: {spotify_metadata.get('id')} (type: {type(spotify_metadata.get('id'))})")
-                logger.debug(f"duration_ms: {spotify_metadata.get('duration_ms')} (type: {type(spotify_metadata.get('duration_ms'))})")
-                logger.debug(f"cover_url: {self._get_best_cover_url(spotify_metadata.get('images', []))} (type: {type(self._get_best_cover_url(spotify_metadata.get('images', [])))})")
-                logger.debug(f"release_date: {spotify_metadata.get('release_date')} (type: {type(spotify_metadata.get('release_date'))})")
-                logger.debug(f"spotify_url: {spotify_metadata.get('spotify_url')} (type: {type(spotify_metadata.get('spotify_url'))})")
-                logger.debug(f"youtube_id: {yt_video_id} (type: {type(yt_video_id)})")
-                
-                # Add song to DB, now including the youtube_id
-                song_id = self.db.add_song(
-                    title=str(spotify_metadata['title']) if spotify_metadata.get('title') else '',
-                    artist=str(spotify_metadata['artist']) if spotify_metadata.get('artist') else '',
-                    album=str(spotify_metadata.get('album', '')),
-                    source_type='spotify',
-                    source_id=str(spotify_metadata['id']),
-                    duration_ms=int(spotify_metadata.get('duration_ms', 0)) if spotify_metadata.get('duration_ms') else None,
-                    cover_url=str(self._get_best_cover_url(spotify_metadata.get('images', []))),
-                    release_date=str(spotify_metadata.get('release_date', '')) if spotify_metadata.get('release_date') else None,
-                    spotify_url=str(spotify_metadata.get('spotify_url', '')),
-                    youtube_id=str(yt_video_id)
-                )
+        Returns:
+            One result dictionary per URL, in input order
+        """
+        max_fingerprint_workers = max_fingerprint_workers or os.cpu_count() or 1
+        max_in_flight = max_download_workers + max_fingerprint_workers
+        results: List[Optional[Dict[str, Any]]] = [None] * len(spotify_urls)
+        pending_urls = iter(enumerate(spotify_urls))
+        in_flight: Dict[Future, Tuple[int, Optional[DownloadedTrack]]] = {}
+        completed = 0
 
-                if song_id is None:
-                    return {'success': False, 'error': 'Failed to add song to the database.'}
+        with ThreadPoolExecutor(max_workers=max_download_workers) as download_pool, \
+                ProcessPoolExecutor(max_workers=max_fingerprint_workers) as fingerprint_pool:
 
-                # Update fingerprints with the correct song_id and store them
-                for fp in fingerprints:
-                    fp.song_id = song_id
-                self.db.add_fingerprints(song_id, fingerprints)
-                # --- END OF CORRECTED BLOCK ---
+            def submit_downloads():
+                while len(in_flight) < max_in_flight:
+                    try:
+                        index, url = next(pending_urls)
+                    except StopIteration:
+                        return
+                    in_flight[download_pool.submit(self._download_spotify_track, url)] = (index, None)
 
-                return {
-                    'success': True,
-                    'song_id': song_id,
-                    'title': spotify_metadata['title'],
-                    'artist': spotify_metadata['artist'],
-                    'status': 'added'
-                }
-            finally:
-                if file_path and os.path.exists(file_path):
-                    os.remove(file_path)
+            submit_downloads()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, track = in_flight.pop(future)
+                    try:
+                        if track is None:
+                            # Download stage finished: hand the file to the fingerprint pool
+                            downloaded = future.result()
+                            if isinstance(downloaded, DownloadedTrack):
+                                in_flight[fingerprint_pool.submit(_fingerprint_file, self.fingerprinter, downloaded.file_path)] = (index, downloaded)
+                            else:
+                                results[index] = downloaded
+                        else:
+                            # Writes are serialized here, so this catches a track that
+                            # appeared twice in the batch and was stored meanwhile
+                            existing = self._find_existing_song(track.metadata)
+                            if existing:
+                                results[index] = {'success': True, 'song_id': existing['id'], 'status': 'already_exists'}
+                            else:
+                                results[index] = self._store_spotify_track(track, iter(future.result()))
+                    except Exception as e:
+                        logger.error(f"Error ingesting {spotify_urls[index]} from Spotify: {str(e)}", exc_info=True)
+                        results[index] = {'success': False, 'error': str(e)}
+                    finally:
+                        if track is not None and os.path.exists(track.file_path):
+                            os.remove(track.file_path)
+                    if results[index] is not None:
+                        completed += 1
+                        if progress_callback:
+                            progress_callback(completed)
+                submit_downloads()
 
-        except Exception as e:
-            logger.error(f"Error ingesting from Spotify: {str(e)}", exc_info=True)
-            return {'success': False, 'error': str(e)}
+        return results
+
+    def _download_spotify_track(self, spotify_url: str) -> Union[DownloadedTrack, Dict[str, Any]]:
+        """Resolve a Spotify track to downloaded YouTube audio.
+
+        Returns:
+            DownloadedTrack on success, otherwise the final result dictionary
+            (already in the database, or the step that failed)
+        """
+        spotify_metadata = self.spotify.get_track_metadata(spotify_url)
+        if not spotify_metadata:
+            return {'success': False, 'error': 'Could not fetch track from Spotify'}
+
+        existing = self._find_existing_song(spotify_metadata)
+        if existing:
+            return {'success': True, 'song_id': existing['id'], 'status': 'already_exists'}
+
+        query = f"{spotify_metadata['artist']} - {spotify_metadata['title']} official audio"
+        yt_results = self.youtube.search_videos(query, max_results=1)
+
+        if not yt_results:
+            return {'success': False, 'error': f"No matching YouTube video found for query: '{query}'"}
+        
+        yt_video_id = yt_results[0]['id']
+        file_path, _ = self.youtube.download_audio(yt_video_id)
+        if not file_path or not os.path.exists(file_path):
+            return {'success': False, 'error': 'Failed to download audio from YouTube'}
+
+        return DownloadedTrack(metadata=spotify_metadata, youtube_id=yt_video_id, file_path=file_path)
+
+    def _find_existing_song(self, spotify_metadata: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Find a stored song for this track, by Spotify ID or, failing that, by ISRC.
+
+        The ISRC catches the same recording ingested under another source or
+        Spotify ID, before anything is downloaded.
+        """
+        existing = self.db.get_song_by_source('spotify', spotify_metadata['id'])
+        if not existing and spotify_metadata.get('isrc'):
+            existing = self.db.get_song_by_isrc(spotify_metadata['isrc'])
+        return existing
+
+    def _store_spotify_track(self, track: DownloadedTrack, fingerprint_chunks: Iterator[Tuple[np.ndarray, np.ndarray]]) -> Dict[str, Any]:
+        """Add a downloaded track and its streamed fingerprint chunks to the database."""
+        spotify_metadata = track.metadata
+        yt_video_id = track.youtube_id
+        first_chunk = next(fingerprint_chunks, None)
+
+        if first_chunk is None:
+            return {'success': False, 'error': 'Failed to generate fingerprints'}
+
+        cover_url = self._get_best_cover_url(spotify_metadata.get('images', []))
+        
+        # Log all parameters before passing to db.add_song(); skipped entirely unless DEBUG is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Parameters for db.add_song():')
+            for name, value in (
+                ('title', spotify_metadata.get('title')),
+                ('artist', spotify_metadata.get('artist')),
+                ('album', spotify_metadata.get('album')),
+                ('source_id', spotify_metadata.get('id')),
+                ('duration_ms', spotify_metadata.get('duration_ms')),
+                ('cover_url', cover_url),
+                ('release_date', spotify_metadata.get('release_date')),
+                ('spotify_url', spotify_metadata.get('spotify_url')),
+                ('youtube_id', yt_video_id),
+                ('isrc', spotify_metadata.get('isrc')),
+            ):
+                logger.debug("%s: %s (type: %s)", name, value, type(value))
+
+        # Add song to DB, now including the youtube_id
+        song_id = self.db.add_song(
+            title=str(spotify_metadata['title']) if spotify_metadata.get('title') else '',
+            artist=str(spotify_metadata['artist']) if spotify_metadata.get('artist') else '',
+            album=str(spotify_metadata.get('album', '')),
+            source_type='spotify',
+            source_id=str(spotify_metadata['id']),
+            duration_ms=int(spotify_metadata.get('duration_ms', 0)) if spotify_metadata.get('duration_ms') else None,
+            cover_url=str(cover_url),
+            release_date=str(spotify_metadata.get('release_date', '')) if spotify_metadata.get('release_date') else None,
+            spotify_url=str(spotify_metadata.get('spotify_url', '')),
+            youtube_id=str(yt_video_id),
+            isrc=spotify_metadata.get('isrc')
+        )
+
+        if song_id is None:
+            return {'success': False, 'error': 'Failed to add song to the database.'}
+
+        # Stream the fingerprint chunks straight into the database
+        self.db.add_fingerprints_bulk(
+            song_id, itertools.chain([first_chunk], fingerprint_chunks), fingerprint_version=FINGERPRINT_VERSION
+        )
+
+        return {
+            'success': True,
+            'song_id': song_id,
+            'title': spotify_metadata['title'],
+            'artist': spotify_metadata['artist'],
+            'status': 'added'
+        }
 
-    def _get_best_cover_url(self, images: list) -> str:
-        """Get the best quality cover image URL from a list of images."""
-        return images[0]['url'] if images else ''
-    
     def ingest_from_youtube(self, youtube_url: str) -> Dict[str, Any]:
         """Ingest a song from YouTube.
         
@@ -186,7 +317,7 @@ class SongIngester:
                 )
                 
                 # Store fingerprints
-                self.db.add_fingerprints(song_id, fingerprints)
+                self.db.add_fingerprints(song_id, fingerprints, fingerprint_version=FINGERPRINT_VERSION)
                 
                 return {
                     'success': True,
@@ -207,24 +338,67 @@ class SongIngester:
             logger.error(f"Error ingesting from YouTube: {str(e)}", exc_info=True)
             return {'success': False, 'error': str(e)}
     
+    def refingerprint_song(self, song: Dict[str, Any]) -> Dict[str, Any]:
+        """Re-download a stored song and replace its fingerprints with current ones.
+
+        Needed after a FINGERPRINT_VERSION bump: fingerprints built by an older
+        decode/fingerprint pipeline only partly match new queries.
+
+        Args:
+            song: Song row from the database (needs 'id' and a YouTube ID)
+
+        Returns:
+            Dictionary with the song ID and status
+        """
+        youtube_id = song.get('youtube_id') or (song['source_id'] if song.get('source_type') == 'youtube' else None)
+        if not youtube_id:
+            return {'success': False, 'song_id': song['id'], 'error': 'No YouTube source to re-download'}
+
+        try:
+            file_path, _ = self.youtube.download_audio(youtube_id)
+            if not file_path or not os.path.exists(file_path):
+                return {'success': False, 'song_id': song['id'], 'error': 'Failed to download audio from YouTube'}
+
+            try:
+                audio_data, _ = load_audio(file_path, target_sample_rate=self.fingerprinter.sample_rate)
+                chunks = self.fingerprinter.generate_fingerprint_arrays(audio_data)
+                # Keep the old fingerprints if no new ones come out
+                first_chunk = next(chunks, None)
+                if first_chunk is None:
+                    return {'success': False, 'song_id': song['id'], 'error': 'Failed to generate fingerprints'}
+                self.db.replace_fingerprints(song['id'], itertools.chain([first_chunk], chunks), FINGERPRINT_VERSION)
+            finally:
+                os.remove(file_path)
+        except Exception as e:
+            logger.error(f"Error re-fingerprinting song {song['id']}: {str(e)}", exc_info=True)
+            return {'success': False, 'song_id': song['id'], 'error': str(e)}
+
+        return {'success': True, 'song_id': song['id'], 'status': 'refingerprinted'}
+
+    def refingerprint_outdated(self) -> List[Dict[str, Any]]:
+        """Re-fingerprint every song stored with an older FINGERPRINT_VERSION.
+
+        Returns:
+            One result dictionary per outdated song, as from refingerprint_song
+        """
+        songs = self.db.get_songs_with_outdated_fingerprints(FINGERPRINT_VERSION)
+        logger.info(f"Re-fingerprinting {len(songs)} songs to fingerprint version {FINGERPRINT_VERSION}")
+        return [self.refingerprint_song(song) for song in songs]
+
     def _get_best_cover_url(self, images: List[Dict[str, Any]]) -> str:
         """Get the best quality cover image URL from a list of images."""
         if not images:
             return ''
-        # Sort by size (width * height), descending
-        sorted_images = sorted(
-            images,
-            key=lambda x: x.get('width', 0) * x.get('height', 0),
-            reverse=True
-        )
-        return sorted_images[0].get('url', '') if sorted_images else ''
+        # Largest image by area (width * height)
+        best_image = max(images, key=lambda x: x.get('width', 0) * x.get('height', 0))
+        return best_image.get('url', '')
     
     def _extract_youtube_id(self, url: str) -> str:
         """Extract YouTube video ID from URL."""
         # Handle youtu.be/ID format
         if 'youtu.be/' in url:
-            return url.split('youtu.be/')[-1].split('?')[0].split('&')[0]
+            return url.rpartition('youtu.be/')[2].partition('?')[0].partition('&')[0]
             
         # Handle youtube.com/watch?v=ID format
-        match = re.search(r'(?:v=|youtu\.be\/|\/v\/|\/e\/|embed\/|\?v=|\&v=)([^#\&\?]*)', url)
+        match = _YT_ID_RE.search(url)
         return match.group(1) if match else ''
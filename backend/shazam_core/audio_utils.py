@@ -1,13 +1,24 @@
 import numpy as np
 from pydub import AudioSegment
+import functools
 import io
+import math
 import os
-from typing import Tuple, Optional
+import subprocess
+import wave
+from scipy import signal
+from typing import BinaryIO, Tuple, Optional
+
+# NumPy dtypes for the integer PCM sample widths (in bytes) read in-process
+_PCM_DTYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
 
 def load_audio(file_path: str, target_sample_rate: int = 11025) -> Tuple[np.ndarray, int]:
     """
     Load an audio file and convert it to a mono waveform with the target sample rate.
     
+    PCM WAV files are decoded in-process; everything else is decoded by a
+    single ffmpeg call that also downmixes and resamples.
+    
     Args:
         file_path: Path to the audio file
         target_sample_rate: Target sample rate in Hz
@@ -15,28 +26,88 @@ def load_audio(file_path: str, target_sample_rate: int = 11025) -> Tuple[np.ndar
     Returns:
         Tuple of (audio_data, sample_rate)
     """
-    # Load audio file
-    audio = AudioSegment.from_file(file_path)
-    
-    # Convert to mono if stereo
-    if audio.channels > 1:
-        audio = audio.set_channels(1)
-    
-    # Resample to target sample rate if needed
-    if audio.frame_rate != target_sample_rate:
-        audio = audio.set_frame_rate(target_sample_rate)
-    
-    # Convert to numpy array
-    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
-    
-    # Normalize to [-1, 1]
-    if audio.sample_width == 2:  # 16-bit
-        samples = samples / 32768.0
-    elif audio.sample_width == 1:  # 8-bit
-        samples = (samples - 128) / 128.0
-    
+    if os.path.splitext(file_path)[1].lower() == '.wav':
+        try:
+            samples, sample_rate = _read_pcm_wav(file_path)
+        except (wave.Error, ValueError):
+            pass  # Compressed or extensible WAV: let ffmpeg handle it
+        else:
+            return _resample(samples, sample_rate, target_sample_rate), target_sample_rate
+    
+    samples = _decode_with_ffmpeg(['-i', file_path], target_sample_rate, stdin=subprocess.DEVNULL)
     return samples, target_sample_rate
 
+def _read_pcm_wav(file_path: str) -> Tuple[np.ndarray, int]:
+    """Read an integer PCM WAV file into a mono float32 array in [-1, 1]."""
+    with wave.open(file_path, 'rb') as wav_file:
+        sample_width = wav_file.getsampwidth()
+        if sample_width not in _PCM_DTYPES:
+            raise ValueError(f"Unsupported WAV sample width: {sample_width} bytes")
+        channels = wav_file.getnchannels()
+        sample_rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+    
+    pcm = np.frombuffer(frames, dtype=_PCM_DTYPES[sample_width])
+    if channels == 1:
+        # Mono: convert in the same pass that applies the offset/scale
+        if sample_width == 1:  # 8-bit WAV is unsigned
+            samples = np.subtract(pcm, 128, dtype=np.float32)
+        else:
+            samples = pcm.astype(np.float32)
+    else:
+        samples = pcm.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+        if sample_width == 1:
+            samples -= 128
+    samples /= 128.0 if sample_width == 1 else float(2 ** (8 * sample_width - 1))
+    return samples, sample_rate
+
+@functools.lru_cache(maxsize=16)
+def _resample_filter(up: int, down: int) -> np.ndarray:
+    """
+    Anti-aliasing FIR filter for an up/down rate pair, designed once per process.
+
+    Same design resample_poly uses by default (Kaiser window, beta 5.0), which
+    for pairs like 48000 -> 11025 (147/640) is a 12801-tap firwin per call.
+    """
+    max_rate = max(up, down)
+    taps = signal.firwin(2 * 10 * max_rate + 1, 1.0 / max_rate, window=('kaiser', 5.0))
+    taps.setflags(write=False)
+    return taps
+
+def _resample(audio_data: np.ndarray, sample_rate: int, target_sample_rate: int) -> np.ndarray:
+    """Resample with a polyphase filter; returns the input unchanged if rates match."""
+    if sample_rate == target_sample_rate:
+        return audio_data
+    factor = math.gcd(sample_rate, target_sample_rate)
+    up, down = target_sample_rate // factor, sample_rate // factor
+    # resample_poly copies the window before scaling it, so the cached taps stay intact
+    resampled = signal.resample_poly(audio_data, up, down, window=_resample_filter(up, down))
+    return resampled.astype(np.float32, copy=False)
+
+def _decode_with_ffmpeg(input_args: list, target_sample_rate: int, **feed) -> np.ndarray:
+    """Run ffmpeg and return its output as mono float32 PCM at the target rate."""
+    command = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        *input_args,
+        '-f', 'f32le', '-ac', '1', '-ar', str(target_sample_rate),
+        'pipe:1',
+    ]
+    result = subprocess.run(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=False,
+        **feed,
+    )
+    if result.returncode != 0:
+        error = result.stderr.decode(errors='replace').strip()
+        raise RuntimeError(f"ffmpeg failed to decode audio: {error}")
+    
+    # f32le output is already mono; decoded lossy streams can overshoot
+    # full scale slightly, so clip to [-1, 1] like 16-bit PCM would
+    samples = np.frombuffer(result.stdout, dtype=np.float32)
+    return np.clip(samples, -1.0, 1.0)
+
 def load_audio_from_bytes(audio_bytes: bytes, format: str = 'wav', target_sample_rate: int = 11025) -> Tuple[np.ndarray, int]:
     """
     Load audio from bytes and convert it to a mono waveform with the target sample rate.
@@ -52,26 +123,51 @@ def load_audio_from_bytes(audio_bytes: bytes, format: str = 'wav', target_sample
     # Create a file-like object from bytes
     audio_file = io.BytesIO(audio_bytes)
     
-    # Load audio using pydub
+    # Decode once with pydub; downmix and resample in NumPy instead of
+    # pydub's set_channels/set_frame_rate, which each rewrite the whole buffer
     audio = AudioSegment.from_file(audio_file, format=format)
     
-    # Convert to mono if stereo
-    if audio.channels > 1:
-        audio = audio.set_channels(1)
-    
-    # Resample to target sample rate if needed
-    if audio.frame_rate != target_sample_rate:
-        audio = audio.set_frame_rate(target_sample_rate)
+    # pydub keeps samples as signed integers (array_type 'b'/'h'/'i'), 8-bit included
+    samples = np.frombuffer(audio.raw_data, dtype=audio.array_type).reshape(-1, audio.channels)
+    scale = float(2 ** (8 * audio.sample_width - 1))
+    samples = samples.mean(axis=1, dtype=np.float32) / scale
     
-    # Convert to numpy array
-    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+    return _resample(samples, audio.frame_rate, target_sample_rate), target_sample_rate
+
+def _disk_fileno(stream: BinaryIO) -> Optional[int]:
+    """Return the OS file descriptor behind a stream, or None if it lives in memory."""
+    # Calling fileno() on an in-memory SpooledTemporaryFile would force it to disk
+    if getattr(stream, '_rolled', True) is False:
+        return None
+    try:
+        return stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+def load_audio_stream(stream: BinaryIO, target_sample_rate: int = 11025) -> Tuple[np.ndarray, int]:
+    """
+    Decode audio from a file-like object by piping it through ffmpeg.
     
-    # Normalize to [-1, 1]
-    if audio.sample_width == 2:  # 16-bit
-        samples = samples / 32768.0
-    elif audio.sample_width == 1:  # 8-bit
-        samples = (samples - 128) / 128.0
+    The encoded bytes are fed to ffmpeg on stdin and come back as mono float32
+    PCM at the target sample rate, so nothing is written to disk.
     
+    Args:
+        stream: Readable binary file-like object (e.g. an uploaded file's stream)
+        target_sample_rate: Target sample rate in Hz
+        
+    Returns:
+        Tuple of (audio_data, sample_rate)
+    """
+    fileno = _disk_fileno(stream)
+    if fileno is not None:
+        # Upload is already spooled to disk: let ffmpeg read the descriptor
+        # directly instead of copying the bytes through Python
+        os.lseek(fileno, stream.tell(), os.SEEK_SET)
+        feed = {'stdin': fileno}
+    else:
+        feed = {'input': stream.read()}
+    
+    samples = _decode_with_ffmpeg(['-i', 'pipe:0'], target_sample_rate, **feed)
     return samples, target_sample_rate
 
 def preprocess_audio(
@@ -92,20 +188,23 @@ def preprocess_audio(
     Returns:
         Preprocessed audio data
     """
+    original = audio_data
+    
     # Convert to float32 if not already
     if audio_data.dtype != np.float32:
         audio_data = audio_data.astype(np.float32)
     
-    # Resample if needed
-    if sample_rate != target_sample_rate:
-        from scipy import signal
-        num_samples = int(len(audio_data) * target_sample_rate / sample_rate)
-        audio_data = signal.resample(audio_data, num_samples)
+    # Resample if needed (polyphase FIR, no full-length FFT)
+    audio_data = _resample(audio_data, sample_rate, target_sample_rate)
     
     # Normalize to [-1, 1]
-    if normalize:
-        max_val = np.max(np.abs(audio_data))
+    if normalize and audio_data.size:
+        # Peak magnitude without materializing np.abs(audio_data)
+        max_val = max(audio_data.max(), -audio_data.min())
         if max_val > 0:
-            audio_data = audio_data / max_val
+            if audio_data is original:
+                audio_data = audio_data / max_val
+            else:
+                audio_data /= max_val  # our own copy: scale in place
     
     return audio_data
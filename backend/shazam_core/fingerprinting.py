@@ -1,23 +1,30 @@
 import numpy as np
 from dataclasses import dataclass
-from typing import List, Tuple, Dict, Any
+from typing import BinaryIO, Iterator, List, Tuple, Dict, Any
 import logging
-from collections import defaultdict
-from .audio_utils import load_audio
+import scipy.fft
+from .audio_utils import load_audio, load_audio_stream
+from .spectrogram import get_window
 
-# We will use the original Peak and Fingerprint dataclasses
-@dataclass
-class Peak:
-    time_idx: int
-    freq_idx: int
-    time: float
-    freq: float
+# Version of the decode + fingerprint pipeline, stored with each song's
+# fingerprints. Bump it whenever a change makes new fingerprints stop matching
+# stored ones, so outdated songs can be found and re-fingerprinted.
+#   1: pydub decoding with audioop resampling (songs stored before versioning)
+#   2: stdlib/ffmpeg decoding with anti-aliased resampling
+FINGERPRINT_VERSION = 2
 
 @dataclass
-class Fingerprint:
-    hash: int
-    song_id: int
-    offset: int # Time offset in STFT frames
+class FingerprintArray:
+    """Fingerprints of one recording as parallel arrays; song_id comes from the caller."""
+    hash: np.ndarray   # uint32 packed (f1, f2, dt) hashes
+    offset: np.ndarray # uint32 anchor time offsets in STFT frames
+
+    @classmethod
+    def empty(cls) -> 'FingerprintArray':
+        return cls(hash=np.empty(0, dtype=np.uint32), offset=np.empty(0, dtype=np.uint32))
+
+    def __len__(self) -> int:
+        return len(self.hash)
 
 class Fingerprinter:
     """
@@ -35,7 +42,8 @@ class Fingerprinter:
         fan_value: int = 15,             # Number of peaks to pair with each anchor
         target_zone_t_start: int = 1,    # Target zone starts 1 frame after anchor
         target_zone_t_len: int = 100,    # Target zone is 100 frames long
-        target_zone_f_len: int = 200     # Target zone is 200 freq bins wide
+        target_zone_f_len: int = 200,    # Target zone is 200 freq bins wide
+        fft_workers: int = -1            # Threads for the STFT's FFTs (-1 = all cores)
     ):
         self.sample_rate = sample_rate
         self.window_size = window_size
@@ -46,84 +54,159 @@ class Fingerprinter:
         self.target_zone_t_start = target_zone_t_start
         self.target_zone_t_len = target_zone_t_len
         self.target_zone_f_len = target_zone_f_len
+        self.fft_workers = fft_workers
+        # Build the STFT window up front so it is cached before any pool workers fork
+        self.window = get_window('hann', window_size)
 
-    def _find_peaks(self, spectrogram: np.ndarray, freqs: np.ndarray, times: np.ndarray) -> List[Peak]:
-        """Finds local maxima in the spectrogram."""
-        from scipy.ndimage import maximum_filter
+    def _find_peaks(self, spectrogram: np.ndarray, freqs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds local maxima in the spectrogram.
 
-        struct = np.ones((self.peak_neighborhood_size, self.peak_neighborhood_size), dtype=bool)
-        local_max = maximum_filter(spectrogram, footprint=struct) == spectrogram
-        
-        # Filter out everything below the minimum amplitude
-        local_max[spectrogram < self.min_amplitude] = False
-        
-        # Get coordinates of peaks
-        freq_idxs, time_idxs = np.where(local_max)
-        
-        peaks = [
-            Peak(time_idx, freq_idx, times[time_idx], freqs[freq_idx])
-            for freq_idx, time_idx in zip(freq_idxs, time_idxs)
-        ]
-        return peaks
-
-    def _create_hash(self, freq1: float, freq2: float, time_delta: int) -> int:
-        """Creates a hash from two frequency points and their time difference."""
+        Returns:
+            Tuple of (time_idxs, freqs_hz) arrays for the peaks, sorted by time.
+            Frame indices are int32 and frequencies whole Hz as uint16, which is
+            all the hash keeps of them.
+        """
+        from scipy.ndimage import maximum_filter1d
+
+        # A square max filter is separable: one 1D pass along each axis.
+        # Both passes write into the same scratch buffer (ndimage filters
+        # lines through an internal buffer, so in-place is safe).
+        size = self.peak_neighborhood_size
+        neighborhood_max = np.empty_like(spectrogram)
+        maximum_filter1d(spectrogram, size=size, axis=0, output=neighborhood_max, mode='constant', cval=-np.inf)
+        maximum_filter1d(neighborhood_max, size=size, axis=1, output=neighborhood_max, mode='constant', cval=-np.inf)
+
+        # Keep local maxima that clear the minimum amplitude, reusing one mask
+        local_max = np.equal(spectrogram, neighborhood_max)
+        del neighborhood_max
+        local_max &= spectrogram >= self.min_amplitude
+        freq_idxs, time_idxs = np.nonzero(local_max)
+
+        # Stable sort keeps peaks within a frame in ascending frequency order
+        order = np.argsort(time_idxs, kind='stable')
+        return time_idxs[order].astype(np.int32), freqs.astype(np.uint16)[freq_idxs[order]]
+
+    def _create_hashes(self, freq1: np.ndarray, freq2: np.ndarray, time_delta: np.ndarray) -> np.ndarray:
+        """Creates hashes from paired frequency points and their time differences."""
         # Pack three values into a 32-bit integer
         # We use bit shifting for efficient packing
-        # [ time_delta (10 bits) | freq2 (10 bits) | freq1 (12 bits) ]
-        f1_binned = int(freq1) & 0xFFF  # 12 bits for freq1
-        f2_binned = int(freq2) & 0x3FF  # 10 bits for freq2
-        dt_binned = int(time_delta) & 0x3FF  # 10 bits for time delta
+        # [ freq1 (12 bits) | freq2 (10 bits) | time_delta (10 bits) ]
+        f1_binned = freq1.astype(np.uint32) & 0xFFF  # 12 bits for freq1
+        f2_binned = freq2.astype(np.uint32) & 0x3FF  # 10 bits for freq2
+        dt_binned = time_delta.astype(np.uint32) & 0x3FF  # 10 bits for time delta
         
         return (f1_binned << 20) | (f2_binned << 10) | dt_binned
 
-    def generate_fingerprints(self, audio_data: np.ndarray, song_id: int = 0) -> List[Fingerprint]:
+    def _hash_peak_pairs(
+        self, peak_times: np.ndarray, peak_freqs: np.ndarray, block_size: int
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Pairs every anchor peak with the peaks in its target zone and hashes the pairs.
+
+        Peaks must be sorted by time. Each anchor looks at the next fan_value + 49
+        peaks and keeps those whose time delta falls inside the target zone; the
+        running total is capped at fan_value hashes per anchor seen so far, which
+        is what the original per-anchor loop did. Anchors are processed
+        block_size at a time to bound the size of the pairing matrix.
+
+        Yields:
+            Non-empty (hashes, offsets) uint32 array pairs in anchor order
+        """
+        num_peaks = len(peak_times)
+        if num_peaks < 2:
+            return
+
+        width = min(self.fan_value + 49, num_peaks - 1)
+        t_start = self.target_zone_t_start
+        t_end = t_start + self.target_zone_t_len
+
+        # The cap is a running recurrence over all anchors:
+        #   total_i = min(total_{i-1} + count_i, (i + 1) * fan_value)
+        # which unrolls to total_i = cum_count_i + min(0, min_{j<=i} headroom_j)
+        # with headroom_j = (j + 1) * fan_value - cum_count_j. Carry it across blocks.
+        total = 0
+        cum_count = 0
+        min_headroom = 0
+
+        for start in range(0, num_peaks, block_size):
+            anchor_idx = np.arange(start, min(start + block_size, num_peaks))
+
+            # Peaks are time-sorted, so everything from the first peak at or past
+            # t + t_end onward is out of the target zone: only build columns up to
+            # the furthest such boundary in the block
+            zone_end = np.searchsorted(peak_times, peak_times[anchor_idx] + t_end, side='left')
+            block_width = max(1, min(width, int((zone_end - anchor_idx).max()) - 1))
+
+            # (anchor, candidate) matrix of target indices i+1 .. i+block_width
+            target_idx = anchor_idx[:, None] + np.arange(1, block_width + 1)
+            in_bounds = target_idx < num_peaks
+            np.minimum(target_idx, num_peaks - 1, out=target_idx)
+
+            time_delta = peak_times[target_idx] - peak_times[anchor_idx, None]
+            valid = in_bounds & (time_delta >= t_start) & (time_delta < t_end)
+
+            cum_counts = cum_count + np.cumsum(valid.sum(axis=1))
+            headroom = (anchor_idx + 1) * self.fan_value - cum_counts
+            running_min = np.minimum(np.minimum.accumulate(headroom), min_headroom)
+            totals = cum_counts + running_min
+            # Drop each anchor's excess pairs from the end of its row
+            kept = np.diff(totals, prepend=total)
+            valid &= np.cumsum(valid, axis=1) <= kept[:, None]
+
+            total, cum_count, min_headroom = totals[-1], cum_counts[-1], running_min[-1]
+
+            rows, columns = np.nonzero(valid)
+            if rows.size == 0:
+                continue
+            anchors = anchor_idx[rows]
+            targets = target_idx[rows, columns]
+            hashes = self._create_hashes(peak_freqs[anchors], peak_freqs[targets], time_delta[rows, columns])
+            yield hashes, peak_times[anchors].astype(np.uint32)
+
+    def _spectrogram_peaks(self, audio_data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         from .spectrogram import generate_spectrogram
 
-        # Generate a dB-scaled spectrogram, which is better for peak finding
-        spectrogram, freqs, times = generate_spectrogram(
-            audio_data, self.sample_rate, self.window_size, self.hop_size, db_scale=True
-        )
-        
-        peaks = self._find_peaks(spectrogram, freqs, times)
-        
-        fingerprints = []
-        # Sort peaks by time index first
-        peaks.sort(key=lambda p: p.time_idx)
-
-        for i, anchor_peak in enumerate(peaks):
-            # Define the start and end of the target zone in time
-            t_min = anchor_peak.time_idx + self.target_zone_t_start
-            t_max = t_min + self.target_zone_t_len
-            
-            # Look ahead for target peaks
-            for target_peak in peaks[i+1 : i + self.fan_value + 50]: # Optimized search window
-                if target_peak.time_idx > t_max:
-                    break
-                
-                # Check if the peak is within the time and frequency bounds of the target zone
-                if t_min <= target_peak.time_idx < t_max:
-                    time_delta = target_peak.time_idx - anchor_peak.time_idx
-                    h = self._create_hash(anchor_peak.freq, target_peak.freq, time_delta)
-                    fingerprints.append(Fingerprint(hash=h, song_id=song_id, offset=anchor_peak.time_idx))
-            
-            # Limit to fan_value hashes per anchor
-            if len(fingerprints) > (i + 1) * self.fan_value:
-                fingerprints = fingerprints[:(i+1) * self.fan_value]
+        # Generate a dB-scaled spectrogram, which is better for peak finding.
+        # pocketfft keeps its plans cached per process; set_workers spreads the
+        # frame FFTs over threads without changing the result.
+        with scipy.fft.set_workers(self.fft_workers):
+            spectrogram, freqs, _ = generate_spectrogram(
+                audio_data, self.sample_rate, self.window_size, self.hop_size, db_scale=True
+            )
+        # ndimage has no float16 kernels, so float32 is the narrowest dtype the
+        # max filter can stream; this is a no-op for float32 audio.
+        return self._find_peaks(spectrogram.astype(np.float32, copy=False), freqs)
 
-        return fingerprints
+    def generate_fingerprint_arrays(self, audio_data: np.ndarray, chunk_size: int = 8192) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Yields fingerprints as (hashes, offsets) array chunks of roughly chunk_size pairs.
 
-    def fingerprint_file(self, file_path: str, song_id: int = 0) -> List[Fingerprint]:
-        logging.info(f"[FINGERPRINTER] fingerprint_file: Attempting to read audio from {file_path}, target_sr={self.sample_rate}, song_id={song_id}")
+        Lets callers stream fingerprints into the database without holding the
+        whole FingerprintArray; song_id is supplied at insert time.
+        """
+        peak_times, peak_freqs = self._spectrogram_peaks(audio_data)
+        anchors_per_block = max(1, chunk_size // self.fan_value)
+        yield from self._hash_peak_pairs(peak_times, peak_freqs, anchors_per_block)
+
+    def generate_fingerprints(self, audio_data: np.ndarray) -> FingerprintArray:
+        chunks = list(self.generate_fingerprint_arrays(audio_data))
+        if not chunks:
+            return FingerprintArray.empty()
+        hashes, offsets = zip(*chunks)
+        return FingerprintArray(hash=np.concatenate(hashes), offset=np.concatenate(offsets))
+
+    def fingerprint_file(self, file_path: str) -> FingerprintArray:
+        logging.info(f"[FINGERPRINTER] fingerprint_file: Attempting to read audio from {file_path}, target_sr={self.sample_rate}")
         samples, sr = load_audio(file_path, target_sample_rate=self.sample_rate)
         if samples is None:
             logging.error(f"[FINGERPRINTER] fingerprint_file: Could not read audio from {file_path}")
-            return []
-        logging.info(f"[FINGERPRINTER] fingerprint_file: Read audio from {file_path}, song_id={song_id}. Actual sample rate: {sr}, Num samples: {len(samples)}")
-        fingerprints = self.generate_fingerprints(samples, song_id=song_id)
-        logging.info(f"[FINGERPRINTER] fingerprint_file: Generated {len(fingerprints)} Fingerprint objects for {file_path}, song_id={song_id}.")
+            return FingerprintArray.empty()
+        logging.info(f"[FINGERPRINTER] fingerprint_file: Read audio from {file_path}. Actual sample rate: {sr}, Num samples: {len(samples)}")
+        fingerprints = self.generate_fingerprints(samples)
+        logging.info(f"[FINGERPRINTER] fingerprint_file: Generated {len(fingerprints)} fingerprints for {file_path}.")
         if fingerprints: 
-            logging.info(f"[FINGERPRINTER] fingerprint_file: First 3 Fingerprints [(hash, offset)]: {[(fp.hash, fp.offset) for fp in fingerprints[:3]]}")
+            logging.info(f"[FINGERPRINTER] fingerprint_file: First 3 fingerprints [(hash, offset)]: {list(zip(fingerprints.hash[:3].tolist(), fingerprints.offset[:3].tolist()))}")
         return fingerprints
 
 
@@ -135,61 +218,122 @@ class FingerprintMatcher:
 
     def match_file(self, query_audio_path: str, top_n: int = 1, min_absolute_matches: int = 2) -> List[Dict[str, Any]]:
         logging.info(f"[MATCHER] match_file: Generating fingerprints for query file: {query_audio_path}")
-        query_fingerprints = self.fingerprinter.fingerprint_file(query_audio_path) # List[Fingerprint]
+        query_fingerprints = self.fingerprinter.fingerprint_file(query_audio_path) # FingerprintArray
         if not query_fingerprints:
             logging.warning(f"[MATCHER] match_file: No fingerprints generated for query file: {query_audio_path}")
             return [] # Return empty list
 
-        logging.info(f"[MATCHER] match_file: Generated {len(query_fingerprints)} query Fingerprints for {query_audio_path}.")
-        if query_fingerprints:
-            logging.info(f"[MATCHER] match_file: First 3 query Fingerprints [(hash, offset)]: {[(fp.hash, fp.offset) for fp in query_fingerprints[:3]]}")
+        logging.info(f"[MATCHER] match_file: Generated {len(query_fingerprints)} query fingerprints for {query_audio_path}.")
+        return self.match_fingerprints(query_fingerprints, top_n=top_n, min_absolute_matches=min_absolute_matches)
 
-        query_hashes_for_db = [fp.hash for fp in query_fingerprints]
-        # Create a dictionary for fast lookup of query offsets by hash
-        query_fingerprint_map: Dict[int, int] = {fp.hash: fp.offset for fp in query_fingerprints}
-        
-        logging.info(f"[MATCHER] match_file: Querying DB with {len(query_hashes_for_db)} unique hashes. First 3: {query_hashes_for_db[:3] if query_hashes_for_db else 'N/A'}")
+    def match_file_like(self, stream: BinaryIO, top_n: int = 1, min_absolute_matches: int = 2) -> List[Dict[str, Any]]:
+        """Match encoded audio read from a file-like object without touching disk."""
+        samples, _ = load_audio_stream(stream, target_sample_rate=self.fingerprinter.sample_rate)
+        query_fingerprints = self.fingerprinter.generate_fingerprints(samples)
+        if not query_fingerprints:
+            logging.warning("[MATCHER] match_file_like: No fingerprints generated for query stream.")
+            return []
+
+        logging.info(f"[MATCHER] match_file_like: Generated {len(query_fingerprints)} query fingerprints from stream.")
+        return self.match_fingerprints(query_fingerprints, top_n=top_n, min_absolute_matches=min_absolute_matches)
+
+    def match_fingerprints(self, query_fingerprints: FingerprintArray, top_n: int = 1, min_absolute_matches: int = 2) -> List[Dict[str, Any]]:
+        """Score already-generated query fingerprints against the database."""
+        if not query_fingerprints:
+            return []
+
+        logging.info(f"[MATCHER] match_fingerprints: First 3 query fingerprints [(hash, offset)]: {list(zip(query_fingerprints.hash[:3].tolist(), query_fingerprints.offset[:3].tolist()))}")
+
+        query_hashes, query_offsets = self._unique_query(query_fingerprints)
+        query_hashes_for_db = query_hashes.tolist()
+
+        logging.info(f"[MATCHER] match_fingerprints: Querying DB with {len(query_hashes_for_db)} unique hashes. First 3: {query_hashes_for_db[:3] if query_hashes_for_db else 'N/A'}")
         # db_matches is List[Tuple[int, int, int]] -> (hash, song_id, db_offset/timestamp)
         db_matches = self.db_handler.get_matches_by_hashes(query_hashes_for_db)
         
-        logging.info(f"[MATCHER] match_file: DB returned {len(db_matches)} raw matches. First 3: {db_matches[:3] if db_matches else 'N/A'}")
+        logging.info(f"[MATCHER] match_fingerprints: DB returned {len(db_matches)} raw matches. First 3: {db_matches[:3] if db_matches else 'N/A'}")
         if not db_matches:
-            logging.info("[MATCHER] match_file: No raw matches returned from DB for any query hashes.")
+            logging.info("[MATCHER] match_fingerprints: No raw matches returned from DB for any query hashes.")
             return []
 
-        song_offset_histograms: Dict[int, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
-        processed_db_matches = 0
-
-        for db_hash, song_id, db_offset_from_db in db_matches: # db_offset_from_db is the timestamp stored in DB
-            # Ensure song_id is an integer (defensive coding)
-            song_id = int(song_id)
-
-            # song_id is already an int from db_matches if schema is correct, but ensure
-            song_id = int(song_id)
-            
-            if db_hash in query_fingerprint_map:
-                query_offset = query_fingerprint_map[db_hash]
-                
-                try:
-                    offset_delta = int(db_offset_from_db) - int(query_offset)
-                except (ValueError, TypeError) as e:
-                    logging.warning(f"[MATCHER] match_file: Skipping match due to invalid offset types. db_hash={db_hash}, db_offset={db_offset_from_db}, query_offset={query_offset}. Error: {e}")
-                    continue
-                
-                song_offset_histograms[song_id][offset_delta] += 1
-                processed_db_matches += 1
-
-        logging.info(f"[MATCHER] match_file: Processed {processed_db_matches} db_matches into offset histograms for {len(song_offset_histograms)} songs.")
-        if not song_offset_histograms:
-            logging.info("[MATCHER] MATCH FAILED: No songs had any offset matches after processing DB results.")
-            return []
+        keys = self._offset_keys(query_hashes, query_offsets, db_matches)
+        logging.info(f"[MATCHER] match_fingerprints: Processing {len(keys)} db_matches into offset histograms.")
+        return self._rank_offset_keys(keys, top_n, min_absolute_matches)
+
+    def iter_matches(
+        self,
+        query_fingerprints: FingerprintArray,
+        chunk_size: int = 512,
+        top_n: int = 1,
+        min_absolute_matches: int = 2
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Score the query incrementally, yielding the ranking after each chunk of hashes.
+
+        The query's distinct hashes are looked up in time order, chunk_size at a
+        time, so a caller can stop as soon as the leading match is confident
+        instead of fetching every hash. The last ranking yielded equals
+        match_fingerprints' result.
+        """
+        if not query_fingerprints:
+            return
+
+        query_hashes, query_offsets = self._unique_query(query_fingerprints)
+        by_time = np.argsort(query_offsets, kind='stable')
+        keys = []
+        for start in range(0, len(by_time), chunk_size):
+            # Sorting the chunk's indices keeps its hashes sorted for _offset_keys
+            chunk = np.sort(by_time[start:start + chunk_size])
+            db_matches = self.db_handler.get_matches_by_hashes(query_hashes[chunk].tolist())
+            if db_matches:
+                keys.append(self._offset_keys(query_hashes[chunk], query_offsets[chunk], db_matches))
+            yield self._rank_offset_keys(np.concatenate(keys) if keys else np.empty(0, dtype=np.int64), top_n, min_absolute_matches)
+
+    @staticmethod
+    def _unique_query(query_fingerprints: FingerprintArray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the query's distinct hashes (sorted) and the offset each one maps to.
+
+        The sort is stable, so for repeated hashes the last occurrence wins, as
+        it would in a dict built from the query.
+        """
+        order = np.argsort(query_fingerprints.hash, kind='stable')
+        sorted_hashes = query_fingerprints.hash[order].astype(np.int64)
+        sorted_offsets = query_fingerprints.offset[order].astype(np.int64)
+        last = np.ones(len(sorted_hashes), dtype=bool)
+        last[:-1] = sorted_hashes[1:] != sorted_hashes[:-1]
+        return sorted_hashes[last], sorted_offsets[last]
+
+    @staticmethod
+    def _offset_keys(query_hashes: np.ndarray, query_offsets: np.ndarray, db_matches: List[Tuple[int, int, int]]) -> np.ndarray:
+        """Pack each DB row's (song_id, offset_delta) into one int64 histogram key.
+
+        query_hashes must be sorted and distinct so rows map back to query
+        offsets with a binary search. Deltas are shifted to be non-negative so
+        keys sort by song, then delta.
+        """
+        matches = np.array(db_matches, dtype=np.int64).reshape(-1, 3)
+        db_hashes, song_ids, db_offsets = matches[:, 0], matches[:, 1], matches[:, 2]
+        idx = np.searchsorted(query_hashes, db_hashes)
+        known = (idx < len(query_hashes)) & (query_hashes[np.minimum(idx, len(query_hashes) - 1)] == db_hashes)
+        if not known.all():
+            song_ids, db_offsets, idx = song_ids[known], db_offsets[known], idx[known]
+        offset_deltas = db_offsets - query_offsets[idx]
+        return (song_ids << 32) | (offset_deltas + (1 << 31))
+
+    def _rank_offset_keys(self, keys: np.ndarray, top_n: int, min_absolute_matches: int) -> List[Dict[str, Any]]:
+        """Score each song by its fullest offset-delta bin and return the top_n."""
+        # Histogram every (song_id, offset_delta) pair at once
+        unique_keys, counts = np.unique(keys, return_counts=True)
+        key_songs = unique_keys >> 32
+        key_deltas = (unique_keys & 0xFFFFFFFF) - (1 << 31)
+
+        # Best bin per song: sort by song, then by count descending (ties keep the smaller delta)
+        order = np.lexsort((-counts, key_songs))
+        first_of_song = np.ones(len(order), dtype=bool)
+        first_of_song[1:] = key_songs[order][1:] != key_songs[order][:-1]
+        best = order[first_of_song]
 
         results = []
-        for song_id, histogram in song_offset_histograms.items():
-            if not histogram: continue
-            
-            best_offset, score = max(histogram.items(), key=lambda item: item[1])
-            
+        for song_id, best_offset, score in zip(key_songs[best].tolist(), key_deltas[best].tolist(), counts[best].tolist()):
             if score < min_absolute_matches: continue
 
             match_time_in_seconds = (best_offset * self.fingerprinter.hop_size) / self.fingerprinter.sample_rate
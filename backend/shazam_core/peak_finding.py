@@ -1,5 +1,8 @@
+import itertools
 import numpy as np
-from typing import List, Tuple, Optional, Dict, Any
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import List, Tuple, Optional, Dict, Any, Iterator, Union
 import scipy.ndimage as ndimage
 from dataclasses import dataclass
 
@@ -16,27 +19,148 @@ class Peak:
         """Convert peak to a tuple of (time_idx, freq_idx, magnitude)."""
         return (self.time_idx, self.freq_idx, self.magnitude)
 
+@dataclass
+class PeakArray:
+    """
+    Peaks stored as parallel arrays (one entry per peak).
+    
+    Indexing with an integer or iterating yields Peak objects built on demand,
+    so code written against a list of peaks keeps working.
+    """
+    time_idx: np.ndarray           # Time indices
+    freq_idx: np.ndarray           # Frequency indices
+    magnitude: np.ndarray          # Peak magnitudes
+    time: Optional[np.ndarray] = None  # Times in seconds (NaN if unknown)
+    freq: Optional[np.ndarray] = None  # Frequencies in Hz (NaN if unknown)
+    
+    def __len__(self) -> int:
+        return len(self.magnitude)
+    
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return Peak(
+                time_idx=self.time_idx[index].item(),
+                freq_idx=self.freq_idx[index].item(),
+                magnitude=self.magnitude[index].item(),
+                time=_optional_value(self.time, index),
+                freq=_optional_value(self.freq, index)
+            )
+        return PeakArray(
+            time_idx=self.time_idx[index],
+            freq_idx=self.freq_idx[index],
+            magnitude=self.magnitude[index],
+            time=None if self.time is None else self.time[index],
+            freq=None if self.freq is None else self.freq[index]
+        )
+    
+    def __iter__(self) -> Iterator[Peak]:
+        # Convert each column to Python scalars in one call rather than
+        # indexing the arrays once per peak
+        columns = zip(
+            self.time_idx.tolist(),
+            self.freq_idx.tolist(),
+            self.magnitude.tolist(),
+            _optional_column(self.time, len(self)),
+            _optional_column(self.freq, len(self))
+        )
+        for time_idx, freq_idx, magnitude, time, freq in columns:
+            yield Peak(time_idx=time_idx, freq_idx=freq_idx, magnitude=magnitude, time=time, freq=freq)
+    
+    def to_peaks(self) -> List[Peak]:
+        """Convert to a list of Peak objects."""
+        return list(self)
+
+def _optional_value(values: Optional[np.ndarray], index: int) -> Optional[float]:
+    """Return values[index], or None when the array is missing or holds NaN there."""
+    if values is None or np.isnan(values[index]):
+        return None
+    return values[index].item()
+
+def _optional_column(values: Optional[np.ndarray], length: int) -> Iterator[Optional[float]]:
+    """Iterate over values as Python floats, with None for a missing array or NaN entries."""
+    if values is None:
+        return itertools.repeat(None, length)
+    return (None if value != value else value for value in values.tolist())
+
+# Use the per-candidate neighbor check when at most 1/N of the bins clear amp_min
+_SPARSE_CANDIDATE_RATIO = 8
+
+def _local_max_mask(spectrogram: np.ndarray) -> np.ndarray:
+    """Boolean mask of points equal to the maximum of their 3x3 neighborhood."""
+    # The 3x3 max filter is separable, so run it as two 1D passes sharing one
+    # scratch buffer.
+    neighborhood_max = np.empty_like(spectrogram)
+    ndimage.maximum_filter1d(spectrogram, size=3, axis=0, output=neighborhood_max)
+    ndimage.maximum_filter1d(neighborhood_max, size=3, axis=1, output=neighborhood_max)
+    return np.equal(spectrogram, neighborhood_max)
+
+def _masked_points(
+    spectrogram: np.ndarray,
+    mask: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Return (freq_idxs, time_idxs, values) of the True points of mask, in row-major order.
+    
+    For C-ordered spectrograms this finds flat indices once and gathers through
+    a 1D view, which is cheaper than np.nonzero plus 2D fancy indexing.
+    """
+    if spectrogram.flags.c_contiguous:
+        flat_idxs = np.flatnonzero(mask)
+        freq_idxs, time_idxs = np.divmod(flat_idxs, spectrogram.shape[1])
+        return freq_idxs, time_idxs, spectrogram.ravel()[flat_idxs]
+    freq_idxs, time_idxs = np.nonzero(mask)
+    return freq_idxs, time_idxs, spectrogram[freq_idxs, time_idxs]
+
+def _sparse_local_max(
+    spectrogram: np.ndarray,
+    freq_idxs: np.ndarray,
+    time_idxs: np.ndarray,
+    values: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Keep the candidate points that are maxima of their 3x3 neighborhood.
+    
+    Equivalent to indexing _local_max_mask at the candidates, but only reads the
+    8 neighbors of each candidate. Neighbor indices are clipped at the edges, which
+    compares an edge point against itself, matching the filter's reflect mode.
+    """
+    num_freqs, num_times = spectrogram.shape
+    keep = np.ones(len(values), dtype=bool)
+    for df in (-1, 0, 1):
+        rows = np.clip(freq_idxs + df, 0, num_freqs - 1)
+        for dt in (-1, 0, 1):
+            if df == 0 and dt == 0:
+                continue
+            cols = np.clip(time_idxs + dt, 0, num_times - 1)
+            keep &= values >= spectrogram[rows, cols]
+    return freq_idxs[keep], time_idxs[keep], values[keep]
+
 def find_peaks(
     spectrogram: np.ndarray,
     time_axis: int = 1,
     freq_axis: int = 0,
     amp_min: Optional[float] = None,
     num_peaks: Optional[int] = None,
+    as_objects: bool = False,
     **kwargs
-) -> List[Peak]:
+) -> Union[PeakArray, List[Peak]]:
     """
     Find peaks in a spectrogram.
     
+    The fast path is a (freq, time) spectrogram, as generate_spectrogram
+    returns; other layouts are transposed into a C-ordered copy first.
+    
     Args:
         spectrogram: Input spectrogram (2D numpy array)
         time_axis: Axis corresponding to time in the spectrogram
         freq_axis: Axis corresponding to frequency in the spectrogram
         amp_min: Minimum amplitude threshold for peaks
         num_peaks: Maximum number of peaks to return (top N by magnitude)
+        as_objects: Return a list of Peak objects instead of a PeakArray
         **kwargs: Additional arguments to pass to the peak finding function
         
     Returns:
-        List of Peak objects
+        PeakArray of the detected peaks, or a list of Peak objects if as_objects is set
     """
     # Ensure spectrogram is 2D
     if spectrogram.ndim != 2:
@@ -44,50 +168,48 @@ def find_peaks(
     
     # Swap axes if needed to ensure time is axis 1 and frequency is axis 0
     if time_axis != 1 or freq_axis != 0:
-        # Create a mapping of old axes to new axes
-        axes = list(range(spectrogram.ndim))
-        axes[time_axis], axes[1] = axes[1], axes[time_axis]
-        axes[freq_axis], axes[0] = axes[0], axes[freq_axis]
-        spectrogram = np.transpose(spectrogram, axes=axes)
-    
-    # Find local maxima in the spectrogram
-    neighborhood = np.ones((3, 3), bool)
-    local_max = ndimage.maximum_filter(spectrogram, footprint=neighborhood) == spectrogram
+        # Copy the transposed view into C order so the filters stream rows
+        spectrogram = np.ascontiguousarray(np.moveaxis(spectrogram, (freq_axis, time_axis), (0, 1)))
     
-    # Find coordinates and values of local maxima
-    freq_idxs, time_idxs = np.where(local_max)
-    magnitudes = spectrogram[freq_idxs, time_idxs]
-    
-    # Filter by minimum amplitude if specified
     if amp_min is not None:
-        mask = magnitudes >= amp_min
-        time_idxs = time_idxs[mask]
-        freq_idxs = freq_idxs[mask]
-        magnitudes = magnitudes[mask]
-    
-    # Sort by magnitude in descending order
-    if num_peaks is not None and len(magnitudes) > num_peaks:
-        # Get indices of top N peaks by magnitude
-        top_indices = np.argpartition(magnitudes, -num_peaks)[-num_peaks:]
-        time_idxs = time_idxs[top_indices]
-        freq_idxs = freq_idxs[top_indices]
-        magnitudes = magnitudes[top_indices]
-    
-    # Create Peak objects
-    peaks = [
-        Peak(time_idx=time_idx, freq_idx=freq_idx, magnitude=magnitude)
-        for time_idx, freq_idx, magnitude in zip(time_idxs, freq_idxs, magnitudes)
-    ]
-    
-    return peaks
+        candidates = spectrogram >= amp_min
+        if np.count_nonzero(candidates) * _SPARSE_CANDIDATE_RATIO <= spectrogram.size:
+            # Few points clear the threshold: test just those against their neighbors
+            freq_idxs, time_idxs, magnitudes = _sparse_local_max(
+                spectrogram, *_masked_points(spectrogram, candidates)
+            )
+        else:
+            # Apply the minimum amplitude to the mask itself, before extracting coordinates
+            local_max = _local_max_mask(spectrogram)
+            local_max &= candidates
+            freq_idxs, time_idxs, magnitudes = _masked_points(spectrogram, local_max)
+    else:
+        freq_idxs, time_idxs, magnitudes = _masked_points(spectrogram, _local_max_mask(spectrogram))
+    
+    peaks = _top_peaks(
+        PeakArray(time_idx=time_idxs, freq_idx=freq_idxs, magnitude=magnitudes),
+        num_peaks
+    )
+    return peaks.to_peaks() if as_objects else peaks
+
+def _top_peaks(peaks: PeakArray, num_peaks: Optional[int]) -> PeakArray:
+    """Keep the num_peaks strongest peaks, sorted by magnitude in descending order."""
+    if num_peaks is None or len(peaks) <= num_peaks:
+        return peaks
+    # Select the top N peaks in O(M), then sort only those N by magnitude
+    magnitudes = peaks.magnitude
+    top_indices = np.argpartition(magnitudes, -num_peaks)[-num_peaks:]
+    top_indices = top_indices[np.argsort(-magnitudes[top_indices], kind='stable')]
+    return peaks[top_indices]
 
 def find_peaks_in_bands(
     spectrogram: np.ndarray,
     freq_bands: List[Tuple[float, float]],
     freq_axis: int = 0,
     time_axis: int = 1,
+    as_objects: bool = False,
     **kwargs
-) -> Dict[Tuple[float, float], List[Peak]]:
+) -> Dict[Tuple[float, float], Union[PeakArray, List[Peak]]]:
     """
     Find peaks within specific frequency bands.
     
@@ -96,26 +218,22 @@ def find_peaks_in_bands(
         freq_bands: List of (freq_min, freq_max) tuples defining the bands
         freq_axis: Axis corresponding to frequency in the spectrogram
         time_axis: Axis corresponding to time in the spectrogram
+        as_objects: Return lists of Peak objects instead of PeakArrays
         **kwargs: Additional arguments to pass to find_peaks
         
     Returns:
-        Dictionary mapping frequency bands to lists of peaks in those bands
+        Dictionary mapping frequency bands to the peaks in those bands
     """
     if spectrogram.ndim != 2:
         raise ValueError("Expected 2D spectrogram")
     
-    # Ensure frequency axis is first and time axis is second
-    if freq_axis != 0 or time_axis != 1:
-        axes = list(range(spectrogram.ndim))
-        axes[freq_axis], axes[0] = axes[0], axes[freq_axis]
-        axes[time_axis], axes[1] = axes[1], axes[time_axis]
-        spectrogram = np.transpose(spectrogram, axes=axes)
+    # Detect local maxima once over the whole spectrogram, then split them
+    # into bands; num_peaks applies to each band separately
+    num_peaks = kwargs.pop('num_peaks', None)
+    peaks = find_peaks(spectrogram, time_axis=time_axis, freq_axis=freq_axis, **kwargs)
     
-    # Convert frequency bands to indices
-    _, num_freq_bins = spectrogram.shape
-    
-    # For this simplified version, we'll assume the spectrogram is already in the right shape
-    # and the frequency bands are given as fraction of the total frequency range
+    # Frequency bands are given as fractions of the total frequency range
+    num_freq_bins = spectrogram.shape[freq_axis]
     band_peaks = {}
     
     for band in freq_bands:
@@ -124,22 +242,10 @@ def find_peaks_in_bands(
         min_idx = int(freq_min * num_freq_bins)
         max_idx = int(freq_max * num_freq_bins)
         
-        # Extract the frequency band
-        band_spectrogram = spectrogram[min_idx:max_idx, :]
-        
-        # Find peaks in this band
-        peaks = find_peaks(
-            band_spectrogram,
-            time_axis=1,
-            freq_axis=0,
-            **kwargs
-        )
-        
-        # Adjust frequency indices to be relative to the full spectrogram
-        for peak in peaks:
-            peak.freq_idx += min_idx
+        in_band = (peaks.freq_idx >= min_idx) & (peaks.freq_idx < max_idx)
+        band_peak_array = _top_peaks(peaks[in_band], num_peaks)
         
-        band_peaks[band] = peaks
+        band_peaks[band] = band_peak_array.to_peaks() if as_objects else band_peak_array
     
     return band_peaks
 
@@ -147,8 +253,9 @@ def find_peaks_with_time_freq(
     spectrogram: np.ndarray,
     times: np.ndarray,
     freqs: np.ndarray,
+    as_objects: bool = False,
     **kwargs
-) -> List[Peak]:
+) -> Union[PeakArray, List[Peak]]:
     """
     Find peaks in a spectrogram and include time and frequency information.
     
@@ -156,17 +263,71 @@ def find_peaks_with_time_freq(
         spectrogram: Input spectrogram (2D numpy array)
         times: Array of time values for each time bin
         freqs: Array of frequency values for each frequency bin
+        as_objects: Return a list of Peak objects instead of a PeakArray
         **kwargs: Additional arguments to pass to find_peaks
         
     Returns:
-        List of Peak objects with time and frequency information
+        Peaks with time and frequency information
     """
     # Find peaks in the spectrogram
     peaks = find_peaks(spectrogram, **kwargs)
     
-    # Add time and frequency information to each peak
-    for peak in peaks:
-        peak.time = times[peak.time_idx] if peak.time_idx < len(times) else None
-        peak.freq = freqs[peak.freq_idx] if peak.freq_idx < len(freqs) else None
+    # Look up time and frequency for all peaks at once; bins past the end of
+    # the axis arrays are left as NaN
+    peaks.time = _lookup_axis(times, peaks.time_idx)
+    peaks.freq = _lookup_axis(freqs, peaks.freq_idx)
+    
+    return peaks.to_peaks() if as_objects else peaks
+
+def _lookup_axis(axis_values: np.ndarray, idxs: np.ndarray) -> np.ndarray:
+    """Map bin indices to axis values, using NaN for out-of-range indices."""
+    axis_values = np.asarray(axis_values, dtype=np.float64)
+    values = np.full(len(idxs), np.nan)
+    in_range = idxs < len(axis_values)
+    values[in_range] = axis_values[idxs[in_range]]
+    return values
+
+def _clip_peaks(
+    audio_data: np.ndarray,
+    spectrogram_params: Dict[str, Any],
+    peak_params: Dict[str, Any]
+) -> PeakArray:
+    """Spectrogram + peak picking for one clip (module level so it pickles)."""
+    from .spectrogram import generate_spectrogram
+    
+    spectrogram, freqs, times = generate_spectrogram(audio_data, **spectrogram_params)
+    return find_peaks_with_time_freq(spectrogram, times, freqs, **peak_params)
+
+def batch_find_peaks(
+    audio_clips: List[np.ndarray],
+    spectrogram_params: Optional[Dict[str, Any]] = None,
+    max_workers: Optional[int] = None,
+    **kwargs
+) -> List[PeakArray]:
+    """
+    Find spectrogram peaks for many clips in parallel worker processes.
+    
+    Each clip is independent, so clips are spread over a process pool; a
+    single clip or max_workers=1 runs in the calling process.
+    
+    Args:
+        audio_clips: List of 1D audio arrays
+        spectrogram_params: Keyword arguments for generate_spectrogram
+            (sample_rate, window_size, hop_size, ...)
+        max_workers: Number of worker processes (defaults to the CPU count)
+        **kwargs: Additional arguments to pass to find_peaks (amp_min, num_peaks, ...)
+        
+    Returns:
+        One PeakArray per clip, in input order, with time and frequency set
+    """
+    worker = partial(
+        _clip_peaks,
+        spectrogram_params=spectrogram_params or {},
+        peak_params=kwargs
+    )
+    
+    if len(audio_clips) <= 1 or max_workers == 1:
+        return [worker(clip) for clip in audio_clips]
     
-    return peaks
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(worker, audio_clips))
@@ -1,7 +1,37 @@
+import functools
+import math
+
 import numpy as np
+import scipy.fft
 from scipy import signal
 from typing import Tuple, Optional
 
+# Slaney Mel scale: linear below 1 kHz, logarithmic above
+_F_SP = 200.0 / 3
+_MIN_LOG_HZ = 1000.0  # beginning of log region (Hz)
+_MIN_LOG_MEL = _MIN_LOG_HZ / _F_SP  # same (Mels)
+_LOGSTEP = math.log(6.4) / 27.0  # step size for log region
+
+@functools.lru_cache(maxsize=None)
+def get_window(window_type: str, window_size: int) -> np.ndarray:
+    """
+    Return a cached, read-only analysis window.
+    
+    Windows are built once per process. Pool workers are forked from the
+    app process, so a window created there is shared copy-on-write.
+    
+    Args:
+        window_type: Type of window function ('hann', 'hamming', 'blackman', etc.)
+        window_size: Size of the window (samples)
+        
+    Returns:
+        Window array of length window_size
+    """
+    window = signal.get_window(window_type, window_size, fftbins=True)
+    window.setflags(write=False)
+    return window
+
+
 def generate_spectrogram(
     audio_data: np.ndarray,
     sample_rate: int = 11025,
@@ -11,7 +41,8 @@ def generate_spectrogram(
     log_scale: bool = True,
     db_scale: bool = True,
     ref: float = 1.0,
-    top_db: float = 80.0
+    top_db: float = 80.0,
+    workers: Optional[int] = None
 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
     Generate a spectrogram from audio data using Short-Time Fourier Transform (STFT).
@@ -26,6 +57,8 @@ def generate_spectrogram(
         db_scale: Whether to convert to decibel scale
         ref: Reference value for dB scaling
         top_db: Threshold the output at top_db below the peak
+        workers: FFT worker threads (-1 for all cores). None uses the
+            current scipy.fft.set_workers setting
         
     Returns:
         Tuple of (spectrogram, frequencies, times)
@@ -34,29 +67,45 @@ def generate_spectrogram(
     if len(audio_data) == 0:
         raise ValueError("Input audio data is empty")
     
-    # Get window function
-    window = signal.get_window(window_type, window_size, fftbins=True)
+    # Work in float32 so the STFT returns complex64 and every later stage
+    # streams half the bytes
+    audio_data = np.asarray(audio_data, dtype=np.float32)
     
-    # Compute STFT
-    f, t, Zxx = signal.stft(
-        audio_data,
-        fs=sample_rate,
-        window=window,
-        nperseg=window_size,
-        noverlap=window_size - hop_size,
-        boundary=None,
-        padded=False
-    )
-    
-    # Calculate magnitude spectrum
-    spectrogram = np.abs(Zxx)
+    if len(audio_data) < window_size:
+        raise ValueError(
+            f"Input audio data is shorter than the window ({len(audio_data)} < {window_size} samples)"
+        )
     
-    # Convert to dB scale if requested
+    # Get window function
+    window = get_window(window_type, window_size)
+    
+    # Compute STFT: window strided frames and batch them through one rfft.
+    # Matches signal.stft(boundary=None, padded=False, detrend=False) without
+    # its boundary/padding bookkeeping.
+    frames = np.lib.stride_tricks.sliding_window_view(audio_data, window_size)[::hop_size]
+    frames = frames * window.astype(audio_data.dtype, copy=False)
+    Zxx = scipy.fft.rfft(frames, axis=-1, workers=workers).T
+    del frames  # release the windowed frames before the spectrum buffers are allocated
+    Zxx *= audio_data.dtype.type(1.0 / window.sum())
+    
+    f = scipy.fft.rfftfreq(window_size, 1.0 / sample_rate)
+    t = (np.arange(Zxx.shape[1]) * hop_size + window_size / 2) / sample_rate
+    
+    # Convert to dB scale if requested, straight from the power spectrum so
+    # the magnitude's square root is never taken. Both branches own their
+    # buffer, so the scaling is done in place.
     if db_scale:
-        spectrogram = amplitude_to_db(spectrogram, ref=ref, top_db=top_db)
-    # Apply log scaling if requested (but not in dB)
-    elif log_scale:
-        spectrogram = np.log1p(spectrogram)
+        spectrogram = power_spectrum(Zxx)
+        np.maximum(spectrogram, spectrogram.dtype.type(1e-20), out=spectrogram)
+        spectrogram = _log_to_db_inplace(
+            spectrogram, spectrogram.dtype.type(np.abs(ref)) ** 2, 5.0, top_db
+        )
+    else:
+        # Calculate magnitude spectrum
+        spectrogram = np.abs(Zxx)
+        # Apply log scaling if requested (but not in dB)
+        if log_scale:
+            np.log1p(spectrogram, out=spectrogram)
     
     return spectrogram, f, t
 
@@ -72,19 +121,67 @@ def amplitude_to_db(S: np.ndarray, ref: float = 1.0, top_db: float = 80.0) -> np
     Returns:
         dB-scaled spectrogram
     """
-    # Avoid division by zero
+    # Stay in the input's float precision (float32 spectrograms stay float32).
+    # np.abs always allocates, so the result can be worked on in place.
     magnitude = np.abs(S)
-    ref_value = np.abs(ref)
+    dtype = np.result_type(magnitude.dtype, np.float32)
+    log_spec = magnitude.astype(dtype, copy=False)
+    
+    # Avoid division by zero
+    np.maximum(log_spec, dtype.type(1e-10), out=log_spec)
+    
+    return _log_to_db_inplace(log_spec, dtype.type(np.abs(ref)), 10.0, top_db)
+
+def power_spectrum(Zxx: np.ndarray) -> np.ndarray:
+    """
+    Compute |Zxx|**2 as real**2 + imag**2.
     
-    # Convert to dB
-    min_db = -100
-    log_spec = 10.0 * np.log10(np.maximum(1e-10, magnitude) / ref_value)
+    Args:
+        Zxx: Complex STFT matrix
+        
+    Returns:
+        Power spectrogram in the matching real dtype
+    """
+    power = np.square(Zxx.real)
+    power += np.square(Zxx.imag)
+    return power
+
+def power_to_db(S: np.ndarray, ref: float = 1.0, top_db: float = 80.0) -> np.ndarray:
+    """
+    Convert a power spectrogram to the same dB scale as amplitude_to_db.
+    
+    Args:
+        S: Input power spectrogram (squared magnitudes)
+        ref: Amplitude reference value for dB scaling
+        top_db: Threshold the output at top_db below the peak
+        
+    Returns:
+        dB-scaled spectrogram
+    """
+    dtype = np.result_type(S.dtype, np.float32)
+    
+    # Floor into a new buffer (S is left untouched), then work in place
+    log_spec = np.maximum(S, dtype.type(1e-20), dtype=dtype)
+    
+    # amplitude_to_db uses 10*log10(amplitude), which is 5*log10(power)
+    return _log_to_db_inplace(log_spec, dtype.type(np.abs(ref)) ** 2, 5.0, top_db)
+
+def _log_to_db_inplace(
+    values: np.ndarray,
+    ref_value: float,
+    multiplier: float,
+    top_db: Optional[float]
+) -> np.ndarray:
+    """Compute multiplier * log10(values / ref_value) in place, clipped to top_db below the peak."""
+    values /= ref_value
+    np.log10(values, out=values)
+    values *= values.dtype.type(multiplier)
     
     # Apply threshold
     if top_db is not None:
-        log_spec = np.maximum(log_spec, log_spec.max() - top_db)
+        np.maximum(values, values.max() - top_db, out=values)
     
-    return log_spec
+    return values
 
 def mel_spectrogram(
     audio_data: np.ndarray,
@@ -113,17 +210,25 @@ def mel_spectrogram(
     """
     from scipy import signal
     
+    audio_data = np.asarray(audio_data, dtype=np.float32)
+    
+    # Reuse the cached window instead of having stft rebuild it on every call
+    window = kwargs.pop('window', 'hann')
+    if isinstance(window, str):
+        window = get_window(window, n_fft)
+    
     # Compute STFT
     _, _, Zxx = signal.stft(
         audio_data,
         fs=sample_rate,
+        window=window,
         nperseg=n_fft,
         noverlap=n_fft - hop_length,
         **kwargs
     )
     
     # Get power spectrogram
-    S = np.abs(Zxx) ** 2
+    S = power_spectrum(Zxx)
     
     # Create Mel filter bank
     fmax = fmax or sample_rate / 2
@@ -135,11 +240,12 @@ def mel_spectrogram(
         fmax=fmax
     )
     
-    # Apply Mel filter bank
-    mel_spectrum = np.dot(mel_basis, S)
+    # Apply Mel filter bank (single precision, so this is an SGEMM)
+    mel_spectrum = np.dot(mel_basis.astype(S.dtype, copy=False), S)
     
     return mel_spectrum
 
+@functools.lru_cache(maxsize=32)
 def mel_filter_bank(
     sample_rate: int,
     n_fft: int,
@@ -151,6 +257,8 @@ def mel_filter_bank(
     """
     Create a Mel filter bank.
     
+    Filter banks are cached per parameter set and returned read-only.
+    
     Args:
         sample_rate: Sample rate of the audio
         n_fft: Number of FFT bins
@@ -167,10 +275,6 @@ def mel_filter_bank(
     if fmax is None:
         fmax = sample_rate / 2
     
-    # Initialize the weights
-    n_freqs = n_fft // 2 + 1
-    weights = np.zeros((n_mels, n_freqs))
-    
     # Center freqs of each FFT bin
     fftfreqs = np.fft.rfftfreq(n_fft, 1.0 / sample_rate)
     
@@ -190,43 +294,45 @@ def mel_filter_bank(
     fdiff = np.diff(mel_f)
     ramps = np.subtract.outer(mel_f, fftfreqs)
     
-    for i in range(n_mels):
-        # Lower and upper slopes for all bins
-        lower = -ramps[i] / fdiff[i]
-        upper = ramps[i+2] / fdiff[i+1]
-        
-        # Intersect with the triangle
-        weights[i] = np.maximum(0, np.minimum(lower, upper))
+    # Lower and upper slopes for all bands and bins
+    lower = -ramps[:-2] / fdiff[:-1, np.newaxis]
+    upper = ramps[2:] / fdiff[1:, np.newaxis]
+    
+    # Intersect with the triangles
+    weights = np.maximum(0.0, np.minimum(lower, upper, out=lower), out=lower)
     
     # Slaney-style mel is scaled to be approx constant energy per channel
     if not htk:
         enorm = 2.0 / (mel_f[2:n_mels+2] - mel_f[:n_mels])
         weights *= enorm[:, np.newaxis]
     
+    weights.setflags(write=False)
     return weights
 
 def hz_to_mel(frequencies: np.ndarray, htk: bool = False) -> np.ndarray:
     """Convert Hz to Mels."""
+    # Scalar band edges (fmin/fmax) skip the array machinery entirely
+    if np.isscalar(frequencies):
+        if htk:
+            return 2595.0 * math.log10(1.0 + frequencies / 700.0)
+        if frequencies >= _MIN_LOG_HZ:
+            return _MIN_LOG_MEL + math.log(frequencies / _MIN_LOG_HZ) / _LOGSTEP
+        return frequencies / _F_SP
+    
     frequencies = np.asanyarray(frequencies)
     
     if htk:
         return 2595.0 * np.log10(1.0 + frequencies / 700.0)
     
     # Fill in the linear part
-    f_min = 0.0
-    f_sp = 200.0 / 3
-    mels = (frequencies - f_min) / f_sp
+    mels = frequencies / _F_SP
     
     # Fill in the log-scale part
-    min_log_hz = 1000.0  # beginning of log region (Hz)
-    min_log_mel = (min_log_hz - f_min) / f_sp  # same (Mels)
-    logstep = np.log(6.4) / 27.0  # step size for log region
-    
     if frequencies.ndim:
-        log_t = (frequencies >= min_log_hz)
-        mels[log_t] = min_log_mel + np.log(frequencies[log_t] / min_log_hz) / logstep
-    elif frequencies >= min_log_hz:
-        mels = min_log_mel + np.log(frequencies / min_log_hz) / logstep
+        log_t = (frequencies >= _MIN_LOG_HZ)
+        mels[log_t] = _MIN_LOG_MEL + np.log(frequencies[log_t] / _MIN_LOG_HZ) / _LOGSTEP
+    elif frequencies >= _MIN_LOG_HZ:
+        mels = _MIN_LOG_MEL + np.log(frequencies / _MIN_LOG_HZ) / _LOGSTEP
     
     return mels
 
@@ -242,16 +348,10 @@ def mel_frequencies(n_mels: int = 128, fmin: float = 0.0, fmax: float = 11025.0,
         return 700.0 * (10.0 ** (mels / 2595.0) - 1.0)
     
     # Fill in the linear scale
-    f_min = 0.0
-    f_sp = 200.0 / 3
-    freqs = f_min + f_sp * mels
+    freqs = _F_SP * mels
     
     # And now the nonlinear scale
-    min_log_hz = 1000.0  # beginning of log region (Hz)
-    min_log_mel = (min_log_hz - f_min) / f_sp  # same (Mels)
-    logstep = np.log(6.4) / 27.0  # step size for log region
-    
-    log_t = (mels >= min_log_mel)
-    freqs[log_t] = min_log_hz * np.exp(logstep * (mels[log_t] - min_log_mel))
+    log_t = (mels >= _MIN_LOG_MEL)
+    freqs[log_t] = _MIN_LOG_HZ * np.exp(_LOGSTEP * (mels[log_t] - _MIN_LOG_MEL))
     
     return freqs
@@ -10,5 +10,10 @@ setup(
         'scipy',
         'pydub',
     ],
+    extras_require={
+        # The HTTP integration tests are I/O-bound; run them with `pytest -n auto --dist loadgroup`
+        # Client libraries the integration scripts use to drive a running server
+        'test': ['pytest', 'pytest-xdist', 'requests', 'requests-toolbelt', 'websocket-client'],
+    },
     python_requires='>=3.8',
 )
@@ -0,0 +1,20 @@
+"""Output helpers shared by the integration test modules."""
+import json
+import logging
+import os
+
+# LOG_LEVEL=DEBUG prints full response bodies; otherwise only a one-line summary
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
+
+def dump_response(data):
+    """Print an API response, in full at DEBUG level and as a short summary otherwise."""
+    if logger.isEnabledFor(logging.DEBUG):
+        print(f"Response: {json.dumps(data, indent=2)}")
+    elif isinstance(data, dict):
+        # Scalar fields only (success, error, ids); skips walking large lists like the song catalogue
+        summary = {k: v for k, v in data.items() if not isinstance(v, (list, dict))}
+        print(f"Response: {summary}")
+    else:
+        print(f"Response: {type(data).__name__}")
@@ -0,0 +1,53 @@
+"""Shared fixtures for the integration tests that talk to a running API server.
+
+The HTTP tests are I/O-bound and can be spread over workers with pytest-xdist:
+``pytest -n auto --dist loadgroup tests/integration``. Tests that change server
+state share an ``xdist_group`` so they stay on one worker, in order.
+"""
+import pytest
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+API_BASE_URL = "http://localhost:5001"
+
+
+def pytest_configure(config):
+    """Load .env once for the whole integration session.
+
+    Variables already exported by the shell are never overridden, and xdist
+    workers inherit the loaded values from the controller.
+    """
+    load_dotenv(override=False)
+
+
+@pytest.fixture(scope="session")
+def api_base_url():
+    """Base URL of the API server under test."""
+    return API_BASE_URL
+
+
+@pytest.fixture(scope="session")
+def ws_url(api_base_url):
+    """WebSocket base URL of the same server (e.g. ws://localhost:5001)."""
+    return "ws" + api_base_url[len("http"):]
+
+
+@pytest.fixture(scope="session")
+def http(api_base_url):
+    """One keep-alive session per test process, so requests reuse pooled connections.
+
+    The server is pinged once up front; if it is down, every HTTP test errors
+    immediately instead of each waiting out its own request timeout.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    try:
+        session.get(f"{api_base_url}/health", timeout=5).raise_for_status()
+    except requests.exceptions.RequestException as e:
+        session.close()
+        pytest.fail(f"API server at {api_base_url} is not reachable: {e}. Is the server running?")
+    yield session
+    session.close()
@@ -2,24 +2,30 @@
 # backend/test_full_flow.py
 import requests
 import websocket
-import threading
 import time
 import json
 import os
 
+from _helpers import dump_response
+
+
 API_BASE_URL = "http://localhost:5001"
 WS_URL = "ws://localhost:5001/identify"
 TEST_SNIPPET_FILE = "test_music.mp3"
+CHUNK_SIZE = 64 * 1024 # Bytes per binary message when streaming the snippet
 SPOTIFY_URL_TO_ADD = "https://open.spotify.com/track/2oenSXLDbWVaaL7QjSGYj5" # "Take on Me" by a-ha
 
-def add_song_to_db():
-    """Step 1: Add a song to the database via REST API."""
+def add_song_to_db(http=requests):
+    """Step 1: Add a song to the database via REST API.
+
+    Pass a requests.Session (e.g. the http fixture) as `http` to reuse its connections.
+    """
     print("\n--- STEP 1: ADDING SONG TO DATABASE ---")
     url = f"{API_BASE_URL}/api/songs"
     payload = {"spotify_url": SPOTIFY_URL_TO_ADD}
     
     try:
-        response = requests.post(url, json=payload, timeout=90) # Long timeout for download
+        response = http.post(url, json=payload, timeout=90) # Long timeout for download
         data = response.json()
         
         if response.status_code in [200, 201] and data.get("success"):
@@ -41,56 +47,44 @@ def match_snippet_via_websocket():
         print(f"❌ ERROR: Test snippet '{TEST_SNIPPET_FILE}' not found.")
         return
 
-    # Use a threading event to wait for the message
-    message_received_event = threading.Event()
-    
-    def on_message(ws, message):
-        print("\n<-- Received from server:")
-        data = json.loads(message)
-        print(json.dumps(data, indent=2))
-        
-        # Check if the match is correct
-        if data.get("status") == "match_found" and data["data"]["title"] == "Lalkara":
-            print("\n✅ SUCCESS: Correct song was identified!")
-        else:
-            print("\n❌ FAILED: Incorrect or no match found.")
-            
-        message_received_event.set()
-        ws.close()
-
-    def on_error(ws, error):
-        print(f"### WebSocket Error: {error} ###")
-        message_received_event.set()
-        ws.close()
+    # Synchronous client on this thread: no helper thread or event, and the
+    # socket timeout bounds the wait for the match result
+    try:
+        ws = websocket.create_connection(WS_URL, timeout=30)
+    except (websocket.WebSocketException, OSError) as e:
+        print(f"### WebSocket Error: {e} ###")
+        return
 
-    def on_open(ws):
+    try:
         print("--> WebSocket opened. Sending audio snippet...")
         with open(TEST_SNIPPET_FILE, "rb") as f:
-            ws.send(f.read(), websocket.ABNF.OPCODE_BINARY)
-        # In a real client, you might keep the connection open, but for this test,
-        # we can close it after sending, or let the server close it.
-        # The backend logic handles the closing after it processes.
+            while chunk := f.read(CHUNK_SIZE):
+                ws.send(chunk, websocket.ABNF.OPCODE_BINARY)
+        # Tell the server the upload is complete so it matches immediately
+        ws.send("end")
 
-    ws_app = websocket.WebSocketApp(WS_URL,
-                                  on_open=on_open,
-                                  on_message=on_message,
-                                  on_error=on_error)
-    
-    # Run the WebSocket client in a separate thread
-    ws_thread = threading.Thread(target=ws_app.run_forever)
-    ws_thread.daemon = True
-    ws_thread.start()
-    
-    # Wait for a message to be received or timeout
-    print("--> Waiting for match result from server...")
-    message_received_event.wait(timeout=30) # Wait up to 30 seconds
-    if not message_received_event.is_set():
+        print("--> Waiting for match result from server...")
+        message = ws.recv()
+    except websocket.WebSocketTimeoutException:
         print("❌ FAILED: Timed out waiting for a response from the server.")
-    
-    ws_app.close()
+        return
+    except (websocket.WebSocketException, OSError) as e:
+        print(f"### WebSocket Error: {e} ###")
+        return
+    finally:
+        ws.close()
+
+    print("\n<-- Received from server:")
+    data = json.loads(message)
+    dump_response(data)
 
+    # Check if the match is correct
+    if data.get("status") == "match_found" and data["data"]["title"] == "Lalkara":
+        print("\n✅ SUCCESS: Correct song was identified!")
+    else:
+        print("\n❌ FAILED: Incorrect or no match found.")
 
-def delete_song_from_db(song_id):
+def delete_song_from_db(song_id, http=requests):
     """Step 3: Clean up by deleting the song."""
     if not song_id:
         print("\n--- SKIPPING CLEANUP (no song_id) ---")
@@ -99,7 +93,7 @@ def delete_song_from_db(song_id):
     print(f"\n--- STEP 3: CLEANING UP SONG ID {song_id} ---")
     url = f"{API_BASE_URL}/api/songs/{song_id}"
     try:
-        response = requests.delete(url)
+        response = http.delete(url)
         if response.status_code == 200:
             print(f"✅ Successfully deleted song {song_id}.")
         else:
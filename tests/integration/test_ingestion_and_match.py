@@ -2,9 +2,13 @@
 import os
 import sys
 import logging
+import threading
 import time
+from collections import defaultdict
 from unittest.mock import patch, DEFAULT # <-- Import DEFAULT
-from pydub import AudioSegment # For creating audio clips
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
 
 # Add project root to Python path
 
@@ -14,9 +18,7 @@ from backend.shazam_core.audio_utils import load_audio
 from backend.services.song_ingester import SongIngester
 from backend.api_clients.spotify_client import SpotifyClient
 from backend.api_clients.youtube_client import YouTubeClient
-from dotenv import load_dotenv
 
-load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -44,27 +46,28 @@ def setup_clean_database():
     logger.info("--- Step 1: Setting up clean database ---")
     if os.path.exists(DB_PATH):
         os.remove(DB_PATH)
-    return DatabaseHandler(db_path=DB_PATH)
+    # The test DB is deleted afterwards, so don't pay for fsyncs on every commit
+    return DatabaseHandler(db_path=DB_PATH, synchronous='OFF')
+
+# Where the current thread's download should be kept instead of deleted.
+# patch() swaps the module attribute for every thread at once, so the threads
+# share one patch and each routes its own file through this slot.
+_download_destination = threading.local()
+
+def _save_instead_of_delete(path):
+    downloaded_song_path = _download_destination.path
+    logger.info(f"-> Mocking os.remove: Renaming {path} to {downloaded_song_path}")
+    os.rename(path, downloaded_song_path)
 
 # Change the signature and logic
 def ingest_from_spotify_and_save(db_handler, ingester, spotify_url, song_index):
+    """Ingest one song, keeping its download. Run inside ingest_songs_from_spotify's os.remove patch."""
     logger.info(f"--- Ingesting song {song_index + 1}: {spotify_url} ---")
     
     # Define a unique path for this song's download
     downloaded_song_path = os.path.join(DOWNLOADS_DIR, f"downloaded_song_{song_index}.mp3")
-
-    with patch('backend.services.song_ingester.os.remove') as mock_os_remove:
-        def save_instead_of_delete(path):
-            logger.info(f"-> Mocking os.remove: Renaming {path} to {downloaded_song_path}")
-            if os.path.exists(downloaded_song_path):
-                # Use the real os.remove if we need to clean up an old version of this specific file
-                # This requires careful handling of the mock or direct call.
-                # For simplicity, ensure DOWNLOADS_DIR is clean before tests.
-                pass 
-            os.rename(path, downloaded_song_path)
-
-        mock_os_remove.side_effect = save_instead_of_delete
-        result = ingester.ingest_from_spotify(spotify_url)
+    _download_destination.path = downloaded_song_path
+    result = ingester.ingest_from_spotify(spotify_url)
     
     if result and result.get("success"):
         logger.info(f"✅ Successfully ingested song. ID: {result['song_id']}, Path: {downloaded_song_path}")
@@ -73,51 +76,127 @@ def ingest_from_spotify_and_save(db_handler, ingester, spotify_url, song_index):
     else:
         logger.error(f"❌ FAILED to ingest song {spotify_url}. Error: {result.get('error') if result else 'Unknown'}")
         return None, None, None
+
+def ingest_songs_from_spotify(db_handler, ingester, spotify_urls: list, max_workers: int = 6) -> list:
+    """Ingest all songs concurrently; returns ingest_from_spotify_and_save's tuple per URL, in order.
+    
+    Downloads are network- and subprocess-bound, so threads overlap them. Each
+    thread writes through its own DatabaseHandler connection and SQLite's busy
+    timeout serializes the inserts.
+    """
+    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+    with patch('backend.services.song_ingester.os.remove', side_effect=_save_instead_of_delete), \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(
+            lambda task: ingest_from_spotify_and_save(db_handler, ingester, task[1], task[0]),
+            enumerate(spotify_urls)
+        ))
         
 # The rest of the script remains the same.
 
+_PCM_INT16_SCALE = 32767.0
+
+def _to_int16_pcm(pcm: np.ndarray) -> np.ndarray:
+    """Quantize float PCM in [-1, 1] to int16 (the source MP3s' own resolution) at half the memory."""
+    return np.round(np.clip(pcm, -1.0, 1.0) * _PCM_INT16_SCALE).astype(np.int16)
+
+def _to_float32_pcm(pcm: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """Up-cast a (slice of) cached PCM to the float32 the fingerprinter expects, into `out` if given."""
+    if pcm.dtype == np.int16:
+        return np.multiply(pcm, np.float32(1.0 / _PCM_INT16_SCALE), out=out, dtype=np.float32)
+    return pcm
+
+def cache_ingested_pcm(ingested_songs: dict, sample_rate: int) -> dict:
+    """Decode each ingested song once and keep its PCM under song_data["pcm"] for the match tests.
+    
+    The cache holds int16 samples; clips are up-cast to float32 only when sliced.
+    """
+    for song_id, song_data in ingested_songs.items():
+        if "pcm" in song_data or not os.path.exists(song_data["path"]):
+            continue
+        try:
+            pcm, _ = load_audio(song_data["path"], target_sample_rate=sample_rate)
+            song_data["pcm"] = _to_int16_pcm(pcm)
+        except Exception as e:
+            logger.error(f"Could not decode '{song_data['path']}' for song ID {song_id}. Error: {e}")
+    return ingested_songs
+
+# Per-process state for the clip-matching pool, set up by _init_clip_worker.
+# SQLite connections can't be shared across processes, so each worker opens its own.
+_clip_worker_matcher = None
+_clip_worker_pcm = None
+_clip_worker_buffer = None
+
+def _init_clip_worker(db_path, fingerprinter_instance, song_pcm, max_clip_samples):
+    global _clip_worker_matcher, _clip_worker_pcm, _clip_worker_buffer
+    fingerprinter_instance.fft_workers = 1  # one process per core already
+    _clip_worker_matcher = FingerprintMatcher(
+        db_handler=DatabaseHandler(db_path=db_path), fingerprinter_instance=fingerprinter_instance
+    )
+    _clip_worker_pcm = song_pcm
+    # Every clip is up-cast into this one buffer. generate_fingerprints doesn't
+    # keep a reference to its input, so the next clip can overwrite it.
+    _clip_worker_buffer = np.empty(max_clip_samples, dtype=np.float32)
+
+def _match_clip(song_id, start_sample, end_sample):
+    """Fingerprint one clip of a song's PCM and match it against the database."""
+    clip = _to_float32_pcm(
+        _clip_worker_pcm[song_id][start_sample:end_sample],
+        out=_clip_worker_buffer[:end_sample - start_sample]
+    )
+    fps = _clip_worker_matcher.fingerprinter.generate_fingerprints(clip)
+    return _clip_worker_matcher.match_fingerprints(fps)
+
 def test_partial_clips_match(
     db_handler, 
     fingerprinter_instance, 
-    ingested_songs: dict, # Dict of {song_id: {"path": "...", "title": "..."}}
+    ingested_songs: dict, # Dict of {song_id: {"path": "...", "title": "...", "pcm": optional decoded audio}}
     clip_durations: list,
     start_offset_percentages: list,
-    min_match_score_threshold: int
+    min_match_score_threshold: int,
+    max_workers: int = None,
+    exhaustive: bool = False
 ):
+    """
+    Find the shortest clip duration that confidently matches each song.
+    
+    Durations are tested shortest first; once a song matches, its longer
+    durations are skipped unless exhaustive is set (full sweep data).
+    """
     logger.info("\n--- Starting Partial Clip Matching Tests ---")
-    matcher = FingerprintMatcher(db_handler=db_handler, fingerprinter_instance=fingerprinter_instance)
     
     overall_success = True
     min_time_results = {}
+    song_pcm = {}
+    clip_tasks = defaultdict(list) # {clip_duration_s: [(song_id, clip_name, start_sample, end_sample)]}
+    sorted_durations = tuple(sorted(set(clip_durations))) # Test shorter durations first
+    sr = fingerprinter_instance.sample_rate # load_audio resamples every song to this rate
 
     for expected_song_id, song_data in ingested_songs.items():
         full_audio_path = song_data["path"]
         song_title = song_data["title"]
-        logger.info(f"\n-- Testing clips for song: '{song_title}' (ID: {expected_song_id}) --")
+        logger.info(f"\n-- Preparing clips for song: '{song_title}' (ID: {expected_song_id}) --")
         min_time_results[expected_song_id] = {"title": song_title, "min_duration_for_match": float('inf'), "best_score_at_min_duration": 0}
         
-        if not os.path.exists(full_audio_path):
-            logger.error(f"  SKIP: Full audio file not found for '{song_title}': {full_audio_path}")
-            overall_success = False
-            continue
-
-        try:
-            full_audio = AudioSegment.from_file(full_audio_path)
-            full_duration_ms = len(full_audio)
-            full_duration_s = full_duration_ms / 1000.0
-        except Exception as e:
-            logger.error(f"  SKIP: Could not load audio file '{full_audio_path}'. Error: {e}")
-            overall_success = False
-            continue
-
-        found_match_for_song = False
-        for clip_duration_s in sorted(clip_durations): # Test shorter durations first
-            if found_match_for_song and clip_duration_s >= min_time_results[expected_song_id]["min_duration_for_match"]:
-                 # Already found a match with this or shorter duration for this song, can optimize by skipping longer ones if only min_time is needed
-                 # For comprehensive testing, we might want to continue. For now, let's be comprehensive.
-                 pass 
+        # Decode once (or reuse the cached PCM); clips are sliced from it in memory
+        full_pcm = song_data.get("pcm")
+        if full_pcm is None:
+            if not os.path.exists(full_audio_path):
+                logger.error(f"  SKIP: Full audio file not found for '{song_title}': {full_audio_path}")
+                overall_success = False
+                continue
+            try:
+                full_pcm, _ = load_audio(full_audio_path, target_sample_rate=sr)
+                full_pcm = _to_int16_pcm(full_pcm)
+            except Exception as e:
+                logger.error(f"  SKIP: Could not load audio file '{full_audio_path}'. Error: {e}")
+                overall_success = False
+                continue
+        song_pcm[expected_song_id] = full_pcm
+        full_duration_s = len(full_pcm) / sr
+        planned_ranges = set() # (start_sample, end_sample) already queued for this song
 
-            logger.info(f"  -- Testing with clip duration: {clip_duration_s}s --")
+        for clip_duration_s in sorted_durations:
             if clip_duration_s > full_duration_s:
                 logger.info(f"    SKIP: Clip duration {clip_duration_s}s exceeds song duration {full_duration_s:.2f}s.")
                 continue
@@ -128,64 +207,77 @@ def test_partial_clips_match(
                 if start_time_s + clip_duration_s > full_duration_s:
                     start_time_s = max(0, full_duration_s - clip_duration_s) # Adjust start time
                 
-                start_time_ms = int(start_time_s * 1000)
-                end_time_ms = start_time_ms + int(clip_duration_s * 1000)
+                start_sample = int(start_time_s * sr)
+                end_sample = start_sample + int(clip_duration_s * sr)
                 
-                # Ensure end_time_ms does not exceed full_duration_ms
-                end_time_ms = min(end_time_ms, full_duration_ms)
+                # Ensure end_sample does not exceed the song length
+                end_sample = min(end_sample, len(full_pcm))
                 # Ensure clip has a minimum length (e.g. 1s) after adjustment
-                if (end_time_ms - start_time_ms) < 1000:
-                    logger.info(f"    SKIP: Adjusted clip for {song_title} is too short ({end_time_ms - start_time_ms}ms). Start: {start_time_s:.2f}s, Duration: {clip_duration_s}s.")
+                if (end_sample - start_sample) < sr:
+                    logger.info(f"    SKIP: Adjusted clip for {song_title} is too short ({(end_sample - start_sample) / sr:.2f}s). Start: {start_time_s:.2f}s, Duration: {clip_duration_s}s.")
                     continue
 
-                clip_audio = full_audio[start_time_ms:end_time_ms]
-                
-                temp_clip_dir = os.path.join(DOWNLOADS_DIR, "temp_clips")
-                os.makedirs(temp_clip_dir, exist_ok=True)
-                clip_file_name = f"clip_song{expected_song_id}_dur{clip_duration_s}s_start{start_time_s:.1f}s.mp3"
-                temp_clip_path = os.path.join(temp_clip_dir, clip_file_name)
-
-                try:
-                    clip_audio.export(temp_clip_path, format="mp3")
-                except Exception as e:
-                    logger.error(f"    ERROR: Failed to export clip {temp_clip_path}. Error: {e}")
-                    overall_success = False
+                clip_name = f"clip_song{expected_song_id}_dur{clip_duration_s}s_start{start_time_s:.1f}s"
+                # Offsets that ran past the end collapse onto the same adjusted range;
+                # the same samples would fingerprint and match identically, so queue them once
+                if (start_sample, end_sample) in planned_ranges:
+                    logger.info(f"    SKIP: {clip_name} duplicates an already planned clip.")
                     continue
-                
-                logger.info(f"    Matching clip: {clip_file_name} (Song: '{song_title}')")
-                results = matcher.match_file(temp_clip_path)
+                planned_ranges.add((start_sample, end_sample))
+                clip_tasks[clip_duration_s].append((expected_song_id, clip_name, start_sample, end_sample))
 
+    # Each clip is an independent fingerprint + match, so spread them over all cores.
+    # Workers are forked with the decoded PCM, so tasks only carry sample ranges.
+    # Durations run as waves, shortest first, so songs that already matched can drop out.
+    songs_to_test = set(song_pcm)
+    max_clip_samples = max((task[3] - task[2] for tasks in clip_tasks.values() for task in tasks), default=0)
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_clip_worker,
+        initargs=(db_handler.db_path, fingerprinter_instance, song_pcm, max_clip_samples)
+    ) as executor:
+        for clip_duration_s in sorted_durations:
+            wave = [task for task in clip_tasks.get(clip_duration_s, ()) if task[0] in songs_to_test]
+            if not wave:
+                continue
+            logger.info(f"  -- Testing with clip duration: {clip_duration_s}s ({len(wave)} clips) --")
+            all_results = executor.map(
+                _match_clip,
+                [task[0] for task in wave],
+                [task[2] for task in wave],
+                [task[3] for task in wave]
+            )
+            for (expected_song_id, clip_name, _, _), results in zip(wave, all_results):
                 if not results:
-                    logger.info(f"    - NO MATCH for {clip_file_name} (Expected ID: {expected_song_id})")
+                    logger.info(f"    - NO MATCH for {clip_name} (Expected ID: {expected_song_id})")
+                    continue
+
+                best_match = results[0]
+                matched_song_id = best_match['song_id']
+                score = best_match['score']
+            
+                if matched_song_id == expected_song_id and score >= min_match_score_threshold:
+                    logger.info(f"    ✅ CORRECT MATCH: ID {matched_song_id} (Score: {score}) for {clip_name}")
+                    song_result = min_time_results[expected_song_id]
+                    if clip_duration_s < song_result["min_duration_for_match"]:
+                        song_result["min_duration_for_match"] = clip_duration_s
+                        song_result["best_score_at_min_duration"] = score
+                    elif clip_duration_s == song_result["min_duration_for_match"]:
+                        song_result["best_score_at_min_duration"] = max(score, song_result["best_score_at_min_duration"])
+                elif matched_song_id == expected_song_id:
+                    logger.info(f"    - CORRECT SONG, LOW SCORE: ID {matched_song_id} (Score: {score} < {min_match_score_threshold}) for {clip_name}")
                 else:
-                    best_match = results[0]
-                    matched_song_id = best_match['song_id']
-                    score = best_match['score']
-                    
-                    if matched_song_id == expected_song_id and score >= min_match_score_threshold:
-                        logger.info(f"    ✅ CORRECT MATCH: ID {matched_song_id} (Score: {score}) for {clip_file_name}")
-                        if clip_duration_s < min_time_results[expected_song_id]["min_duration_for_match"]:
-                            min_time_results[expected_song_id]["min_duration_for_match"] = clip_duration_s
-                            min_time_results[expected_song_id]["best_score_at_min_duration"] = score
-                        elif clip_duration_s == min_time_results[expected_song_id]["min_duration_for_match"]:
-                            min_time_results[expected_song_id]["best_score_at_min_duration"] = max(score, min_time_results[expected_song_id]["best_score_at_min_duration"])
-                        found_match_for_song = True # Mark that we found at least one good match for this song
-                    elif matched_song_id == expected_song_id:
-                        logger.info(f"    - CORRECT SONG, LOW SCORE: ID {matched_song_id} (Score: {score} < {min_match_score_threshold}) for {clip_file_name}")
-                    else:
-                        logger.info(f"    ❌ WRONG SONG: Matched ID {matched_song_id} (Score: {score}), Expected ID {expected_song_id} for {clip_file_name}")
-                        # If a wrong song is identified with high confidence, that's a concern.
-                        if score >= min_match_score_threshold:
-                             overall_success = False # Treat confident wrong match as failure
-                
-                if os.path.exists(temp_clip_path):
-                    os.remove(temp_clip_path)
-        
-        if os.path.exists(temp_clip_dir) and not os.listdir(temp_clip_dir):
-            try:
-                os.rmdir(temp_clip_dir)
-            except OSError as e:
-                logger.warning(f"Could not remove temp_clips dir {temp_clip_dir}: {e}")
+                    logger.info(f"    ❌ WRONG SONG: Matched ID {matched_song_id} (Score: {score}), Expected ID {expected_song_id} for {clip_name}")
+                    # If a wrong song is identified with high confidence, that's a concern.
+                    if score >= min_match_score_threshold:
+                         overall_success = False # Treat confident wrong match as failure
+
+            if not exhaustive:
+                # Longer clips of a song that already matched add nothing to the minimum
+                songs_to_test = {song_id for song_id in songs_to_test
+                                 if min_time_results[song_id]["min_duration_for_match"] == float('inf')}
+                if not songs_to_test:
+                    break
 
     logger.info("\n--- Summary of Minimum Durations for Correct Match (Score >= {min_match_score_threshold}) ---")
     for song_id, data in min_time_results.items():
@@ -197,20 +289,24 @@ def test_partial_clips_match(
 
     return overall_success
 
-def test_local_file_match(db_handler, fingerprinter, expected_song_id, downloaded_song_path, song_title="Unknown Song"):
+def test_local_file_match(db_handler, fingerprinter, expected_song_id, downloaded_song_path, song_title="Unknown Song", pcm=None):
     logger.info(f"--- Matching FULL downloaded file for '{song_title}' (ID: {expected_song_id}) ---")
     logger.info(f"--- Using file: {downloaded_song_path} ---")
     # ... (rest of the function remains similar, but uses the passed downloaded_song_path)
     # The assertion for score > 10 might be too low for a full match.
     # Consider increasing it or making it a parameter.
     # For now, let's keep it to ensure basic functionality.
-    if not os.path.exists(downloaded_song_path): # Use the parameter
+    if pcm is None and not os.path.exists(downloaded_song_path): # Use the parameter
         logger.error(f"FATAL: Test file '{downloaded_song_path}' does not exist.")
         return False
         
     matcher = FingerprintMatcher(db_handler=db_handler, fingerprinter_instance=fingerprinter) # Corrected db_handler
     logger.info(f"Attempting to match file: {downloaded_song_path}")
-    results = matcher.match_file(downloaded_song_path) # Use the parameter
+    if pcm is not None:
+        # Already decoded by cache_ingested_pcm; skip the second decode
+        results = matcher.match_fingerprints(fingerprinter.generate_fingerprints(_to_float32_pcm(pcm)))
+    else:
+        results = matcher.match_file(downloaded_song_path) # Use the parameter
     
     if not results:
         logger.error("❌ MATCH FAILED: No results returned.")
@@ -239,14 +335,15 @@ def cleanup(ingested_song_data_dict): # Pass the dictionary of song paths
     
     # Remove all downloaded song files
     if os.path.exists(DOWNLOADS_DIR):
-        for filename in os.listdir(DOWNLOADS_DIR):
-            file_path = os.path.join(DOWNLOADS_DIR, filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                    logger.info(f"Removed {file_path}")
-            except Exception as e:
-                logger.error(f'Failed to delete {file_path}. Reason: {e}')
+        # DirEntry caches the type from the directory read, so no extra stat() per file
+        with os.scandir(DOWNLOADS_DIR) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file(follow_symlinks=False) or entry.is_symlink():
+                        os.unlink(entry.path)
+                        logger.info(f"Removed {entry.path}")
+                except Exception as e:
+                    logger.error(f'Failed to delete {entry.path}. Reason: {e}')
         # Optionally remove the directory itself if empty
         if not os.listdir(DOWNLOADS_DIR):
             os.rmdir(DOWNLOADS_DIR)
@@ -1,4 +1,5 @@
 """Integration tests for matching local audio files against the database."""
+import io
 import os
 import sys
 import logging
@@ -9,7 +10,7 @@ from pydub import AudioSegment
 # Import our project's components
 from backend.database.db_handler import DatabaseHandler
 from backend.shazam_core.fingerprinting import Fingerprinter, FingerprintMatcher
-from backend.shazam_core.audio_utils import load_audio
+from backend.shazam_core.audio_utils import load_audio, load_audio_stream
 
 # --- Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,9 +18,9 @@ logger = logging.getLogger(__name__)
 
 DB_PATH = "test_local_db.db"
 FULL_SONG_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "backend", "test_music.mp3")
-SNIPPET_PATH = "temp_snippet.mp3"
 SNIPPET_START_MS = 30 * 1000  # Start snippet at 30 seconds
 SNIPPET_DURATION_MS = 10 * 1000 # Make it 10 seconds long
+CONFIDENT_MATCH_SCORE = 20  # Stop looking up the snippet's hashes once the leader reaches this score
 
 # --- Test Functions ---
 
@@ -55,12 +56,9 @@ def ingest_full_song(db_handler, fingerprinter):
         # Generate fingerprints for the full song
         audio_data, _ = load_audio(FULL_SONG_PATH, target_sample_rate=fingerprinter.sample_rate)
         fingerprints = fingerprinter.generate_fingerprints(audio_data)
-        
-        # Assign the correct song_id to each fingerprint
-        for fp in fingerprints:
-            fp.song_id = song_id
-            
-        # Store the fingerprints in the database
+
+
+        # Store the fingerprints in the database; add_fingerprints attaches the song_id
         db_handler.add_fingerprints(song_id, fingerprints)
         logger.info(f"✅ Stored {len(fingerprints)} fingerprints for Song ID {song_id}.")
         return song_id
@@ -68,8 +66,15 @@ def ingest_full_song(db_handler, fingerprinter):
         logger.error(f"Failed to ingest song: {e}", exc_info=True)
         return None
 
-def create_test_snippet():
-    """Creates a short audio snippet from the full song."""
+def create_test_snippet(sample_rate=None):
+    """Creates a short audio snippet from the full song.
+    
+    The snippet is encoded as uncompressed mono WAV into memory, at `sample_rate`
+    when given (pass the fingerprinter's rate so decoding doesn't resample it again).
+    
+    Returns:
+        A BytesIO positioned at the start of the WAV data, or None on failure
+    """
     logger.info("--- Step 3: Creating test snippet from full song ---")
     try:
         full_song_audio = AudioSegment.from_file(FULL_SONG_PATH)
@@ -77,29 +82,37 @@ def create_test_snippet():
         
         if len(full_song_audio) < snippet_end_ms:
             logger.error("Song is too short to create a snippet at the configured time.")
-            return False
-
-        snippet = full_song_audio[SNIPPET_START_MS:snippet_end_ms]
-        snippet.export(SNIPPET_PATH, format="mp3")
-        logger.info(f"✅ Snippet created successfully: {SNIPPET_PATH}")
-        return True
+            return None
+
+        snippet = full_song_audio[SNIPPET_START_MS:snippet_end_ms].set_channels(1)
+        if sample_rate:
+            snippet = snippet.set_frame_rate(sample_rate)
+        # WAV is written directly; an MP3 would cost an ffmpeg encode and add codec artifacts
+        snippet_buffer = io.BytesIO()
+        snippet.export(snippet_buffer, format="wav")
+        snippet_buffer.seek(0)
+        logger.info(f"✅ Snippet created successfully ({snippet_buffer.getbuffer().nbytes} bytes in memory)")
+        return snippet_buffer
     except Exception as e:
         logger.error(f"Failed to create snippet: {e}", exc_info=True)
-        return False
+        return None
 
-def match_snippet(db_handler, fingerprinter, expected_song_id):
+def match_snippet(db_handler, fingerprinter, expected_song_id, snippet_buffer):
     """Matches the snippet against the database and validates the result."""
     logger.info("--- Step 4: Matching snippet against database ---")
     try:
         matcher = FingerprintMatcher(db_handler, fingerprinter)
         
-        # Generate fingerprints for the query snippet
-        snippet_audio, _ = load_audio(SNIPPET_PATH, target_sample_rate=fingerprinter.sample_rate)
+        # Decode and fingerprint the in-memory snippet; nothing touches disk
+        snippet_audio, _ = load_audio_stream(snippet_buffer, target_sample_rate=fingerprinter.sample_rate)
         query_fingerprints = fingerprinter.generate_fingerprints(snippet_audio)
         logger.info(f"Generated {len(query_fingerprints)} fingerprints for the snippet.")
         
-        # Perform the match
-        results = matcher.match_fingerprints(query_fingerprints)
+        # Perform the match, stopping early once the best candidate is confident
+        results = []
+        for results in matcher.iter_matches(query_fingerprints):
+            if results and results[0]['score'] >= CONFIDENT_MATCH_SCORE:
+                break
         
         # --- Analyze the Results ---
         if not results:
@@ -127,7 +140,7 @@ def match_snippet(db_handler, fingerprinter, expected_song_id):
 def cleanup():
     """Removes temporary files created during the test."""
     logger.info("--- Step 5: Cleaning up temporary files ---")
-    for f in [DB_PATH, SNIPPET_PATH]:
+    for f in [DB_PATH]:
         if os.path.exists(f):
             os.remove(f)
             logger.info(f"Removed {f}")
@@ -3,26 +3,40 @@
 import os
 import sys
 import logging
-from dotenv import load_dotenv
+import pytest
 
-# Add project root to Python path
+from backend.api_clients.spotify_client import SpotifyClient
+from backend.api_clients.youtube_client import YouTubeClient
+from backend.database.db_handler import DatabaseHandler
 
-# Load environment variables
-load_dotenv()
+# Add project root to Python path
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def test_api_clients():
+@pytest.fixture(scope="module", autouse=True)
+def disk_cache():
+    """Serve repeated Spotify/YouTube metadata lookups from the on-disk cache, for this module only."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("SHAZAM_CACHE", os.getenv("SHAZAM_CACHE", "1"))
+        yield
+
+@pytest.fixture(scope="session")
+def spotify():
+    """Spotify client built (and authenticated) once per test session."""
+    return SpotifyClient()
+
+@pytest.fixture(scope="session")
+def youtube():
+    """YouTube client built once per test session."""
+    return YouTubeClient()
+
+def test_api_clients(spotify, youtube):
     """Test Spotify and YouTube API clients."""
     print("\n--- Testing API Clients ---")
     try:
-        from backend.api_clients.spotify_client import SpotifyClient
-        from backend.api_clients.youtube_client import YouTubeClient
-        
         # Test Spotify
-        spotify = SpotifyClient()
         track_url = "https://open.spotify.com/track/0VjIjW4GlUZAMYd2vXMi3b" # "Mr. Brightside"
         metadata = spotify.get_track_metadata(track_url)
         assert metadata['title'] == "Blinding Lights"
@@ -30,7 +44,6 @@ def test_api_clients():
         print("✅ SpotifyClient: Successfully fetched metadata.")
 
         # Test YouTube
-        youtube = YouTubeClient()
         query = "The Killers - Mr. Brightside"
         results = youtube.search_videos(query, max_results=1)
         assert len(results) > 0
@@ -46,37 +59,47 @@ def test_database_handler():
     """Test the DatabaseHandler methods."""
     print("\n--- Testing Database Handler ---")
     try:
-        from backend.database.db_handler import DatabaseHandler
-        
-        # Use an in-memory or test-specific DB
-        db_handler = DatabaseHandler()
+        # In-memory DB: no file, no journal or fsync traffic. Each thread keeps one
+        # connection, so the schema and rows persist for the whole test.
+        db_handler = DatabaseHandler(db_path=':memory:')
         print("✅ DB Handler: Initialized in-memory database.")
 
-        # Test add_song and get_song_by_id
-        song_id = db_handler.add_song(
-            title="Test Song",
-            artist="Test Artist",
-            source_type="test",
-            source_id="12345"
-        )
-        assert song_id is not None
-        print(f"✅ DB Handler: Added song with ID {song_id}.")
+        # One transaction for the whole sequence instead of a commit per call
+        with db_handler.transaction():
+            # Test add_song and get_song_by_id
+            song_id = db_handler.add_song(
+                title="Test Song",
+                artist="Test Artist",
+                source_type="test",
+                source_id="12345"
+            )
+            assert song_id is not None
+            print(f"✅ DB Handler: Added song with ID {song_id}.")
         
-        song = db_handler.get_song_by_id(song_id)
-        assert song['title'] == "Test Song"
-        print("✅ DB Handler: Retrieved song by ID successfully.")
+            song = db_handler.get_song_by_id(song_id)
+            assert song['title'] == "Test Song"
+            print("✅ DB Handler: Retrieved song by ID successfully.")
         
-        # Test get_all_songs
-        songs = db_handler.get_all_songs()
-        assert len(songs) == 1
-        print("✅ DB Handler: get_all_songs returned correct count.")
+            # Test get_all_songs
+            songs = db_handler.get_all_songs()
+            assert len(songs) == 1
+            print("✅ DB Handler: get_all_songs returned correct count.")
+
+            # Test add_songs_bulk: one transaction for the batch, one SELECT to check it
+            inserted = db_handler.add_songs_bulk(
+                {"title": f"Bulk Song {i}", "artist": f"Bulk Artist {i}", "source_type": "test", "source_id": f"bulk-{i}"}
+                for i in range(100)
+            )
+            assert inserted == 100
+            assert len(db_handler.get_all_songs()) == 101
+            print("✅ DB Handler: add_songs_bulk inserted 100 songs.")
 
-        # Test delete_song
-        deleted = db_handler.delete_song(song_id)
-        assert deleted is True
-        song_after_delete = db_handler.get_song_by_id(song_id)
-        assert song_after_delete is None
-        print("✅ DB Handler: Deleted song successfully.")
+            # Test delete_song
+            deleted = db_handler.delete_song(song_id)
+            assert deleted is True
+            song_after_delete = db_handler.get_song_by_id(song_id)
+            assert song_after_delete is None
+            print("✅ DB Handler: Deleted song successfully.")
 
         print("--- Database Handler Tests Passed ---\n")
     except Exception as e:
@@ -4,10 +4,14 @@ This script tests the `/api/songs` endpoint for audio file uploads with metadata
 """
 import os
 import sys
+import pytest
 import requests
+from requests_toolbelt.multipart.encoder import MultipartEncoder
 
-def test_upload_audio(api_url, audio_file_path, title, artist, album=None):
-    """Test uploading an audio file to the API.
+SAMPLE_AUDIO_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'sample.wav')
+
+def upload_audio(api_url, audio_file_path, title, artist, album=None, http=requests):
+    """Upload an audio file to the API.
     
     Args:
         api_url: Base URL of the API (e.g., 'http://localhost:5001')
@@ -15,33 +19,51 @@ def test_upload_audio(api_url, audio_file_path, title, artist, album=None):
         title: Song title
         artist: Artist name
         album: Album name (optional)
+        http: requests module or Session to send with (e.g. the http fixture)
+
+    Returns:
+        The new song's ID, or None if the upload failed
     """
     if not os.path.isfile(audio_file_path):
         print(f"Error: File not found: {audio_file_path}")
-        return False
+        return None
     
     url = f"{api_url.rstrip('/')}/api/songs"
-    files = {'file': (os.path.basename(audio_file_path), open(audio_file_path, 'rb'))}
-    data = {'title': title, 'artist': artist}
+    fields = {'title': title, 'artist': artist}
     
     if album:
-        data['album'] = album
+        fields['album'] = album
     
     try:
-        print(f"Uploading {audio_file_path}...")
-        response = requests.post(url, files=files, data=data)
+        with open(audio_file_path, 'rb') as audio_file:
+            # The encoder reads the file in chunks as the body is sent, so the upload
+            # is never held in memory in full (a files= dict is read up front)
+            fields['file'] = (os.path.basename(audio_file_path), audio_file, 'audio/mpeg')
+            encoder = MultipartEncoder(fields=fields)
+            print(f"Uploading {audio_file_path}...")
+            response = http.post(url, data=encoder, headers={'Content-Type': encoder.content_type})
         result = response.json()
         
         if response.status_code == 200 and result.get('success'):
             print(f"Success! Song ID: {result.get('song_id')}")
             print(f"Message: {result.get('message')}")
-            return True
+            return result.get('song_id')
         else:
             print(f"Error: {result.get('error', 'Unknown error')}")
-            return False
+            return None
             
     except Exception as e:
         print(f"Request failed: {str(e)}")
-        return False
-    finally:
-        files['file'][1].close()
+        return None
+
+@pytest.mark.skip(reason="No upload endpoint: POST /api/songs (add_from_spotify) only accepts a JSON "
+                         "spotify_url and answers a multipart file upload with 415")
+@pytest.mark.xdist_group("song_writes")
+def test_upload_audio(http, api_base_url):
+    """Test uploading an audio file with metadata, then remove the new song."""
+    if not os.path.exists(SAMPLE_AUDIO_FILE):
+        pytest.skip(f"Sample audio file not found: {SAMPLE_AUDIO_FILE}")
+    song_id = upload_audio(api_base_url, SAMPLE_AUDIO_FILE, "Upload Test Song", "Upload Test Artist",
+                           album="Upload Test Album", http=http)
+    assert song_id is not None
+    http.delete(f"{api_base_url}/api/songs/{song_id}", timeout=10)
@@ -1,47 +1,44 @@
 """Integration tests for the WebSocket communication and real-time client updates."""
 # backend/test_websocket.py
+import pytest
 import websocket
-import threading
-import time
 import json
 import os
 
-WS_URL = "ws://localhost:5001/identify"
-TEST_AUDIO_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "backend", "test_music.mp3") # Make sure this file exists!
+from _helpers import dump_response
 
-def on_message(ws, message):
-    print("\n<-- Received from server:")
-    data = json.loads(message)
-    print(json.dumps(data, indent=2))
-    ws.close()
 
-def on_error(ws, error):
-    print(f"### WebSocket Error: {error} ###")
-    ws.close()
+WS_URL = "ws://localhost:5001/identify"
+TEST_AUDIO_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "backend", "test_music.MP3") # Make sure this file exists!
+CHUNK_SIZE = 64 * 1024 # Bytes per binary message
 
-def on_close(ws, close_status_code, close_msg):
-    print("### WebSocket Closed ###")
+def test_identify_over_websocket(ws_url):
+    """Test streaming an audio file to /identify and receiving a JSON result."""
+    if not os.path.exists(TEST_AUDIO_FILE):
+        pytest.skip(f"Test audio file not found: {TEST_AUDIO_FILE}")
 
-def on_open(ws):
-    def run(*args):
+    # Synchronous client: the socket timeout bounds every send and the wait for
+    # the result, so a server that never replies fails the test instead of hanging it
+    ws = websocket.create_connection(f"{ws_url}/identify", timeout=30)
+    try:
         print("--> WebSocket opened. Sending audio file...")
-        try:
-            with open(TEST_AUDIO_FILE, "rb") as f:
-                audio_bytes = f.read()
-            
-            # Send the binary data
-            ws.send(audio_bytes, websocket.ABNF.OPCODE_BINARY)
-            print(f"--> Sent {len(audio_bytes)} bytes of audio data.")
-            
-            # The server will process after the connection closes when the client is done sending
-            # In a real streaming scenario, you'd send an 'end' message. For this test,
-            # we just close the connection after sending the file.
-            time.sleep(1) # Give a moment for data to be sent
-            ws.close()
-            print("--> Audio sent. Connection closed.")
-            
-        except FileNotFoundError:
-            print(f"ERROR: Test audio file not found at '{TEST_AUDIO_FILE}'")
-            ws.close()
-            
-    threading.Thread(target=run).start()
\ No newline at end of file
+        # Stream the file as a series of binary messages; /identify appends each
+        # one to its buffer as it arrives, so only one chunk is held here at a time
+        sent = 0
+        with open(TEST_AUDIO_FILE, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                ws.send(chunk, websocket.ABNF.OPCODE_BINARY)
+                sent += len(chunk)
+        print(f"--> Sent {sent} bytes of audio data.")
+
+        # Tell the server the upload is complete so it matches immediately
+        ws.send("end")
+        print("--> Audio sent. Waiting for result...")
+        message = ws.recv()
+    finally:
+        ws.close()
+
+    print("\n<-- Received from server:")
+    data = json.loads(message)
+    dump_response(data)
+    assert isinstance(data, dict), "No JSON result received from /identify"
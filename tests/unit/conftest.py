@@ -0,0 +1,44 @@
+"""Shared fixtures for the unit tests."""
+import contextlib
+
+import numpy as np
+import pytest
+
+from backend.shazam_core.fingerprinting import FingerprintArray
+
+
+@pytest.fixture
+def make_fingerprints():
+    """Factory for a FingerprintArray of n fingerprints, built as two uint32 arrays.
+
+    Hashes count up from first_hash and offsets from 0 in steps of offset_step,
+    so tests get distinct, predictable values without building them one at a time.
+    """
+    def _make(n, first_hash=123, offset_step=100):
+        return FingerprintArray(
+            hash=np.arange(first_hash, first_hash + n, dtype=np.uint32),
+            offset=np.arange(0, n * offset_step, offset_step, dtype=np.uint32),
+        )
+    return _make
+
+
+class _RollbackTest(Exception):
+    """Raised at teardown to roll back the test's transaction."""
+
+
+@contextlib.contextmanager
+def _rolled_back(db):
+    with contextlib.suppress(_RollbackTest):
+        with db.transaction():
+            yield db
+            raise _RollbackTest
+
+
+@pytest.fixture
+def rolled_back():
+    """Context manager that runs a test inside a transaction on db and rolls it back.
+
+    Lets a test reuse a session-scoped DatabaseHandler and still start from
+    the same database state, without rebuilding the schema for every test.
+    """
+    return _rolled_back
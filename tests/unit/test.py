@@ -3,11 +3,9 @@ import asyncio
 
 async def test_ws():
     async with websockets.connect('ws://localhost:5000/tasks/cd4e137a-b62a-45dd-bb6f-6868f9fda187') as ws:
-        try:
-            while True:
-                message = await ws.recv()
-                print(message)
-        except websockets.exceptions.ConnectionClosedOK:
-            print("Connection closed by server.")
+        # Iteration ends cleanly when the server closes the connection normally
+        async for message in ws:
+            print(message)
+        print("Connection closed by server.")
 
-asyncio.get_event_loop().run_until_complete(test_ws())
\ No newline at end of file
+asyncio.run(test_ws())
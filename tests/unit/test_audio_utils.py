@@ -1,7 +1,8 @@
 import pytest
 import numpy as np
 import os
-from backend.shazam_core.audio_utils import load_audio, load_audio_from_bytes, preprocess_audio
+import shutil
+from backend.shazam_core.audio_utils import load_audio, load_audio_from_bytes, load_audio_stream, preprocess_audio
 from pydub import AudioSegment
 import io
 
@@ -9,32 +10,77 @@ import io
 # Adjust if tests/data is not found relative to where pytest is run
 SAMPLE_WAV_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'sample.wav')
 SAMPLE_MP3_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'test_music.MP3') # If you have an MP3 sample
-
-@pytest.fixture
+# Reference decode of the MP3 sample, made with the ffmpeg CLI rather than load_audio:
+#   ffmpeg -i test_music.MP3 -f f32le -ac 1 -ar 22050 pipe:1
+# clipped to [-1, 1]; only seconds 10-12 are kept, to keep the file small
+GOLDEN_MP3_22050_PATH = SAMPLE_MP3_PATH + '.22050.npy'
+GOLDEN_MP3_22050_SLICE = slice(10 * 22050, 12 * 22050)
+
+# 1 second of a 440 Hz sine at 44.1 kHz, built once; read-only so no test can alter it
+_SINE_440_44100 = np.sin(2 * np.pi * 440 * np.linspace(0, 1, 44100, endpoint=False)).astype(np.float32)
+_SINE_440_44100.setflags(write=False)
+
+def _peak(audio_data):
+    """Largest absolute sample, from two reductions instead of materializing np.abs(audio_data)."""
+    return max(audio_data.max(), -audio_data.min())
+
+def _decode_wav_reference(path_or_bytes):
+    """Independent WAV decode (pydub's in-process reader) used as an oracle for load_audio.
+
+    Returns a mono float32 array in [-1, 1] and the file's sample rate.
+    """
+    source = io.BytesIO(path_or_bytes) if isinstance(path_or_bytes, bytes) else path_or_bytes
+    segment = AudioSegment.from_wav(source)
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32).reshape(-1, segment.channels)
+    return samples.mean(axis=1) / float(1 << (8 * segment.sample_width - 1)), segment.frame_rate
+
+# Session-scoped: the sample files are read and decoded once, not once per test
+@pytest.fixture(scope="session")
 def sample_wav_file_path():
     if not os.path.exists(SAMPLE_WAV_PATH):
         pytest.skip(f"Sample WAV file not found: {SAMPLE_WAV_PATH}")
     return SAMPLE_WAV_PATH
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_mp3_file_path():
     if not os.path.exists(SAMPLE_MP3_PATH):
         pytest.skip(f"Sample MP3 file not found: {SAMPLE_MP3_PATH}")
     return SAMPLE_MP3_PATH
 
-def test_load_audio_wav(sample_wav_file_path):
+@pytest.fixture(scope="session")
+def sample_wav_bytes(sample_wav_file_path):
+    with open(sample_wav_file_path, 'rb') as f:
+        return f.read()
+
+@pytest.fixture(scope="session")
+def sample_mp3_bytes(sample_mp3_file_path):
+    with open(sample_mp3_file_path, 'rb') as f:
+        return f.read()
+
+@pytest.fixture(scope="session")
+def decoded_wav_11025(sample_wav_file_path):
+    return load_audio(sample_wav_file_path, target_sample_rate=11025)
+
+@pytest.fixture(scope="session")
+def golden_mp3_22050(sample_mp3_file_path):
+    """Reference samples for GOLDEN_MP3_22050_SLICE of the MP3 sample at 22050 Hz."""
+    if not os.path.exists(GOLDEN_MP3_22050_PATH):
+        pytest.skip(f"Golden MP3 decode not found: {GOLDEN_MP3_22050_PATH}")
+    return np.load(GOLDEN_MP3_22050_PATH)
+
+def test_load_audio_wav(decoded_wav_11025):
     """Test loading a WAV file."""
     target_sr = 11025
-    audio_data, sample_rate = load_audio(sample_wav_file_path, target_sample_rate=target_sr)
+    audio_data, sample_rate = decoded_wav_11025
 
     assert isinstance(audio_data, np.ndarray), "Audio data should be a numpy array"
     assert audio_data.ndim == 1, "Audio data should be mono (1D)"
     assert sample_rate == target_sr, f"Sample rate should be {target_sr}"
     assert audio_data.dtype == np.float32, "Audio data type should be float32"
-    assert np.max(np.abs(audio_data)) <= 1.0, "Audio data should be normalized to [-1, 1]"
+    assert _peak(audio_data) <= 1.0, "Audio data should be normalized to [-1, 1]"
     assert len(audio_data) > 0, "Audio data should not be empty"
 
-def test_load_audio_mp3(sample_mp3_file_path):
+def test_load_audio_mp3(sample_mp3_file_path, golden_mp3_22050):
     """Test loading an MP3 file."""
     target_sr = 22050
     audio_data, sample_rate = load_audio(sample_mp3_file_path, target_sample_rate=target_sr)
@@ -43,45 +89,46 @@ def test_load_audio_mp3(sample_mp3_file_path):
     assert audio_data.ndim == 1
     assert sample_rate == target_sr
     assert audio_data.dtype == np.float32
-    assert np.max(np.abs(audio_data)) <= 1.0
+    assert _peak(audio_data) <= 1.0
     assert len(audio_data) > 0
+    # load_audio decodes through ffmpeg too, so it must reproduce the reference
+    np.testing.assert_allclose(audio_data[GOLDEN_MP3_22050_SLICE], golden_mp3_22050, atol=1e-4)
 
 def test_load_audio_different_target_sr(sample_wav_file_path):
     """Test loading with a different target sample rate for resampling."""
-    original_audio = AudioSegment.from_file(sample_wav_file_path)
-    original_sr = original_audio.frame_rate
+    original_samples, original_sr = _decode_wav_reference(sample_wav_file_path)
     target_sr = original_sr * 2 # Example: double the original SR
 
     audio_data, sample_rate = load_audio(sample_wav_file_path, target_sample_rate=target_sr)
     assert sample_rate == target_sr
 
-    # Expected length after resampling
-    expected_len = int(len(original_audio.get_array_of_samples()) * (target_sr / original_sr))
+    # Expected length after resampling (frames, not interleaved samples, for stereo files)
+    expected_len = int(len(original_samples) * (target_sr / original_sr))
     # Allow for small differences due to resampling algorithms
     assert abs(len(audio_data) - expected_len) < target_sr * 0.01 # Allow 10ms difference
 
-def test_load_audio_from_bytes_wav(sample_wav_file_path):
+def test_load_audio_wav_matches_reference(sample_wav_file_path, sample_wav_bytes):
+    """Test that WAV decoding at the native rate matches an independent decoder."""
+    expected, native_sr = _decode_wav_reference(sample_wav_bytes)
+    audio_data, sample_rate = load_audio(sample_wav_file_path, target_sample_rate=native_sr)
+    assert sample_rate == native_sr
+    np.testing.assert_allclose(audio_data, expected, atol=1e-4)
+
+def test_load_audio_from_bytes_wav(sample_wav_bytes, decoded_wav_11025):
     """Test loading audio from bytes (WAV format)."""
     target_sr = 11025
-    with open(sample_wav_file_path, 'rb') as f:
-        wav_bytes = f.read()
-
-    audio_data, sample_rate = load_audio_from_bytes(wav_bytes, format='wav', target_sample_rate=target_sr)
+    audio_data, sample_rate = load_audio_from_bytes(sample_wav_bytes, format='wav', target_sample_rate=target_sr)
 
     assert isinstance(audio_data, np.ndarray)
     assert audio_data.ndim == 1
     assert sample_rate == target_sr
     assert audio_data.dtype == np.float32
-    assert np.max(np.abs(audio_data)) <= 1.0
+    assert _peak(audio_data) <= 1.0
     assert len(audio_data) > 0
+    # Decoding the same bytes must give what load_audio gave for the file
+    np.testing.assert_array_equal(audio_data, decoded_wav_11025[0])
 
-# To test load_audio_from_bytes for MP3, you'd need a sample MP3 byte stream
-@pytest.fixture
-def sample_mp3_bytes(sample_mp3_file_path):
-    with open(sample_mp3_file_path, 'rb') as f:
-        return f.read()
-
-def test_load_audio_from_bytes_mp3(sample_mp3_bytes):
+def test_load_audio_from_bytes_mp3(sample_mp3_bytes, golden_mp3_22050):
     """Test loading audio from bytes (MP3 format)."""
     target_sr = 22050
     audio_data, sample_rate = load_audio_from_bytes(sample_mp3_bytes, format='mp3', target_sample_rate=target_sr)
@@ -90,16 +137,33 @@ def test_load_audio_from_bytes_mp3(sample_mp3_bytes):
     assert audio_data.ndim == 1
     assert sample_rate == target_sr
     assert audio_data.dtype == np.float32
-    assert np.max(np.abs(audio_data)) <= 1.0
+    assert _peak(audio_data) <= 1.0
+    assert len(audio_data) > 0
+    # pydub decodes at the native rate and scipy resamples, which differs from
+    # ffmpeg's resampler by a fraction of a sample, so compare the waveform shape
+    segment = audio_data[GOLDEN_MP3_22050_SLICE]
+    assert len(segment) == len(golden_mp3_22050)
+    assert np.corrcoef(segment, golden_mp3_22050)[0, 1] > 0.99
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg not installed")
+def test_load_audio_stream_wav(sample_wav_file_path):
+    """Test decoding a WAV file-like object through the ffmpeg pipe."""
+    target_sr = 11025
+    with open(sample_wav_file_path, 'rb') as f:
+        audio_data, sample_rate = load_audio_stream(f, target_sample_rate=target_sr)
+
+    assert isinstance(audio_data, np.ndarray)
+    assert audio_data.ndim == 1
+    assert sample_rate == target_sr
+    assert audio_data.dtype == np.float32
+    assert _peak(audio_data) <= 1.0
     assert len(audio_data) > 0
 
 def test_preprocess_audio_resample():
     """Test resampling in preprocess_audio."""
     original_sr = 44100
     target_sr = 11025
-    # Create a dummy audio signal (e.g., 1 second sine wave)
-    t = np.linspace(0, 1, original_sr, endpoint=False)
-    audio_data_orig = np.sin(2 * np.pi * 440 * t).astype(np.float32)
+    audio_data_orig = _SINE_440_44100
 
     processed_audio = preprocess_audio(audio_data_orig, original_sr, target_sample_rate=target_sr, normalize=False)
 
@@ -113,13 +177,15 @@ def test_preprocess_audio_normalize():
 
     processed_audio = preprocess_audio(audio_data_unnormalized, sr, target_sample_rate=sr, normalize=True)
 
-    assert np.max(np.abs(processed_audio)) == pytest.approx(1.0)
+    assert _peak(processed_audio) == pytest.approx(1.0)
     assert processed_audio.dtype == np.float32
 
 def test_preprocess_audio_no_op():
     """Test preprocess_audio when no operation should occur."""
     sr = 11025
-    audio_data_orig = np.random.rand(sr).astype(np.float32) * 0.5 # Already normalized somewhat
+    # Drawn straight into float32 and scaled in place: one allocation, no float64 temporaries
+    audio_data_orig = np.random.default_rng(0).random(sr, dtype=np.float32)
+    audio_data_orig *= 0.5 # Already normalized somewhat
     audio_data_orig_copy = audio_data_orig.copy()
 
     # Normalize=False, and sample rates match
@@ -129,6 +195,7 @@ def test_preprocess_audio_no_op():
     # Normalize=True, but data is already effectively normalized (max_val <= 1)
     # Note: if max_val is 0, it won't divide. If max_val is very small, it might amplify noise.
     # For this test, ensure max_val > 0
-    audio_already_norm = audio_data_orig / np.max(np.abs(audio_data_orig)) if np.max(np.abs(audio_data_orig)) > 0 else audio_data_orig
+    peak = _peak(audio_data_orig)
+    audio_already_norm = audio_data_orig / peak if peak > 0 else audio_data_orig
     processed_audio_norm = preprocess_audio(audio_already_norm.copy(), sr, target_sample_rate=sr, normalize=True)
     np.testing.assert_allclose(processed_audio_norm, audio_already_norm, atol=1e-6)
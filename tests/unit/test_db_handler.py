@@ -1,29 +1,37 @@
 import pytest
 import os
+import sqlite3
+import numpy as np
 from backend.database.db_handler import DatabaseHandler
+from backend.database.migrations.v4_add_fingerprint_version import migrate
 
 # Use a temporary in-memory database for most tests
-# For tests requiring a file, use a temporary file path
-TEST_DB_FILE = 'test_temp_db_handler.db'
+# For tests requiring a file, use a per-test path under tmp_path, so parallel
+# workers (pytest -n auto) never share a database file
 
-@pytest.fixture
-def in_memory_db():
-    """Fixture for an in-memory SQLite database handler."""
+@pytest.fixture(scope="session")
+def shared_memory_db():
+    """One in-memory database handler for the session, so the schema is created once."""
     db = DatabaseHandler(db_path=':memory:')
-    # create_tables(db._get_connection()) # Ensure tables are created for in-memory
-    # The DatabaseHandler's __init__ already calls _ensure_schema_exists, which calls create_tables
-    return db
+    yield db
+    db.close()
+
+@pytest.fixture
+def in_memory_db(shared_memory_db, rolled_back):
+    """Fixture for an in-memory SQLite database handler.
+
+    Each test runs inside a transaction on the shared handler that is rolled
+    back afterwards, so tests start from an empty database without rebuilding it.
+    """
+    with rolled_back(shared_memory_db) as db:
+        yield db
 
 @pytest.fixture
-def file_db():
+def file_db(tmp_path):
     """Fixture for a file-based SQLite database handler."""
-    if os.path.exists(TEST_DB_FILE):
-        os.remove(TEST_DB_FILE)
-    db = DatabaseHandler(db_path=TEST_DB_FILE)
+    db = DatabaseHandler(db_path=str(tmp_path / 'test_db_handler.db'))
     yield db
-    # Teardown: remove the database file after tests are done
-    if os.path.exists(TEST_DB_FILE):
-        os.remove(TEST_DB_FILE)
+    db.close()
 
 def test_db_handler_initialization_in_memory(in_memory_db):
     """Test that DatabaseHandler initializes correctly with an in-memory DB."""
@@ -38,13 +46,20 @@ def test_db_handler_initialization_in_memory(in_memory_db):
 def test_db_handler_initialization_file_db(file_db):
     """Test that DatabaseHandler initializes correctly with a file DB."""
     assert file_db is not None
-    assert os.path.exists(TEST_DB_FILE)
+    assert os.path.exists(file_db.db_path)
     try:
         songs = file_db.get_all_songs()
         assert isinstance(songs, list)
     except Exception as e:
         pytest.fail(f"Schema might not have been created correctly for file DB: {e}")
 
+def test_synchronous_mode():
+    """Test that the synchronous mode is applied to connections and validated."""
+    db = DatabaseHandler(db_path=':memory:', synchronous='off')
+    assert db._get_connection().execute('PRAGMA synchronous').fetchone()[0] == 0
+    with pytest.raises(ValueError):
+        DatabaseHandler(db_path=':memory:', synchronous='sometimes')
+
 def test_add_and_get_song(in_memory_db):
     """Test adding a song and retrieving it by ID and source ID."""
     db = in_memory_db
@@ -86,6 +101,94 @@ def test_add_song_duplicate_source_id(in_memory_db):
     song = db.get_song_by_id(song_id1)
     assert song['title'] == "Title1" # Should be the original title
 
+def test_add_songs_bulk(in_memory_db):
+    """Test inserting many songs at once, skipping existing source IDs."""
+    db = in_memory_db
+    db.add_song("Existing", "Artist", "test", "bulk_1")
+    inserted = db.add_songs_bulk(
+        {"title": f"Song {i}", "artist": "Artist", "source_type": "test", "source_id": f"bulk_{i}"}
+        for i in range(5)
+    )
+    assert inserted == 4
+    titles = {s['title'] for s in db.get_all_songs()}
+    assert titles == {"Existing", "Song 0", "Song 2", "Song 3", "Song 4"}
+
+def test_transaction_commits_and_rolls_back(file_db):
+    """Test that transaction() groups handler calls and rolls them back on error."""
+    db = file_db
+    with db.transaction():
+        db.add_song("Kept", "Artist", "test", "txn_1")
+        db.add_songs_bulk([{"title": "Kept too", "artist": "Artist", "source_type": "test", "source_id": "txn_2"}])
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.add_song("Dropped", "Artist", "test", "txn_3")
+            raise RuntimeError("abort")
+    # A second handler reads through its own connection, so it only sees committed rows
+    titles = {s['title'] for s in DatabaseHandler(db_path=db.db_path).get_all_songs()}
+    assert titles == {"Kept", "Kept too"}
+
+def test_get_matches_by_hashes_large_query(in_memory_db):
+    """Test that a query too long for an IN list returns the same rows via the temp-table join."""
+    db = in_memory_db
+    song_id = db.add_song("Match Song", "Artist", "test", "match_001")
+    db.store_fingerprints(song_id, [(h, h * 10) for h in range(0, 4000, 2)])
+    hashes = list(range(3000)) + [0, 2]  # duplicates must not duplicate rows
+    expected = {(h, song_id, h * 10) for h in range(0, 3000, 2)}
+    rows = db.get_matches_by_hashes(hashes)
+    assert len(rows) == len(expected)
+    assert set(rows) == expected
+    assert set(db.get_matches_by_hashes(hashes[:100])) == {r for r in expected if r[0] < 100}
+
+def test_get_song_by_id_cache_is_per_handler(file_db, monkeypatch):
+    """Test that get_song_by_id caches per handler, skips misses and expires entries."""
+    writer = file_db
+    reader = DatabaseHandler(db_path=writer.db_path)
+    assert reader.get_song_by_id(1) is None
+    song_id = writer.add_song("Cached Song", "Artist", "test", "cache_001")
+    # The miss above was not cached, so the new song is visible at once
+    assert reader.get_song_by_id(song_id)['title'] == "Cached Song"
+
+    # Deleting through one handler only clears that handler's cache
+    writer.delete_song(song_id)
+    assert writer.get_song_by_id(song_id) is None
+    assert reader.get_song_by_id(song_id)['title'] == "Cached Song"
+    # Other handlers see the change once their entry expires
+    monkeypatch.setattr('backend.database.db_handler._SONG_CACHE_TTL_SECONDS', 0.0)
+    assert reader.get_song_by_id(song_id) is None
+    reader.close()
+
+def test_fingerprint_version_and_replace(in_memory_db):
+    """Test that stored fingerprint versions are tracked and outdated songs can be re-fingerprinted."""
+    db = in_memory_db
+    old_id = db.add_song("Old Song", "Artist", "test", "fpv_old")
+    new_id = db.add_song("New Song", "Artist", "test", "fpv_new")
+    db.store_fingerprints(old_id, [(1, 10), (2, 20)])  # unversioned, as before versioning existed
+    db.add_fingerprints_bulk(new_id, [(np.array([3], dtype=np.uint32), np.array([30], dtype=np.uint32))], fingerprint_version=2)
+
+    assert [s['id'] for s in db.get_songs_with_outdated_fingerprints(2)] == [old_id]
+    assert db.get_songs_with_outdated_fingerprints(3) != []
+
+    inserted = db.replace_fingerprints(old_id, [(np.array([4, 5], dtype=np.uint32), np.array([40, 50], dtype=np.uint32))], 2)
+    assert inserted == 2
+    assert db.get_fingerprints_by_song_id(old_id) == [(4, 40, old_id), (5, 50, old_id)]
+    assert db.get_songs_with_outdated_fingerprints(2) == []
+
+def test_migration_adds_fingerprint_version_column(tmp_path):
+    """Test that the v4 migration adds the column to a database from before fingerprint versioning."""
+    db_path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE songs (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, artist TEXT NOT NULL, '
+                 'album TEXT, source_type TEXT NOT NULL, source_id TEXT NOT NULL, UNIQUE(source_type, source_id))')
+    conn.execute("INSERT INTO songs (title, artist, source_type, source_id) VALUES ('Old', 'Artist', 'test', 'old_1')")
+    conn.commit()
+    conn.close()
+
+    # Same order as app.py: open the handler, then run the migrations
+    db = DatabaseHandler(db_path=db_path)
+    migrate(db_path)
+    assert [s['title'] for s in db.get_songs_with_outdated_fingerprints(2)] == ['Old']
+    db.close()
+
 def test_get_all_songs(in_memory_db):
     """Test retrieving all songs."""
     db = in_memory_db
@@ -118,9 +221,9 @@ def test_store_and_get_fingerprints(in_memory_db):
     db = in_memory_db
     song_id = db.add_song("FP Test Song", "FP Artist", "FP Album", "fp_source", "fp_001")
 
-    # Fingerprints are tuples of (hash_str, offset_int)
+    # Fingerprints are (hash, offset) pairs; hashes are 32-bit integers stored as INTEGER
     fingerprints_to_store = [
-        ("hash1", 10), ("hash2", 20), ("hash1", 30) # hash1 appears twice
+        (0xdeadbeef, 10), (0x0badf00d, 20), (0xdeadbeef, 30) # 0xdeadbeef appears twice
     ]
     db.store_fingerprints(song_id, fingerprints_to_store)
 
@@ -128,23 +231,17 @@ def test_store_and_get_fingerprints(in_memory_db):
     retrieved_by_song = db.get_fingerprints_by_song_id(song_id)
     assert len(retrieved_by_song) == 3
     # Convert to set of tuples for easier comparison as order might not be guaranteed
-    assert set(retrieved_by_song) == {("hash1", 10, song_id), ("hash2", 20, song_id), ("hash1", 30, song_id)}
-
-    # Test get_fingerprints_by_hashes
-    hashes_to_query = ["hash1", "hash3"] # hash3 does not exist
-    retrieved_by_hash = db.get_fingerprints_by_hashes(hashes_to_query)
-    assert len(retrieved_by_hash) == 2 # Two entries for hash1
-    # Retrieved items are dicts: {'hash': str, 'offset': int, 'song_id': int}
-    retrieved_hashes_set = set()
-    for fp in retrieved_by_hash:
-        assert fp['song_id'] == song_id
-        retrieved_hashes_set.add(fp['hash'])
-    assert "hash1" in retrieved_hashes_set
-    assert "hash3" not in retrieved_hashes_set
-    assert len({(item['hash'], item['offset']) for item in retrieved_by_hash}) == 2 # (hash1,10), (hash1,30)
-
-    # Test get_fingerprints_by_hashes with empty list
-    assert db.get_fingerprints_by_hashes([]) == []
+    assert set(retrieved_by_song) == {(0xdeadbeef, 10, song_id), (0x0badf00d, 20, song_id), (0xdeadbeef, 30, song_id)}
+    assert all(isinstance(fp_hash, int) for fp_hash, _, _ in retrieved_by_song)
+
+    # Test get_matches_by_hashes
+    hashes_to_query = [0xdeadbeef, 0x12345678] # 0x12345678 does not exist
+    retrieved_by_hash = db.get_matches_by_hashes(hashes_to_query)
+    # Rows are (hash, song_id, timestamp); two entries for 0xdeadbeef
+    assert set(retrieved_by_hash) == {(0xdeadbeef, song_id, 10), (0xdeadbeef, song_id, 30)}
+
+    # Test get_matches_by_hashes with empty list
+    assert db.get_matches_by_hashes([]) == []
 
 def test_store_fingerprints_empty(in_memory_db):
     """Test storing an empty list of fingerprints."""
@@ -1,10 +1,7 @@
 """Unit tests for audio fingerprinting and matching logic in `backend.shazam_core`."""
 import os
-import sys
+import numpy as np
 import pytest
-from pathlib import Path
-
-# Add the backend directory to the Python path
 
 # Now import from the shazam_core package
 from backend.shazam_core.audio_utils import load_audio
@@ -13,9 +10,8 @@ from backend.database.db_handler import DatabaseHandler
 
 # Test audio file 
 SAMPLE_AUDIO_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'sample.wav')
-TEST_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'test_fingerprints.db')
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_audio():
     """Load sample audio for testing."""
     if not os.path.exists(SAMPLE_AUDIO_FILE):
@@ -24,29 +20,36 @@ def sample_audio():
     audio_data, sample_rate = load_audio(SAMPLE_AUDIO_FILE)
     return audio_data, sample_rate
 
-@pytest.fixture
-def db_handler():
-    """Set up a test database."""
-    # Make sure the test database doesn't exist
-    if os.path.exists(TEST_DB_PATH):
-        os.remove(TEST_DB_PATH)
-    
-    # Create a test database
-    db = DatabaseHandler(db_path=TEST_DB_PATH)
+@pytest.fixture(scope="session")
+def full_fingerprints(sample_audio):
+    """Fingerprints of the whole sample, generated once and shared by the tests."""
+    audio_data, sample_rate = sample_audio
+    return Fingerprinter(sample_rate=sample_rate).generate_fingerprints(audio_data)
+
+@pytest.fixture(scope="session")
+def seeded_db(tmp_path_factory):
+    """A test database holding one song, created once per session."""
+    # Under tmp_path_factory, so parallel workers never share the file
+    db = DatabaseHandler(db_path=str(tmp_path_factory.mktemp("db") / 'test_fingerprints.db'))
     
     # Add a test song
     song_id = db.add_song(
         title="Test Song",
         artist="Test Artist",
+        source_type="test",
+        source_id="test123",
         album="Test Album",
         youtube_id="test123"
     )
     
     yield db
-    
-    # Clean up - just remove the test database file, not the directory
-    if os.path.exists(TEST_DB_PATH):
-        os.remove(TEST_DB_PATH)
+    db.close()
+
+@pytest.fixture
+def db_handler(seeded_db, rolled_back):
+    """Set up a test database; whatever a test stores is rolled back afterwards."""
+    with rolled_back(seeded_db) as db:
+        yield db
 
 def test_fingerprinter_initialization():
     """Test that the Fingerprinter initializes with default parameters."""
@@ -56,37 +59,28 @@ def test_fingerprinter_initialization():
     assert fingerprinter.hop_size == 512
     assert fingerprinter.fan_value == 15
 
-def test_generate_fingerprints(sample_audio):
+def test_generate_fingerprints(full_fingerprints):
     """Test generating fingerprints from audio."""
-    audio_data, sample_rate = sample_audio
-    fingerprinter = Fingerprinter(sample_rate=sample_rate)
-    
-    # Generate fingerprints
-    fingerprints = fingerprinter.generate_fingerprints(audio_data, song_id=1)
+    fingerprints = full_fingerprints
     
     # Check that we got some fingerprints
     assert len(fingerprints) > 0
     
     # Check fingerprint structure
-    fp = fingerprints[0]
-    assert hasattr(fp, 'hash')
-    assert hasattr(fp, 'song_id')
-    assert hasattr(fp, 'offset')
-    assert hasattr(fp, 'timestamp')
+    assert fingerprints.hash.dtype == np.uint32
+    assert fingerprints.offset.dtype == np.uint32
+    assert fingerprints.hash.shape == fingerprints.offset.shape
 
-def test_fingerprint_matching(sample_audio, db_handler):
+def test_fingerprint_matching(full_fingerprints, db_handler):
     """Test matching fingerprints against a database."""
-    audio_data, sample_rate = sample_audio
-    fingerprinter = Fingerprinter(sample_rate=sample_rate)
-
-    # Generate fingerprints for the test song
+    # Fingerprints for the test song
     song_id = 1  # Should match the fixture
-    fingerprints = fingerprinter.generate_fingerprints(audio_data, song_id=song_id)
+    fingerprints = full_fingerprints
     
     print(f"Generated {len(fingerprints)} fingerprints for the test song")
 
     # Store fingerprints in the database
-    db_handler.store_fingerprints(song_id, [(fp.hash, fp.offset) for fp in fingerprints])
+    db_handler.store_fingerprints(song_id, list(zip(fingerprints.hash.tolist(), fingerprints.offset.tolist())))
     
     # Verify fingerprints were stored
     with db_handler._get_connection() as conn:
@@ -99,17 +93,14 @@ def test_fingerprint_matching(sample_audio, db_handler):
     matcher = FingerprintMatcher(db_handler=db_handler)
 
     # Try to match the same audio
-    query_fingerprints = fingerprinter.generate_fingerprints(audio_data, song_id=0)
+    query_fingerprints = full_fingerprints
     print(f"Generated {len(query_fingerprints)} query fingerprints")
     
     # Get matching hashes from the database for debugging
-    hashes = [f.hash for f in query_fingerprints]
-    with db_handler._get_connection() as conn:
-        cursor = conn.cursor()
-        placeholders = ','.join(['?'] * len(hashes))
-        cursor.execute(f"SELECT COUNT(DISTINCT hash) FROM fingerprints WHERE hash IN ({placeholders})", hashes)
-        matching_hashes = cursor.fetchone()[0]
-        print(f"Found {matching_hashes} matching hashes in the database")
+    # (goes through the matcher's lookup, which joins a temp table for long queries)
+    hashes = query_fingerprints.hash.tolist()
+    matching_hashes = len({row[0] for row in db_handler.get_matches_by_hashes(hashes)})
+    print(f"Found {matching_hashes} matching hashes in the database")
     
     matches = matcher.match_fingerprints(query_fingerprints)
     print(f"Found {len(matches)} matches")
@@ -127,17 +118,16 @@ def test_fingerprint_matching(sample_audio, db_handler):
     assert len(matches) > 0, "No matches found in the database"
     assert matches[0]['song_id'] == song_id
 
-def test_time_coherence(sample_audio, db_handler):
+def test_time_coherence(sample_audio, full_fingerprints, db_handler):
     """Test that time coherence is properly handled in matching."""
     audio_data, sample_rate = sample_audio
     fingerprinter = Fingerprinter(sample_rate=sample_rate)
     
-    # Generate fingerprints for the test song
+    # Fingerprints for the test song
     song_id = 1
-    full_fingerprints = fingerprinter.generate_fingerprints(audio_data, song_id=song_id)
     
     # Store fingerprints in the database
-    db_handler.store_fingerprints(song_id, [(fp.hash, fp.offset) for fp in full_fingerprints])
+    db_handler.store_fingerprints(song_id, list(zip(full_fingerprints.hash.tolist(), full_fingerprints.offset.tolist())))
     
     # Create a matcher with the test database
     matcher = FingerprintMatcher(db_handler=db_handler)
@@ -148,7 +138,7 @@ def test_time_coherence(sample_audio, db_handler):
     snippet = audio_data[:snippet_samples]
     
     # Generate fingerprints for the snippet
-    query_fingerprints = fingerprinter.generate_fingerprints(snippet, song_id=0)
+    query_fingerprints = fingerprinter.generate_fingerprints(snippet)
     
     # Match against the full song
     matches = matcher.match_fingerprints(query_fingerprints)
@@ -159,3 +149,23 @@ def test_time_coherence(sample_audio, db_handler):
     
     # The best match should have a high number of matches
     assert matches[0]['total_matches'] > 10  # Check total unique hashes matched
+
+def test_iter_matches_converges_to_match_fingerprints():
+    """Test that the incremental matcher's final ranking equals match_fingerprints."""
+    fingerprinter = Fingerprinter()
+    rng = np.random.default_rng(0)
+    db = DatabaseHandler(db_path=':memory:')
+    for i in range(3):
+        audio_data = rng.standard_normal(fingerprinter.sample_rate * 10, dtype=np.float32)
+        audio_data *= 0.1
+        song_id = db.add_song(title=f"Song {i}", artist="Test Artist", source_type="test", source_id=str(i))
+        db.add_fingerprints(song_id, fingerprinter.generate_fingerprints(audio_data))
+
+    # Query with a snippet of the last song added
+    matcher = FingerprintMatcher(db_handler=db, fingerprinter_instance=fingerprinter)
+    query = fingerprinter.generate_fingerprints(audio_data[fingerprinter.sample_rate * 2:fingerprinter.sample_rate * 6])
+
+    rankings = list(matcher.iter_matches(query, chunk_size=100, top_n=3))
+    assert len(rankings) > 1
+    assert rankings[-1] == matcher.match_fingerprints(query, top_n=3)
+    assert rankings[-1][0]['song_id'] == song_id
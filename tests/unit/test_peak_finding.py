@@ -1,6 +1,7 @@
 import pytest
 import numpy as np
-from backend.shazam_core.peak_finding import find_peaks, Peak, find_peaks_with_time_freq
+from backend.shazam_core.peak_finding import find_peaks, Peak, find_peaks_with_time_freq, batch_find_peaks
+from backend.shazam_core.spectrogram import generate_spectrogram
 # find_peaks_in_bands might be more complex to unit test without a full spectrogram context,
 # so we'll focus on find_peaks and find_peaks_with_time_freq for now.
 
@@ -94,31 +95,22 @@ def test_find_peaks_empty_spectrogram():
 def test_find_peaks_with_time_freq_basic(sample_spectrogram_simple, sample_times_freqs):
     """Test find_peaks_with_time_freq adds time and freq correctly."""
     times, freqs = sample_times_freqs
-    peaks = find_peaks_with_time_freq(sample_spectrogram_simple, times, freqs)
+    # amp_min drops the zero background, whose flat plateaus also count as local maxima
+    peaks = find_peaks_with_time_freq(sample_spectrogram_simple, times, freqs, amp_min=1.0)
 
     assert len(peaks) == 2
 
-    peak_details = []
-    for p in peaks:
-        assert p.time is not None, "Time should be populated"
-        assert p.freq is not None, "Frequency should be populated"
-        peak_details.append((p.freq_idx, p.time_idx, p.magnitude, p.freq, p.time))
+    # PeakArray keeps each field as a column, so compare whole arrays at once,
+    # ordered by magnitude (descending)
+    assert not np.isnan(peaks.time).any(), "Time should be populated"
+    assert not np.isnan(peaks.freq).any(), "Frequency should be populated"
+    order = np.argsort(-peaks.magnitude, kind='stable')
 
-    # Sort by magnitude then original indices for consistent comparison
-    peak_details_sorted = sorted(peak_details, key=lambda x: (-x[2], x[0], x[1]))
-
-    expected_details = [
-        (1, 1, 5.0, freqs[1], times[1]), # freq_idx=1, time_idx=1, mag=5.0
-        (3, 3, 3.0, freqs[3], times[3])  # freq_idx=3, time_idx=3, mag=3.0
-    ]
-    expected_details_sorted = sorted(expected_details, key=lambda x: (-x[2], x[0], x[1]))
-
-    for found, expected in zip(peak_details_sorted, expected_details_sorted):
-        assert found[0] == expected[0] # freq_idx
-        assert found[1] == expected[1] # time_idx
-        assert found[2] == expected[2] # magnitude
-        assert found[3] == expected[3] # freq (actual value)
-        assert found[4] == expected[4] # time (actual value)
+    np.testing.assert_array_equal(peaks.freq_idx[order], [1, 3])
+    np.testing.assert_array_equal(peaks.time_idx[order], [1, 3])
+    np.testing.assert_array_equal(peaks.magnitude[order], [5.0, 3.0])
+    np.testing.assert_array_equal(peaks.freq[order], freqs[[1, 3]])
+    np.testing.assert_array_equal(peaks.time[order], times[[1, 3]])
 
 def test_peak_dataclass():
     """Test the Peak dataclass."""
@@ -126,3 +118,21 @@ def test_peak_dataclass():
     assert peak.to_tuple() == (1, 2, 3.0)
     assert peak.time == 0.1
     assert peak.freq == 200.0
+
+def test_batch_find_peaks_matches_single_clip():
+    """Test batch_find_peaks returns the same peaks per clip, in order, as the serial path."""
+    sample_rate = 11025
+    rng = np.random.default_rng(0)
+    clips = [rng.standard_normal(sample_rate, dtype=np.float32) for _ in range(3)]
+
+    results = batch_find_peaks(clips, {'sample_rate': sample_rate}, max_workers=2, amp_min=-20)
+
+    assert len(results) == len(clips)
+    for clip, peaks in zip(clips, results):
+        spectrogram, freqs, times = generate_spectrogram(clip, sample_rate)
+        expected = find_peaks_with_time_freq(spectrogram, times, freqs, amp_min=-20)
+        np.testing.assert_array_equal(peaks.time_idx, expected.time_idx)
+        np.testing.assert_array_equal(peaks.freq_idx, expected.freq_idx)
+        np.testing.assert_array_equal(peaks.time, expected.time)
+        np.testing.assert_array_equal(peaks.freq, expected.freq)
+
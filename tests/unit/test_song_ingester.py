@@ -1,37 +1,72 @@
 import pytest
-from unittest.mock import MagicMock, patch, mock_open
-import os
+from unittest.mock import MagicMock, patch
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
 
 from backend.services.song_ingester import SongIngester
-# Assuming Fingerprint class is used for type hinting or comparison inside ingester
-from backend.shazam_core.fingerprinting import Fingerprint
-
-@pytest.fixture
+from backend.database.db_handler import DatabaseHandler
+from backend.api_clients.spotify_client import SpotifyClient
+from backend.api_clients.youtube_client import YouTubeClient
+from backend.shazam_core.fingerprinting import FINGERPRINT_VERSION, Fingerprinter
+
+# The collaborator mocks are built once per module and reset before each test.
+# Each is specced on the real class, so a misspelled or removed method fails loudly.
+@pytest.fixture(scope="module")
 def mock_db_handler():
-    return MagicMock()
+    return MagicMock(spec=DatabaseHandler)
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_spotify_client():
-    return MagicMock()
+    return MagicMock(spec=SpotifyClient)
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_youtube_client():
-    return MagicMock()
+    return MagicMock(spec=YouTubeClient)
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def mock_fingerprinter():
-    fp = MagicMock()
-    fp.sample_rate = 11025 # Set a default sample_rate attribute
-    return fp
+    return MagicMock(spec=Fingerprinter)
+
+@pytest.fixture
+def song_ingester(patched_io, mock_db_handler, mock_spotify_client, mock_youtube_client, mock_fingerprinter):
+    # Clear calls, return values and side effects left by the previous test
+    for mock in (mock_db_handler, mock_spotify_client, mock_youtube_client, mock_fingerprinter):
+        mock.reset_mock(return_value=True, side_effect=True)
+    mock_fingerprinter.sample_rate = 11025 # Set a default sample_rate attribute
+    ingester = SongIngester(mock_db_handler, mock_spotify_client, mock_youtube_client)
+    # Replace the fingerprinter instance after __init__ with our mock
+    ingester.fingerprinter = mock_fingerprinter
+    return ingester
+
+@pytest.fixture(autouse=True)
+def patched_io(monkeypatch):
+    """Replace the ingester's audio loading and file checks/cleanup with mocks for every test.
+
+    os.makedirs is patched here too, for the ingester's __init__, so no patch
+    outlives the test that needed it.
+    """
+    mocks = SimpleNamespace(load_audio=MagicMock(), exists=MagicMock(), remove=MagicMock(), makedirs=MagicMock())
+    monkeypatch.setattr('os.makedirs', mocks.makedirs)
+    monkeypatch.setattr('backend.services.song_ingester.load_audio', mocks.load_audio)
+    monkeypatch.setattr('os.path.exists', mocks.exists)
+    monkeypatch.setattr('os.remove', mocks.remove)
+    return mocks
 
 @pytest.fixture
-def song_ingester(mock_db_handler, mock_spotify_client, mock_youtube_client, mock_fingerprinter):
-    # Patch os.makedirs in the context of the ingester's __init__ if it's called there
-    with patch('os.makedirs') as mock_makedirs:
-        ingester = SongIngester(mock_db_handler, mock_spotify_client, mock_youtube_client)
-        # Replace the fingerprinter instance after __init__ with our mock
-        ingester.fingerprinter = mock_fingerprinter
-        return ingester
+def mock_chunk(make_fingerprints):
+    """One (hashes, offsets) fingerprint chunk, the form fingerprints are streamed to the DB in."""
+    fingerprints = make_fingerprints(1)
+    return (fingerprints.hash, fingerprints.offset)
+
+def _assert_streamed(mock_method, song_id, mock_chunk):
+    """Assert mock_method was called once with song_id and exactly mock_chunk; return its remaining args."""
+    mock_method.assert_called_once()
+    called_song_id, chunks, *rest = mock_method.call_args.args
+    assert called_song_id == song_id
+    # The chunks are passed through untouched, so compare by identity rather than array equality
+    chunks = list(chunks)
+    assert len(chunks) == 1 and chunks[0] is mock_chunk
+    return rest
 
 # --- Tests for _get_best_cover_url ---
 def test_get_best_cover_url_empty_list(song_ingester):
@@ -60,10 +95,7 @@ def test_extract_youtube_id_invalid(song_ingester):
     assert song_ingester._extract_youtube_id('not a youtube url') == ''
 
 # --- Tests for ingest_from_spotify ---
-@patch('backend.services.song_ingester.load_audio')
-@patch('os.path.exists')
-@patch('os.remove')
-def test_ingest_from_spotify_success(mock_os_remove, mock_os_exists, mock_load_audio, song_ingester, mock_db_handler, mock_spotify_client, mock_youtube_client, mock_fingerprinter):
+def test_ingest_from_spotify_success(patched_io, mock_chunk, song_ingester, mock_db_handler, mock_spotify_client, mock_youtube_client, mock_fingerprinter):
     mock_spotify_client.get_track_metadata.return_value = {
         'id': 'spotify_id_123', 'title': 'Test Song', 'artist': 'Test Artist', 'album': 'Test Album',
         'duration_ms': 180000, 'images': [{'url': 'cover.jpg', 'width': 300, 'height': 300}],
@@ -72,11 +104,9 @@ def test_ingest_from_spotify_success(mock_os_remove, mock_os_exists, mock_load_a
     mock_db_handler.get_song_by_source.return_value = None # Not already in DB
     mock_youtube_client.search_videos.return_value = [{'id': 'youtube_id_789'}]
     mock_youtube_client.download_audio.return_value = ('/tmp/audio.mp3', {'title': 'YT Title', 'duration': 180})
-    mock_os_exists.return_value = True # Simulate file downloaded
-    mock_load_audio.return_value = (MagicMock(), 11025) # (audio_data, sample_rate)
-    # Create mock Fingerprint objects
-    mock_fingerprints = [Fingerprint(hash='fp1', song_id=0, offset=100, timestamp=0.1)]
-    mock_fingerprinter.generate_fingerprints.return_value = mock_fingerprints
+    patched_io.exists.return_value = True # Simulate file downloaded
+    patched_io.load_audio.return_value = (MagicMock(), 11025) # (audio_data, sample_rate)
+    mock_fingerprinter.generate_fingerprint_arrays.return_value = iter([mock_chunk])
     mock_db_handler.add_song.return_value = 1 # New song_id from DB
 
     result = song_ingester.ingest_from_spotify('some_spotify_url')
@@ -85,15 +115,11 @@ def test_ingest_from_spotify_success(mock_os_remove, mock_os_exists, mock_load_a
     assert result['song_id'] == 1
     assert result['status'] == 'added'
     mock_db_handler.add_song.assert_called_once()
-    # Check that fingerprints were updated with song_id and stored
-    assert mock_fingerprints[0].song_id == 1
-    mock_db_handler.add_fingerprints.assert_called_once_with(1, mock_fingerprints)
-    mock_os_remove.assert_called_once_with('/tmp/audio.mp3')
-
-@patch('backend.services.song_ingester.load_audio')
-@patch('os.path.exists')
-@patch('os.remove')
-def test_ingest_from_spotify_already_exists(mock_os_remove, mock_os_exists, mock_load_audio, song_ingester, mock_db_handler, mock_spotify_client):
+    # Check that the fingerprint chunks were streamed into the DB for the new song_id
+    _assert_streamed(mock_db_handler.add_fingerprints_bulk, 1, mock_chunk)
+    patched_io.remove.assert_called_once_with('/tmp/audio.mp3')
+
+def test_ingest_from_spotify_already_exists(patched_io, song_ingester, mock_db_handler, mock_spotify_client):
     mock_spotify_client.get_track_metadata.return_value = {'id': 'spotify_id_123', 'title': 'Test Song'}
     mock_db_handler.get_song_by_source.return_value = {'id': 1, 'title': 'Test Song'} # Already in DB
 
@@ -105,19 +131,26 @@ def test_ingest_from_spotify_already_exists(mock_os_remove, mock_os_exists, mock
     mock_youtube_client.search_videos.assert_not_called()
     mock_youtube_client.download_audio.assert_not_called()
 
-@patch('backend.services.song_ingester.load_audio')
-@patch('os.path.exists')
-@patch('os.remove')
-def test_ingest_from_spotify_spotify_failure(mock_os_remove, mock_os_exists, mock_load_audio, song_ingester, mock_spotify_client):
+def test_ingest_from_spotify_already_exists_by_isrc(patched_io, song_ingester, mock_db_handler, mock_spotify_client, mock_youtube_client):
+    mock_spotify_client.get_track_metadata.return_value = {'id': 'spotify_id_456', 'title': 'Test Song', 'artist': 'TA', 'isrc': 'USRC17607839'}
+    mock_db_handler.get_song_by_source.return_value = None # Not stored under this Spotify ID
+    mock_db_handler.get_song_by_isrc.return_value = {'id': 3, 'title': 'Test Song'} # Same recording already ingested
+
+    result = song_ingester.ingest_from_spotify('some_spotify_url')
+
+    assert result == {'success': True, 'song_id': 3, 'status': 'already_exists'}
+    mock_db_handler.get_song_by_isrc.assert_called_once_with('USRC17607839')
+    mock_youtube_client.search_videos.assert_not_called()
+    mock_youtube_client.download_audio.assert_not_called()
+    patched_io.load_audio.assert_not_called()
+
+def test_ingest_from_spotify_spotify_failure(patched_io, song_ingester, mock_spotify_client):
     mock_spotify_client.get_track_metadata.return_value = None
     result = song_ingester.ingest_from_spotify('some_spotify_url')
     assert result['success'] is False
     assert 'Could not fetch track from Spotify' in result['error']
 
-@patch('backend.services.song_ingester.load_audio')
-@patch('os.path.exists')
-@patch('os.remove')
-def test_ingest_from_spotify_youtube_search_failure(mock_os_remove, mock_os_exists, mock_load_audio, song_ingester, mock_db_handler, mock_spotify_client, mock_youtube_client):
+def test_ingest_from_spotify_youtube_search_failure(patched_io, song_ingester, mock_db_handler, mock_spotify_client, mock_youtube_client):
     mock_spotify_client.get_track_metadata.return_value = {'id': 'spotify_id_123', 'title': 'TS', 'artist': 'TA'}
     mock_db_handler.get_song_by_source.return_value = None
     mock_youtube_client.search_videos.return_value = [] # No YouTube results
@@ -126,10 +159,7 @@ def test_ingest_from_spotify_youtube_search_failure(mock_os_remove, mock_os_exis
     assert result['success'] is False
     assert 'No matching YouTube video found' in result['error']
 
-@patch('backend.services.song_ingester.load_audio')
-@patch('os.path.exists')
-@patch('os.remove')
-def test_ingest_from_spotify_download_failure(mock_os_remove, mock_os_exists, mock_load_audio, song_ingester, mock_db_handler, mock_spotify_client, mock_youtube_client):
+def test_ingest_from_spotify_download_failure(patched_io, song_ingester, mock_db_handler, mock_spotify_client, mock_youtube_client):
     mock_spotify_client.get_track_metadata.return_value = {'id': 'spotify_id_123', 'title': 'TS', 'artist': 'TA'}
     mock_db_handler.get_song_by_source.return_value = None
     mock_youtube_client.search_videos.return_value = [{'id': 'youtube_id_789'}]
@@ -139,61 +169,76 @@ def test_ingest_from_spotify_download_failure(mock_os_remove, mock_os_exists, mo
     assert result['success'] is False
     assert 'Failed to download audio from YouTube' in result['error']
 
-@patch('backend.services.song_ingester.load_audio')
-@patch('os.path.exists')
-@patch('os.remove')
-def test_ingest_from_spotify_fingerprint_failure(mock_os_remove, mock_os_exists, mock_load_audio, song_ingester, mock_db_handler, mock_spotify_client, mock_youtube_client, mock_fingerprinter):
+def test_ingest_from_spotify_fingerprint_failure(patched_io, song_ingester, mock_db_handler, mock_spotify_client, mock_youtube_client, mock_fingerprinter):
     mock_spotify_client.get_track_metadata.return_value = {'id': 'spotify_id_123', 'title': 'TS', 'artist': 'TA'}
     mock_db_handler.get_song_by_source.return_value = None
     mock_youtube_client.search_videos.return_value = [{'id': 'youtube_id_789'}]
     mock_youtube_client.download_audio.return_value = ('/tmp/audio.mp3', {})
-    mock_os_exists.return_value = True
-    mock_load_audio.return_value = (MagicMock(), 11025)
-    mock_fingerprinter.generate_fingerprints.return_value = [] # Empty list = failure
+    patched_io.exists.return_value = True
+    patched_io.load_audio.return_value = (MagicMock(), 11025)
+    mock_fingerprinter.generate_fingerprint_arrays.return_value = iter([]) # No chunks = failure
 
     result = song_ingester.ingest_from_spotify('some_spotify_url')
     assert result['success'] is False
     assert 'Failed to generate fingerprints' in result['error']
-    mock_os_remove.assert_called_once_with('/tmp/audio.mp3') # Ensure cleanup still happens
+    patched_io.remove.assert_called_once_with('/tmp/audio.mp3') # Ensure cleanup still happens
 
-@patch('backend.services.song_ingester.load_audio')
-@patch('os.path.exists')
-@patch('os.remove')
-def test_ingest_from_spotify_db_add_failure(mock_os_remove, mock_os_exists, mock_load_audio, song_ingester, mock_db_handler, mock_spotify_client, mock_youtube_client, mock_fingerprinter):
+def test_ingest_from_spotify_db_add_failure(patched_io, make_fingerprints, song_ingester, mock_db_handler, mock_spotify_client, mock_youtube_client, mock_fingerprinter):
     mock_spotify_client.get_track_metadata.return_value = {'id': 'spotify_id_123', 'title': 'TS', 'artist': 'TA'}
     mock_db_handler.get_song_by_source.return_value = None
     mock_youtube_client.search_videos.return_value = [{'id': 'youtube_id_789'}]
     mock_youtube_client.download_audio.return_value = ('/tmp/audio.mp3', {})
-    mock_os_exists.return_value = True
-    mock_load_audio.return_value = (MagicMock(), 11025)
-    mock_fingerprinter.generate_fingerprints.return_value = [Fingerprint(hash='fp1', song_id=0, offset=100, timestamp=0.1)]
+    patched_io.exists.return_value = True
+    patched_io.load_audio.return_value = (MagicMock(), 11025)
+    fingerprints = make_fingerprints(1)
+    mock_fingerprinter.generate_fingerprint_arrays.return_value = iter([(fingerprints.hash, fingerprints.offset)])
     mock_db_handler.add_song.return_value = None # DB add_song fails
 
     result = song_ingester.ingest_from_spotify('some_spotify_url')
     assert result['success'] is False
     assert 'Failed to add song to the database' in result['error']
-    mock_os_remove.assert_called_once_with('/tmp/audio.mp3')
+    patched_io.remove.assert_called_once_with('/tmp/audio.mp3')
+
+# --- Tests for ingest_batch ---
+@patch('backend.services.song_ingester.ProcessPoolExecutor', ThreadPoolExecutor) # Keep mocks in-process
+@patch('backend.services.song_ingester._fingerprint_file')
+def test_ingest_batch(mock_fingerprint_file, patched_io, mock_chunk, song_ingester, mock_db_handler, mock_spotify_client, mock_youtube_client):
+    mock_spotify_client.get_track_metadata.side_effect = lambda url: None if url == 'bad_url' else {'id': url, 'title': 'TS', 'artist': 'TA'}
+    mock_db_handler.get_song_by_source.side_effect = lambda source, source_id: {'id': 7} if source_id == 'known_url' else None
+    mock_youtube_client.search_videos.return_value = [{'id': 'youtube_id_789'}]
+    mock_youtube_client.download_audio.return_value = ('/tmp/audio.mp3', {})
+    patched_io.exists.return_value = True
+    mock_fingerprint_file.return_value = [mock_chunk]
+    mock_db_handler.add_song.return_value = 1
+
+    progress = []
+    results = song_ingester.ingest_batch(['new_url', 'bad_url', 'known_url'], max_download_workers=2, max_fingerprint_workers=1, progress_callback=progress.append)
+
+    assert results[0]['success'] is True and results[0]['status'] == 'added'
+    assert results[1]['success'] is False
+    assert results[2] == {'success': True, 'song_id': 7, 'status': 'already_exists'}
+    assert progress == [1, 2, 3]
+    mock_db_handler.add_song.assert_called_once()
+    _assert_streamed(mock_db_handler.add_fingerprints_bulk, 1, mock_chunk)
+    patched_io.remove.assert_called_once_with('/tmp/audio.mp3')
 
 # Similar tests would be needed for ingest_from_youtube
 # For brevity, only one success case for ingest_from_youtube is shown here.
 
-@patch('backend.services.song_ingester.load_audio') # Assuming Fingerprinter uses load_audio internally if path is passed
-@patch('os.path.exists')
-@patch('os.remove')
-def test_ingest_from_youtube_success(mock_os_remove, mock_os_exists, mock_load_audio, song_ingester, mock_db_handler, mock_youtube_client, mock_fingerprinter):
+def test_ingest_from_youtube_success(patched_io, make_fingerprints, song_ingester, mock_db_handler, mock_youtube_client, mock_fingerprinter):
     video_id = 'youtube_id_123'
     mock_db_handler.get_song_by_source.return_value = None # Not in DB
     mock_youtube_client.download_audio.return_value = ('/tmp/yt_audio.mp3', {
         'title': 'YouTube Song', 'uploader': 'YT Uploader', 'duration': 200,
         'thumbnail': 'yt_thumb.jpg'
     })
-    mock_os_exists.return_value = True
+    patched_io.exists.return_value = True
     # If fingerprinter.generate_fingerprints takes a path, it might call load_audio itself.
     # If it takes audio_data, then load_audio needs to be mocked before fingerprinter call.
     # The current song_ingester.py calls: `fingerprints = self.fingerprinter.generate_fingerprints(file_path)`
     # So, Fingerprinter's generate_fingerprints method needs to handle the path, or load_audio needs to be part of its mock or this test setup.
     # For this test, let's assume Fingerprinter.generate_fingerprints directly returns fingerprints when given a path.
-    mock_fingerprints_yt = [Fingerprint(hash='yt_fp1', song_id=0, offset=50, timestamp=0.05)]
+    mock_fingerprints_yt = make_fingerprints(1, first_hash=321)
     mock_fingerprinter.generate_fingerprints.return_value = mock_fingerprints_yt
     mock_db_handler.add_song.return_value = 2 # New song_id
 
@@ -203,6 +248,32 @@ def test_ingest_from_youtube_success(mock_os_remove, mock_os_exists, mock_load_a
     assert result['song_id'] == 2
     assert result['status'] == 'added'
     mock_db_handler.add_song.assert_called_once()
-    assert mock_fingerprints_yt[0].song_id == 2 # Check song_id propagation
-    mock_db_handler.add_fingerprints.assert_called_once_with(2, mock_fingerprints_yt)
-    mock_os_remove.assert_called_once_with('/tmp/yt_audio.mp3')
+    mock_db_handler.add_fingerprints.assert_called_once()
+    song_id, fingerprints = mock_db_handler.add_fingerprints.call_args.args
+    assert song_id == 2 and fingerprints is mock_fingerprints_yt
+    patched_io.remove.assert_called_once_with('/tmp/yt_audio.mp3')
+
+def test_refingerprint_song(patched_io, mock_chunk, song_ingester, mock_db_handler, mock_youtube_client, mock_fingerprinter):
+    mock_youtube_client.download_audio.return_value = ('/tmp/refp_audio.mp3', {})
+    patched_io.exists.return_value = True
+    patched_io.load_audio.return_value = (MagicMock(), 11025)
+    mock_fingerprinter.generate_fingerprint_arrays.return_value = iter([mock_chunk])
+
+    result = song_ingester.refingerprint_song({'id': 5, 'source_type': 'spotify', 'source_id': 'sp', 'youtube_id': 'yt_5'})
+
+    assert result == {'success': True, 'song_id': 5, 'status': 'refingerprinted'}
+    mock_youtube_client.download_audio.assert_called_once_with('yt_5')
+    assert _assert_streamed(mock_db_handler.replace_fingerprints, 5, mock_chunk) == [FINGERPRINT_VERSION]
+    patched_io.remove.assert_called_once_with('/tmp/refp_audio.mp3')
+
+def test_refingerprint_song_keeps_fingerprints_on_failure(patched_io, song_ingester, mock_db_handler, mock_youtube_client, mock_fingerprinter):
+    mock_youtube_client.download_audio.return_value = ('/tmp/refp_audio.mp3', {})
+    patched_io.exists.return_value = True
+    patched_io.load_audio.return_value = (MagicMock(), 11025)
+    mock_fingerprinter.generate_fingerprint_arrays.return_value = iter([]) # No chunks = failure
+
+    result = song_ingester.refingerprint_song({'id': 5, 'source_type': 'youtube', 'source_id': 'yt_5', 'youtube_id': None})
+
+    assert result['success'] is False
+    mock_db_handler.replace_fingerprints.assert_not_called()
+    patched_io.remove.assert_called_once_with('/tmp/refp_audio.mp3')